@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Time and peak memory of every phase of loading an ncdu export and showing it:
+parse, tree build, aggregation, sort, Treeview populate and owner switch.
+The Treeview is a stub, no display is needed. The results are written as json,
+and compared with a previous results file to catch the regressions.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from file_info import FileInfo, FileUtils
+from ncdu_parser import NcduJsonParser
+from gen_ncdu_export import ExportGenerator, SIZE_DISTRIBUTIONS, FIRST_UID
+
+
+class NullHandler:
+    """ NcduJsonParser handler which only counts the entries, to time the parsing alone """
+    def __init__(self):
+        self.count = 0
+
+    def start_dir(self, info: dict):
+        self.count += 1
+
+    def add_file(self, info: dict):
+        self.count += 1
+
+    def end_dir(self):
+        pass
+
+
+class StubTreeview:
+    """ The ttk.Treeview methods used by the Window rows logic, rows kept in dicts """
+    def __init__(self):
+        self.children = {"": []}
+        self.parents = {}
+        self.values = {}
+        self.counter = 0
+
+    def insert(self, parent, index, iid = None, text = "", values = (), tags = ()):
+        if iid is None:
+            self.counter += 1
+            iid = "I{}".format(self.counter)
+        self.children[iid] = []
+        self.parents[iid] = parent
+        self.values[iid] = {"text": text, "values": values, "tags": tags}
+        if index == "end":
+            self.children[parent].append(iid)
+        else:
+            self.children[parent].insert(index, iid)
+        return iid
+
+    def delete(self, *iids):
+        for iid in iids:
+            self.delete(*self.children[iid])
+            self.children[self.parents[iid]].remove(iid)
+            del self.children[iid], self.parents[iid], self.values[iid]
+
+    def get_children(self, iid = ""):
+        return tuple(self.children[iid])
+
+    def item(self, iid, option = None, **kw):
+        if option is not None:
+            return self.values[iid][option]
+        self.values[iid].update(kw)
+
+    def move(self, iid, parent, index):
+        self.children[self.parents[iid]].remove(iid)
+        self.children[parent].insert(index, iid)
+        self.parents[iid] = parent
+
+    def parent(self, iid):
+        return self.parents[iid]
+
+    def heading(self, *args, **kw):
+        pass
+
+
+def make_stub_window(root_file: FileInfo, max_children_rows: int):
+    """
+    A Window without Tk, only its rows logic (populate_data, expand_row, refresh_rows) is used
+    """
+    from window import Window
+    window = Window.__new__(Window)
+    window.const_multiplier = 1.0/1024/1024
+    window.logger = logging.getLogger('PYNCDU')
+    window.diff = None
+    window.sort_by = "size"
+    window.tree = StubTreeview()
+    window.max_children_rows = max_children_rows
+    window.nodes = {}
+    window.loaded_children = {}
+    window.selected_item = None
+    window.root_file = root_file
+    return window
+
+
+def read_proc_status(field: str) -> int:
+    """ Returns a memory field of /proc/self/status in bytes, None if not available """
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss() -> bool:
+    """ Linux only, reset the peak RSS (VmHWM) so it is measured per phase """
+    try:
+        with open("/proc/self/clear_refs", "w") as fh:
+            fh.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def measure(results: dict, phase: str, function):
+    """
+    Run function, save its time and memory in results["phases"][phase]
+    @return: what function returns
+    """
+    per_phase_peak = reset_peak_rss()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    ret = function()
+    seconds = time.perf_counter() - start
+    cpu_seconds = time.process_time() - cpu_start
+    peak_rss = read_proc_status("VmHWM")
+    if peak_rss is None or not per_phase_peak:
+        # process peak so far, ru_maxrss is in KB on Linux
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    rss = read_proc_status("VmRSS")
+    results["phases"][phase] = {"seconds": round(seconds, 4), "cpu_seconds": round(cpu_seconds, 4),
+            "peak_rss_mb": round(peak_rss / 1024 / 1024, 1),
+            "rss_mb": None if rss is None else round(rss / 1024 / 1024, 1)}
+    print("{:12s} {:9.3f}s  peak RSS {:8.1f} MB".format(phase, seconds, peak_rss / 1024 / 1024))
+    return ret
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Returns the phases slower than baseline by more than threshold (0.2 means 20%)
+    """
+    regressions = []
+    for phase, data in results["phases"].items():
+        old = baseline.get("phases", {}).get(phase)
+        # too short phases are only noise, the export generation is not our code
+        if not old or old["seconds"] < 0.01 or phase == "generate":
+            continue
+        ratio = data["seconds"] / old["seconds"]
+        if ratio > 1 + threshold:
+            regressions.append("{}: {:.3f}s -> {:.3f}s (+{:.0f}%)".format(
+                    phase, old["seconds"], data["seconds"], (ratio - 1) * 100))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--export", help = "ncdu export to load, if missing one is generated")
+    parser.add_argument("--entries", type = int, default = 100000, help = "generated entries, 10k .. 50M")
+    parser.add_argument("--fanout", type = int, default = 20)
+    parser.add_argument("--depth", type = int, default = 8)
+    parser.add_argument("--owners", type = int, default = 10)
+    parser.add_argument("--size-dist", choices = SIZE_DISTRIBUTIONS, default = "lognormal")
+    parser.add_argument("--seed", type = int, default = 1)
+    parser.add_argument("--rows", type = int, default = 1000, help = "MAX_CHILDREN_ROWS of the window")
+    parser.add_argument("--expand", type = int, default = 100, help = "folders rows expanded in the populate phase")
+    parser.add_argument("--output", help = "write the results as json to this file")
+    parser.add_argument("--baseline", help = "previous results json, the slower phases are reported")
+    parser.add_argument("--threshold", type = float, default = 0.2,
+            help = "allowed slowdown against the baseline, 0.2 means 20%%")
+    args = parser.parse_args()
+
+    params = {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "threshold")}
+    results = {"params": params, "python": platform.python_version(),
+               "machine": platform.machine(), "phases": {}}
+    # fake usernames, so the owners are known without the system users database
+    FileUtils.cache_dict_uid_to_username.update(
+            {FIRST_UID + i: "user{}".format(i) for i in range(args.owners)})
+    tmp_file = None
+    export = args.export
+    if export is None:
+        fd, tmp_file = tempfile.mkstemp(suffix = ".json")
+        export = tmp_file
+        generator = ExportGenerator(args.entries, args.fanout, args.depth, args.owners,
+                args.size_dist, seed = args.seed)
+        with os.fdopen(fd, "w", encoding = "utf-8") as fh:
+            measure(results, "generate", lambda: generator.write(fh))
+    try:
+        results["export_bytes"] = os.path.getsize(export)
+        handler = NullHandler()
+        measure(results, "parse", lambda: NcduJsonParser(handler).parse_file(export))
+        results["entries"] = handler.count
+        root_file = measure(results, "load", lambda: FileUtils.load_json_data(export))
+    finally:
+        if tmp_file:
+            os.remove(tmp_file)
+    # the tree build alone, parse + build - parse
+    results["phases"]["build"] = {"seconds": round(
+            results["phases"]["load"]["seconds"] - results["phases"]["parse"]["seconds"], 4)}
+    tree = root_file.tree
+
+    def aggregate():
+        tree.invalidate_hierarchy_sizes()
+        tree.get_hierarchy_sizes()
+    measure(results, "aggregation", aggregate)
+    measure(results, "sort", lambda: root_file.sort_children_by_size_group_by_selected_owner(0))
+
+    window = make_stub_window(root_file, args.rows)
+    def populate():
+        root_file.set_selected_owner("*")
+        window.populate_data(root_file, "")
+        # expand the biggest folders, breadth first
+        to_expand = [root_file.path]
+        expanded = 0
+        while to_expand and expanded < args.expand:
+            iid = to_expand.pop(0)
+            window.expand_row(iid)
+            expanded += 1
+            to_expand.extend(c for c in window.tree.get_children(iid) if c in window.nodes)
+    measure(results, "populate", populate)
+
+    def switch_owner():
+        root_file.set_selected_owner("user0")
+        window.refresh_rows(root_file.path)
+    measure(results, "owner_switch", switch_owner)
+    results["tree_bytes"] = tree.get_memory_size()
+    results["rows"] = len(window.tree.parents)
+
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent = 2)
+    if args.baseline:
+        with open(args.baseline) as fh:
+            regressions = compare(results, json.load(fh), args.threshold)
+        for r in regressions:
+            print("REGRESSION " + r)
+        if regressions:
+            sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Compare the native parallel scanner with the ncdu command on a generated folders tree.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from native_scan import NativeScanner
+
+
+def generate_tree(path: str, depth: int, fanout: int, files_per_dir: int, file_size: int) -> int:
+    """
+    Create depth levels of fanout folders, each with files_per_dir files of file_size bytes
+    @return: number of created entries
+    """
+    count = 0
+    dirs = [path]
+    for level in range(depth):
+        next_dirs = []
+        for d in dirs:
+            for i in range(fanout):
+                sub = os.path.join(d, "d{}_{}".format(level, i))
+                os.makedirs(sub, exist_ok = True)
+                next_dirs.append(sub)
+                count += 1
+                for j in range(files_per_dir):
+                    with open(os.path.join(sub, "f{}".format(j)), "wb") as fh:
+                        if file_size:
+                            fh.write(b"x" * file_size)
+                    count += 1
+        dirs = next_dirs
+    return count
+
+
+def time_it(function) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("--path", help = "Tree to scan, if missing one is generated in a temp folder")
+    parser.add_argument("--depth", type = int, default = 4)
+    parser.add_argument("--fanout", type = int, default = 10)
+    parser.add_argument("--files", type = int, default = 20, help = "files per folder")
+    parser.add_argument("--file-size", type = int, default = 0)
+    parser.add_argument("--threads", default = "1,4,8,16,32", help = "comma separated thread counts")
+    parser.add_argument("--repeat", type = int, default = 3, help = "best of N runs")
+    parser.add_argument("--output", help = "write the results as json to this file")
+    args = parser.parse_args()
+
+    tmp_dir = None
+    path = args.path
+    if path is None:
+        tmp_dir = path = os.path.join(os.environ.get("TMPDIR", "/tmp"), "pyncdu_bench_scan")
+        shutil.rmtree(path, ignore_errors = True)
+        os.makedirs(path)
+        print("Generated {} entries in {}".format(
+                generate_tree(path, args.depth, args.fanout, args.files, args.file_size), path))
+    results = {"path": path, "runs": {}}
+    try:
+        for threads in [int(t) for t in args.threads.split(",")]:
+            entries = []
+            def scan():
+                tree, _ = NativeScanner(threads).scan(path)
+                entries.append(len(tree))
+            seconds = min(time_it(scan) for _ in range(args.repeat))
+            results["runs"]["native-{}".format(threads)] = {"seconds": seconds, "entries": entries[-1]}
+            print("native {:2d} threads: {:.3f}s, {} entries".format(threads, seconds, entries[-1]))
+        if shutil.which("ncdu"):
+            cmd = ["ncdu", "-0", "-x", "-o", os.devnull, path]
+            seconds = min(time_it(lambda: subprocess.run(cmd, check = True)) for _ in range(args.repeat))
+            results["runs"]["ncdu"] = {"seconds": seconds}
+            print("ncdu            : {:.3f}s".format(seconds))
+        else:
+            print("ncdu not found, skipped")
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors = True)
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent = 2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Deterministic generator of ncdu json exports ('ncdu -e -o ...' format), for the benchmarks.
+The same arguments and seed always give the same file. It is written while generated,
+so even 50M entries need no memory.
+"""
+import argparse
+import json
+import random
+import sys
+
+SIZE_DISTRIBUTIONS = ("uniform", "lognormal", "pareto")
+FIRST_UID = 1000
+EXTENSIONS = ("txt", "py", "log", "jpg", "mp4", "tar.gz", "parquet", "o")
+
+
+class ExportGenerator:
+    """
+    Folders have on average fanout entries, dir_ratio of them are folders (until max depth).
+    When the first top folder is full, new ones are added under the root until there are enough entries.
+    Owners are the uids FIRST_UID .. FIRST_UID + owners - 1.
+    """
+    def __init__(self, entries: int, fanout: int = 20, depth: int = 8, owners: int = 10,
+                 size_dist: str = "lognormal", mean_size: int = 64 * 1024, dir_ratio: float = 0.1,
+                 seed: int = 1):
+        self.entries = entries
+        self.fanout = fanout
+        self.depth = depth
+        self.owners = owners
+        self.size_dist = size_dist
+        self.mean_size = mean_size
+        self.dir_ratio = dir_ratio
+        self.rng = random.Random(seed)
+        self.count = 0
+
+    def get_size(self) -> int:
+        rng = self.rng
+        if self.size_dist == "uniform":
+            return rng.randint(0, 2 * self.mean_size)
+        if self.size_dist == "pareto":
+            # alpha 1.5 => mean 3 * scale
+            return int(rng.paretovariate(1.5) * self.mean_size / 3)
+        # sigma 2 => mean exp(mu + 2)
+        return int(rng.lognormvariate(0, 2) * self.mean_size / 7.389)
+
+    def get_entry(self, name: str, is_dir: bool) -> str:
+        rng = self.rng
+        asize = 4096 if is_dir else self.get_size()
+        self.count += 1
+        info = {"name": name, "asize": asize, "dsize": (asize + 4095) // 4096 * 4096,
+                "ino": self.count, "uid": FIRST_UID + rng.randrange(self.owners), "gid": 100,
+                "mode": 16877 if is_dir else 33188, "mtime": 1500000000 + rng.randrange(300000000)}
+        return json.dumps(info)
+
+    def write(self, fh) -> int:
+        """
+        Write the export to the text file object fh
+        @return: number of entries
+        """
+        rng = self.rng
+        fh.write('[1,2,{"progname":"ncdu","progver":"1.15.1","timestamp":1700000000}')
+        fh.write(",\n[" + self.get_entry("/bench", True))
+        top = 0
+        while self.count < self.entries:
+            # explicit stack of the number of entries left in every opened folder
+            fh.write(",\n[" + self.get_entry("top{}".format(top), True))
+            top += 1
+            left = [rng.randint(1, 2 * self.fanout)]
+            while left:
+                if left[-1] == 0 or self.count >= self.entries:
+                    fh.write("]")
+                    left.pop()
+                    continue
+                left[-1] -= 1
+                if len(left) < self.depth and rng.random() < self.dir_ratio:
+                    fh.write(",\n[" + self.get_entry("d{}".format(self.count), True))
+                    left.append(rng.randint(1, 2 * self.fanout))
+                else:
+                    fh.write(",\n" + self.get_entry("f{}.{}".format(
+                            self.count, rng.choice(EXTENSIONS)), False))
+        fh.write("]]\n")
+        return self.count
+
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__)
+    parser.add_argument("entries", type = int, help = "number of files and folders, e.g. 10000 .. 50000000")
+    parser.add_argument("output", help = "export file path, '-' for stdout")
+    parser.add_argument("--fanout", type = int, default = 20, help = "average entries per folder")
+    parser.add_argument("--depth", type = int, default = 8, help = "max folders depth")
+    parser.add_argument("--owners", type = int, default = 10, help = "number of distinct uids")
+    parser.add_argument("--size-dist", choices = SIZE_DISTRIBUTIONS, default = "lognormal")
+    parser.add_argument("--mean-size", type = int, default = 64 * 1024, help = "average file size")
+    parser.add_argument("--dir-ratio", type = float, default = 0.1, help = "probability of an entry to be a folder")
+    parser.add_argument("--seed", type = int, default = 1)
+    args = parser.parse_args()
+    generator = ExportGenerator(args.entries, args.fanout, args.depth, args.owners, args.size_dist,
+            args.mean_size, args.dir_ratio, args.seed)
+    if args.output == "-":
+        generator.write(sys.stdout)
+    else:
+        with open(args.output, "w", encoding = "utf-8") as fh:
+            generator.write(fh)
+
+
+if __name__ == "__main__":
+    main()
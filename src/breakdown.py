@@ -0,0 +1,313 @@
+"""
+Size breakdowns of a files tree: by file extension, by modification age and by owner x age.
+"""
+import bisect
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    # optional, the same results are computed with plain loops, only slower
+    np = None
+
+from file_info import FileUtils
+from file_tree import FileTree, NO_NODE, FLAG_DIR, FLAG_SUMMARY
+from profiler import Profiler
+
+DAY = 24 * 3600
+
+
+class Breakdown:
+    """
+    Group by over the files (not the folders) below a folder, on the tree arrays as they are:
+    with NumPy every group by is a few vectorized passes (np.unique + np.bincount),
+    there is no walk of the tree and no Python object per entry.
+    Every breakdown is a list of (key, total size on disk, files count).
+    The summaries of collapsed folders (see CollapsingTreeBuilder) are not files: their entries
+    have no name or age, they are one COLLAPSED group, counted with the entries they stand for.
+    """
+    # age buckets, (max age in days, label), the last one has no limit
+    AGE_BUCKETS = ((30, "< 30 days"), (90, "30-90 days"), (365, "90 days-1 year"),
+                   (3 * 365, "1-3 years"), (None, "> 3 years"))
+    UNKNOWN_AGE = "unknown"
+    COLLAPSED = "(collapsed)"
+    NO_EXTENSION = "(none)"
+    LONG_EXTENSION = "(long)"
+    # longer extensions are grouped together, NumPy packs an extension in 8 bytes
+    max_extension_len = 8
+
+    def __init__(self, tree: FileTree, root: int, uids: frozenset = None, now: float = None,
+                 use_numpy: bool = True):
+        """
+        @param: root - only the files below this folder
+        @param: uids - only the files owned by these uids, None means all owners
+        @param: now - the ages are computed from this time, default the current time
+        @param: use_numpy - if False, or NumPy is not installed, use the plain loops
+        """
+        self.tree = tree
+        self.root = root
+        self.uids = uids
+        self.now = time.time() if now is None else now
+        self.np = np if use_numpy else None
+        self.age_labels = [label for _, label in self.AGE_BUCKETS] + [self.UNKNOWN_AGE]
+        self.files = None
+        self.age_buckets = None
+        self.collapsed = None
+
+    def get_files(self):
+        """
+        Returns the selected files indexes, a NumPy array or a list
+        """
+        if self.files is not None:
+            return self.files
+        tree = self.tree
+        # the check is needed only for a sub folder or after a rescan
+        all_attached = tree.parent[self.root] == NO_NODE and not tree.has_detached()
+        if self.np is not None:
+            n = len(tree)
+            mask = (self.np.frombuffer(tree.flags, self.np.uint8) & (FLAG_DIR | FLAG_SUMMARY)) == 0
+            if not all_attached:
+                mask &= self.get_below_root_mask()
+            if self.uids is not None:
+                mask &= self.np.isin(self.np.frombuffer(tree.uid, self.np.uint32)[:n], list(self.uids))
+            self.files = self.np.flatnonzero(mask)
+        else:
+            below = None if all_attached else self.get_below_root_mask()
+            flags = tree.flags
+            uid = tree.uid
+            uids = self.uids
+            self.files = [i for i in range(len(tree)) if not flags[i] & (FLAG_DIR | FLAG_SUMMARY)
+                          and (below is None or below[i]) and (uids is None or uid[i] in uids)]
+        return self.files
+
+    def get_collapsed(self) -> list:
+        """
+        Returns (uid, size, entries count) of the selected summaries, the counts come from tree.collapsed
+        """
+        if self.collapsed is not None:
+            return self.collapsed
+        tree = self.tree
+        parent = tree.parent
+        flags = tree.flags
+        uid = tree.uid
+        self.collapsed = []
+        # one summary per owner after the children of a collapsed folder, a few entries
+        for idx, (_, _, counts) in tree.collapsed.items():
+            ancestor = idx
+            while ancestor != self.root and ancestor != NO_NODE:
+                ancestor = parent[ancestor]
+            if ancestor == NO_NODE:
+                continue
+            for child in tree.iter_children(idx):
+                if flags[child] & FLAG_SUMMARY and (self.uids is None or uid[child] in self.uids):
+                    self.collapsed.append((uid[child], tree.dsize[child], counts.get(uid[child], 0)))
+        return self.collapsed
+
+    def add_collapsed(self, groups: dict, key) -> None:
+        """
+        Add the selected summaries to the group key of groups, key -> [size, count]
+        """
+        for _, size, count in self.get_collapsed():
+            group = groups.setdefault(key, [0, 0])
+            group[0] += size
+            group[1] += count
+
+    def get_below_root_mask(self):
+        """
+        True for the entries below root.
+        With NumPy by pointer jumping: every pass checks twice more ancestors, so ~log2(depth) passes.
+        Else one forward pass, see FileTree.fold_down.
+        """
+        tree = self.tree
+        n = len(tree)
+        if self.np is not None:
+            np = self.np
+            parent = np.frombuffer(tree.parent, np.int32).astype(np.int64)
+            # index n is a sentinel, the ancestor of the entries without parent
+            hop = np.append(np.where(parent < 0, n, parent), n)
+            below = np.zeros(n + 1, dtype = bool)
+            below[self.root] = True
+            while True:
+                below |= below[hop]
+                next_hop = hop[hop]
+                if np.array_equal(next_hop, hop):
+                    return below[:n]
+                hop = next_hop
+        below = bytearray(n)
+        below[self.root] = 1
+        tree.fold_down(below, int.__or__, self.root)
+        return below
+
+    @classmethod
+    def sorted_groups(cls, groups: dict) -> list:
+        """ dict key -> [size, count] to a list of (key, size, count), biggest first """
+        return sorted(((key, size, count) for key, (size, count) in groups.items()),
+                      key = lambda g: g[1], reverse = True)
+
+    def by_extension(self) -> list:
+        """
+        Returns (extension, size, count), biggest first. The extension is lower case (ASCII),
+        without the dot, the names starting with a dot (hidden files) have no extension.
+        """
+        with Profiler.span("breakdown_extension"):
+            if self.np is not None:
+                return self.by_extension_numpy()
+            tree = self.tree
+            names = tree.names
+            name_offset = tree.name_offset
+            dsize = tree.dsize
+            groups = {}
+            for i in self.get_files():
+                name = bytes(names[name_offset[i]:name_offset[i + 1]])
+                dot = name.rfind(b".")
+                if dot <= 0 or dot == len(name) - 1:
+                    ext = self.NO_EXTENSION
+                elif len(name) - dot - 1 > self.max_extension_len:
+                    ext = self.LONG_EXTENSION
+                else:
+                    ext = name[dot + 1:].lower().decode("utf-8", "surrogateescape")
+                group = groups.setdefault(ext, [0, 0])
+                group[0] += dsize[i]
+                group[1] += 1
+            self.add_collapsed(groups, self.COLLAPSED)
+            return self.sorted_groups(groups)
+
+    def by_extension_numpy(self) -> list:
+        """ by_extension with NumPy, the extensions are grouped as integers, not strings """
+        np = self.np
+        tree = self.tree
+        files = self.get_files()
+        buf = np.frombuffer(tree.names, np.uint8)
+        offsets = np.frombuffer(tree.name_offset, np.uint64).astype(np.int64)
+        starts = offsets[files]
+        ends = offsets[files + 1]
+        # the last dot of every name
+        dots = np.flatnonzero(buf == ord("."))
+        last = np.searchsorted(dots, ends) - 1
+        dot = np.where(last >= 0, dots[np.maximum(last, 0)], -1)
+        ext_len = ends - dot - 1
+        has_ext = (dot > starts) & (ext_len > 0)
+        is_long = has_ext & (ext_len > self.max_extension_len)
+        # the extension bytes packed in an integer, 0 means no extension, 1 a long one
+        width = self.max_extension_len
+        short = np.flatnonzero(has_ext & ~is_long)
+        # (files, 8) matrix of the bytes after the dot, the bytes after the name end are zeroed
+        padded = np.append(buf, np.zeros(width, np.uint8))
+        chars = padded[(dot[short] + 1)[:, None] + np.arange(width)]
+        chars[np.arange(width) >= ext_len[short][:, None]] = 0
+        upper = (chars >= ord("A")) & (chars <= ord("Z"))
+        chars[upper] += 32
+        keys = np.zeros(len(files), dtype = np.uint64)
+        keys[short] = np.ascontiguousarray(chars).view("<u8").ravel()
+        keys[is_long] = 1
+        unique_keys, inverse = np.unique(keys, return_inverse = True)
+        sizes = np.bincount(inverse, weights = np.frombuffer(tree.dsize, np.uint64)[files])
+        counts = np.bincount(inverse)
+        groups = {}
+        for key, size, count in zip(unique_keys.tolist(), sizes.tolist(), counts.tolist()):
+            if key == 0:
+                ext = self.NO_EXTENSION
+            elif key == 1:
+                ext = self.LONG_EXTENSION
+            else:
+                ext = key.to_bytes(8, "little").rstrip(b"\0").decode("utf-8", "surrogateescape")
+            groups[ext] = [int(size), count]
+        self.add_collapsed(groups, self.COLLAPSED)
+        return self.sorted_groups(groups)
+
+    def get_age_buckets(self):
+        """
+        Returns the age bucket (index in age_labels) of every selected file
+        """
+        if self.age_buckets is not None:
+            return self.age_buckets
+        files = self.get_files()
+        limits = [self.now - days * DAY for days, _ in self.AGE_BUCKETS[:-1]]
+        unknown = len(self.age_labels) - 1
+        if self.np is not None:
+            np = self.np
+            mtime = np.frombuffer(self.tree.mtime, np.uint32)[files].astype(np.float64)
+            # the limits are decreasing times, the newest files are in bucket 0
+            buckets = np.digitize(mtime, limits[::-1])
+            buckets = len(limits) - buckets
+            self.age_buckets = np.where(mtime == 0, unknown, buckets)
+            return self.age_buckets
+        mtime = self.tree.mtime
+        ordered = limits[::-1]
+        self.age_buckets = [unknown if mtime[i] == 0 else len(limits) - bisect.bisect_right(ordered, mtime[i])
+                for i in files]
+        return self.age_buckets
+
+    def by_age(self) -> list:
+        """
+        Returns (age label, size, count) in the AGE_BUCKETS order, then the unknown ages
+        """
+        with Profiler.span("breakdown_age"):
+            buckets = self.get_age_buckets()
+            sizes, counts = self.group_sizes(buckets, len(self.age_labels))
+            groups = [(label, size, count) for label, size, count in zip(self.age_labels, sizes, counts)
+                      if count]
+            collapsed = self.get_collapsed()
+            if collapsed:
+                groups.append((self.COLLAPSED, sum(c[1] for c in collapsed), sum(c[2] for c in collapsed)))
+            return groups
+
+    def by_owner_age(self) -> list:
+        """
+        Returns (owner, age label, size, count), by owner name then by age
+        """
+        with Profiler.span("breakdown_owner_age"):
+            files = self.get_files()
+            buckets = self.get_age_buckets()
+            labels_count = len(self.age_labels)
+            if self.np is not None:
+                np = self.np
+                # a few distinct uids, the key is the uid position * labels_count + bucket
+                tree_uids = sorted(self.tree.get_uids())
+                uid = np.frombuffer(self.tree.uid, np.uint32)[files]
+                keys = np.searchsorted(np.array(tree_uids, np.uint32), uid) * labels_count + buckets
+                sizes, counts = self.group_sizes(keys, len(tree_uids) * labels_count)
+                unique_keys = [u * labels_count + b for u in tree_uids for b in range(labels_count)]
+            else:
+                uid = self.tree.uid
+                keys = [uid[i] * labels_count + b for i, b in zip(files, buckets)]
+                unique_keys = sorted(set(keys))
+                position = {key: i for i, key in enumerate(unique_keys)}
+                sizes, counts = self.group_sizes([position[k] for k in keys], len(unique_keys))
+            # several uids may have the same username
+            groups = {}
+            for key, size, count in zip(unique_keys, sizes, counts):
+                if not count:
+                    continue
+                owner = FileUtils.get_owner_by_uid(key // labels_count)
+                group = groups.setdefault((owner, key % labels_count), [0, 0])
+                group[0] += size
+                group[1] += count
+            # after the age buckets of the owner
+            for uid, size, count in self.get_collapsed():
+                group = groups.setdefault((FileUtils.get_owner_by_uid(uid), labels_count), [0, 0])
+                group[0] += size
+                group[1] += count
+            labels = self.age_labels + [self.COLLAPSED]
+            return [(owner, labels[bucket], size, count)
+                    for (owner, bucket), (size, count) in sorted(groups.items())]
+
+    def group_sizes(self, groups, groups_count: int):
+        """
+        Returns the sizes and the counts of the selected files for every group 0 .. groups_count - 1
+        @param: groups - the group of every selected file
+        """
+        files = self.get_files()
+        if self.np is not None:
+            np = self.np
+            dsize = np.frombuffer(self.tree.dsize, np.uint64)[files]
+            sizes = np.bincount(groups, weights = dsize, minlength = groups_count)
+            counts = np.bincount(groups, minlength = groups_count)
+            return [int(s) for s in sizes.tolist()], counts.tolist()
+        dsize = self.tree.dsize
+        sizes = [0] * groups_count
+        counts = [0] * groups_count
+        for i, group in zip(files, groups):
+            sizes[group] += dsize[i]
+            counts[group] += 1
+        return sizes, counts
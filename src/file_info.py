@@ -0,0 +1,663 @@
+"""
+Files tree views and the files utilities (owners, loading, scanning), no GUI here.
+"""
+import concurrent.futures
+import configparser
+import datetime as dt
+from datetime import datetime
+import logging
+import multiprocessing
+import os
+import pwd
+import subprocess
+import tempfile
+import time
+
+import ncdu_parser
+from ncdu_parser import NcduInput, NcduJsonParser, NcduBinaryParser, NcduJsonWriter
+from native_scan import NativeScanner
+from file_tree import FileTree, FileTreeBuilder, CollapsingTreeBuilder, NO_NODE
+from tree_cache import TreeCache
+from scan_diff import ScanDiff
+from profiler import Profiler
+
+logger = logging.getLogger('PYNCDU')
+
+
+class FileInfo:
+    """
+    View over one entry of a FileTree, information about a specific file or folder.
+    It has attributes like:
+        - name
+        - asize - actuall size
+        - dsize - size on disk
+        - owner - who owns the file/folder
+        - path - rebuilt from the parents names
+    Nothing is stored here except the tree and the entry index,
+    so the views are created on demand and thrown away.
+    """
+    __slots__ = ("tree", "index")
+    # class static memebers
+    # keep track of all files owners, usernames are the keys
+    files_owners = {}
+    #selected owner, the files will be sorted by this
+    selected_owner = "*" # it means all
+
+    def __init__(self, tree: FileTree, index: int):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def name(self) -> str:
+        return self.tree.get_name(self.index)
+
+    @property
+    def asize(self) -> int:
+        return self.tree.asize[self.index]
+
+    @property
+    def dsize(self) -> int:
+        return self.tree.dsize[self.index]
+
+    @property
+    def uid(self) -> int:
+        return self.tree.uid[self.index]
+
+    @property
+    def owner(self) -> str:
+        # when look for owner we may ger exxcption like file was deleted 
+        # or it is a symlink to a file where we have no access
+        return FileUtils.get_owner_by_uid(self.uid)
+
+    @property
+    def path(self) -> str:
+        return self.tree.get_path(self.index)
+
+    @property
+    def parent_node(self) -> "FileInfo":
+        parent = self.tree.parent[self.index]
+        return None if parent == NO_NODE else FileInfo(self.tree, parent)
+
+    @property
+    def children(self) -> list:
+        return self.get_children()
+
+    def get_children(self, start: int = 0, end: int = None) -> list:
+        """
+        Returns the children from start to end (not included), in the current order
+        """
+        children = []
+        for i, child in enumerate(self.tree.iter_children(self.index)):
+            if end is not None and i >= end:
+                break
+            if i >= start:
+                children.append(FileInfo(self.tree, child))
+        return children
+
+    def get_children_count(self) -> int:
+        return self.tree.get_children_count(self.index)
+
+    def has_children(self) -> bool:
+        return self.tree.has_children(self.index)
+
+    def __repr__(self):
+        # the entry then all its content, in pre-order (see FileTree.iter_preorder)
+        return "\n".join("{}\n\tasize : {}\n\tdsize : {}\n\tpath : {}\n\towner : {}\n\t#children : {}".format(
+                node.name, node.asize, node.dsize, node.path, node.owner, node.get_children_count())
+                for node in (FileInfo(self.tree, idx) for idx in self.tree.iter_preorder(self.index)))
+
+    def invalidate_hierarchy_sizes(self):
+        """
+        Drop the cached hierarchy sizes, must be called every time the tree is changed.
+        """
+        self.tree.invalidate_hierarchy_sizes()
+
+    def update_hierarchy_sizes(self):
+        """
+        Single backward pass over the tree which caches the disk size of every entry
+        together with its sub tree. After this call get_hierarchy_size() is a simple lookup.
+        """
+        self.tree.get_hierarchy_sizes()
+
+    def get_hierarchy_size_by_owner(self, owner = "*"):
+        """
+        Returns the disk szie take by the respective file/folder and the children if it is a folder
+        for owner
+        """
+        return self.tree.get_hierarchy_sizes(FileUtils.get_uids_by_owner(owner))[self.index]
+
+    def get_hierarchy_size(self):
+        """
+        Returns the disk szie take by the respective file/folder and the children if it is a folder        
+        """
+        return self.tree.get_hierarchy_sizes()[self.index]
+    
+    # two views are equal when they show the same entry; there is no ordering,
+    # sort with an explicit key, e.g. key = FileInfo.get_hierarchy_size
+    def __eq__(self, other):
+        return isinstance(other, FileInfo) and self.tree is other.tree and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.tree), self.index))
+
+    def sort_children_by_size_group_by_selected_owner(self, hier_level = 0):
+        """
+        Sort the children of every folder below this one, biggest first, by the selected owner.
+        One pre-order traversal, no recursion, see FileTree.iter_preorder
+        @param: hier_level - only the top level (0) logs its progress
+        """
+        if hier_level == 0:
+            logger.info("Calculating hierarchy size for user {}...".format(self.get_selected_owner()))
+        with Profiler.span("sort"):
+            tree = self.tree
+            sizes = tree.get_hierarchy_sizes(FileUtils.get_uids_by_owner(self.get_selected_owner()))
+            first_child = tree.first_child # loop optimization
+            sort_children = tree.sort_children
+            for idx in tree.iter_preorder(self.index):
+                if first_child[idx] != NO_NODE:
+                    sort_children(idx, sizes)
+        if hier_level == 0:
+            logger.info("End calculating hierarchy size.")
+
+    def sort_children_by_selected_owner(self, top: int = None):
+        """
+        Sort only the direct children, biggest first, by the size owned by the selected owner.
+        @param: top - only the top biggest children are sorted first, None means all (see FileTree.sort_children)
+        """
+        with Profiler.span("sort"):
+            sizes = self.tree.get_hierarchy_sizes(FileUtils.get_uids_by_owner(self.get_selected_owner()))
+            self.tree.sort_children(self.index, sizes, top)
+
+    def set_selected_owner(self, owner: str):
+        self.__class__.selected_owner = owner
+
+    def get_selected_owner(self):
+        return self.__class__.selected_owner
+
+    def get_files_owners(self):
+        return sorted(self.__class__.files_owners.keys())
+
+
+class FileUtils:
+    """
+    Files Utility - various files utilities
+    """
+    # cahe here uid -> username, to not make many calls to system 
+    # calling pwd.getpwuid(uid) means also IO operations => they are slow
+    cache_dict_uid_to_username = {}
+    # cache here username -> frozenset of uids, rebuilt when the uid cache grows
+    cache_dict_username_to_uids = {}
+    logger : logging.Logger = None
+    # last logged loading progress, in 10% steps
+    load_progress_step = -1
+    # installed ncdu version, see get_ncdu_version()
+    ncdu_version = None
+    # new uids given by load_json_files() start here, above the usual system ones
+    first_merged_uid = 2**31
+
+    @classmethod
+    def set_logger(cls, logger: logging.Logger) -> None:
+        cls.logger  = logger
+        
+
+    @classmethod
+    def get_username_by_uid(cls, uid ):
+        """
+        Parameters
+        uid : int
+            Get sername associated with uid
+
+        Returns
+        -------
+            string
+
+        """
+        uname = cls.cache_dict_uid_to_username.get(uid, False)
+        # if uname was not scanned get it from the system and cache it
+        if uname == False:            
+            uname = pwd.getpwuid(uid).pw_name
+            cls.cache_dict_uid_to_username[uid] = uname
+            cls.cache_dict_username_to_uids = {}
+        return uname
+
+    @classmethod
+    def get_owner_by_uid(cls, uid) -> str:
+        """
+        Same as get_username_by_uid() but returns "*" when the uid has no user
+        """
+        try:
+            return cls.get_username_by_uid(uid)
+        except:
+            return "*"
+
+    @classmethod
+    def get_uids_by_owner(cls, owner: str) -> frozenset:
+        """
+        Returns all the uids of the username owner, None when owner is "*" (all users)
+        """
+        if owner == "*":
+            return None
+        if len(cls.cache_dict_username_to_uids) == 0:
+            username_to_uids = {}
+            for uid, uname in cls.cache_dict_uid_to_username.items():
+                username_to_uids.setdefault(uname, set()).add(uid)
+            cls.cache_dict_username_to_uids = {
+                    uname: frozenset(uids) for uname, uids in username_to_uids.items()}
+        return cls.cache_dict_username_to_uids.get(owner, frozenset())
+
+    @classmethod
+    def resolve_owners(cls, tree: FileTree) -> None:
+        """
+        Get the usernames of all the uids from the tree, once per uid
+        """
+        with Profiler.span("resolve_owners"):
+            for uid in tree.get_uids():
+                FileInfo.files_owners[cls.get_owner_by_uid(uid)] = True
+
+    @classmethod
+    def get_all_usernames(cls) -> list:
+        ret_list = list(cls.cache_dict_uid_to_username.values())
+        ret_list.sort()
+        # insert "*" which means all users
+        ret_list.insert(0, "*")
+        return ret_list
+    
+    @classmethod
+    def load_json_data(cls, ncdu_data_file, cache: TreeCache = None, progress_callback = None,
+                       collapse: dict = None) -> FileInfo:
+        """
+        Loads data from json_file_path , created by 'ncdu -o ...' command
+        Params:
+            ncdu_data_file - path to the json file
+            cache - if set, load the tree from the cache when up to date, else save it there
+            progress_callback - see load_json_stream()
+            collapse - optional, max_depth, min_size and memory_budget of a CollapsingTreeBuilder,
+                    then the cache is not used, it keeps only full trees
+        Return: a FileInfo object
+        """
+        count1 = time.perf_counter()
+        if collapse is not None:
+            logger.info("Loading data from {} , collapsed {} ... ".format(ncdu_data_file, collapse))
+            builder = CollapsingTreeBuilder(owner_name = cls.get_owner_by_uid, **collapse)
+            root_file = cls.build_tree(lambda handler, on_progress: NcduInput.parse_file(
+                    ncdu_data_file, handler, on_progress, True), progress_callback, builder)
+            logger.info("{} folders with collapsed content".format(len(root_file.tree.collapsed)))
+            return root_file
+        if cache is not None:
+            with Profiler.span("cache_load"):
+                cached = cache.load(ncdu_data_file)
+            if cached is not None:
+                tree, root, uid_names = cached
+                cls.cache_dict_uid_to_username.update(uid_names)
+                cls.resolve_owners(tree)
+                logger.info("Data loaded from cache {}, {} files.".format(
+                        cache.get_cache_file(ncdu_data_file), len(tree)))
+                return FileInfo(tree, root)
+        logger.info("Loading data from {} ... ".format(ncdu_data_file))
+        # json (plain or compressed) or binary, see NcduInput
+        root_file = cls.build_tree(lambda handler, on_progress: NcduInput.parse_file(
+                ncdu_data_file, handler, on_progress), progress_callback)
+        count2 = time.perf_counter()
+        logger.debug("Time spent on loading data {}".format(dt.timedelta(seconds = round(count2 - count1))))
+        if cache is not None:
+            with Profiler.span("cache_save"):
+                uids = root_file.tree.get_uids()
+                cache.save(ncdu_data_file, root_file.tree, root_file.index,
+                        {uid: uname for uid, uname in cls.cache_dict_uid_to_username.items() if uid in uids})
+        return root_file
+
+    @classmethod
+    def load_serialized(cls, ncdu_data_file, cache: TreeCache = None) -> tuple:
+        """
+        Worker of load_json_files(), runs in another process.
+        Returns the loaded tree serialized (see FileTree.serialize()), the root index
+        and the usernames of its uids: the exports carry only the uids, the names are the ones
+        of this machine user database (or the ones saved in the cache when it was built)
+        """
+        root_file = cls.load_json_data(ncdu_data_file, cache)
+        tree = root_file.tree
+        tree.get_hierarchy_sizes()
+        uid_names = {uid: cls.cache_dict_uid_to_username[uid] for uid in tree.get_uids()
+                     if uid in cls.cache_dict_uid_to_username}
+        return tree.serialize(), root_file.index, uid_names
+
+    @classmethod
+    def load_json_files(cls, ncdu_data_files: list, cache: TreeCache = None, progress_callback = None,
+                        processes: int = None) -> FileInfo:
+        """
+        Load several exports in parallel, one process per file, and put them under a new root folder.
+        Every process sends back its tree as a few bytes buffers, they are merged by copying
+        the arrays (see FileTree.merge()), the hierarchy sizes are merged the same way.
+        The usernames are resolved on this machine, not on the machines the exports come from
+        (ncdu writes only the uids), so the same uid is the same user in all the exports.
+        The only exception is a cache saved with another name for the uid (e.g. the user was renamed),
+        that uid gets a new one in that export, so the two names stay distinct owners.
+        The processes are spawned, not forked, so they do not inherit the Tk window state.
+        The new root is named "[N exports]", every export root gets the relative label
+        "<file name>:<root path without the leading '/', '/' replaced by ':'>", e.g.
+        "[2 exports]/a.json:data/x" and "[2 exports]/b.json:data:sub/y", with " (2)", ... added
+        when the same file name and root come twice.
+        Params:
+            ncdu_data_files - paths of the exports, see load_json_data()
+            cache - see load_json_data(), used by every process
+            progress_callback - see load_json_stream(), called when a file is loaded
+            processes - max number of processes, default the number of CPUs
+        Return: a FileInfo object
+        """
+        count1 = time.perf_counter()
+        logger.info("Loading data from {} files ... ".format(len(ncdu_data_files)))
+        sizes = [os.path.getsize(f) for f in ncdu_data_files]
+        results = [None] * len(ncdu_data_files)
+        executor = concurrent.futures.ProcessPoolExecutor(min(processes or os.cpu_count() or 1,
+                                                              len(ncdu_data_files)),
+                                                          mp_context = multiprocessing.get_context("spawn"))
+        try:
+            futures = {executor.submit(cls.load_serialized, f, cache): i for i, f in enumerate(ncdu_data_files)}
+            bytes_read = 0
+            files_number = 0
+            for future in concurrent.futures.as_completed(futures):
+                i = futures[future]
+                data, root, uid_names = results[i] = future.result()
+                bytes_read += sizes[i]
+                files_number += len(data["parent"]) // 4
+                logger.info("Data loaded from {}".format(ncdu_data_files[i]))
+                if progress_callback is not None:
+                    progress_callback(bytes_read, sum(sizes), files_number)
+        finally:
+            # when one file failed or the loading was stopped, the files not started yet are dropped
+            executor.shutdown(wait = True, cancel_futures = True)
+        with Profiler.span("merge"):
+            parts = []
+            root_names = set()
+            next_uid = cls.first_merged_uid
+            for ncdu_data_file, (data, root, uid_names) in zip(ncdu_data_files, results):
+                tree = FileTree.deserialize(data)
+                uids_map = {}
+                for uid, uname in uid_names.items():
+                    known = cls.cache_dict_uid_to_username.get(uid)
+                    if known is not None and known != uname:
+                        while next_uid in cls.cache_dict_uid_to_username:
+                            next_uid += 1
+                        uids_map[uid] = uid = next_uid
+                    cls.cache_dict_uid_to_username[uid] = uname
+                # the paths are the folders ids in the GUI, they must be unique: a label without '/'
+                # is a single path component, so unique labels give unique paths, also for nested roots
+                label = "{}:{}".format(os.path.basename(ncdu_data_file),
+                                       tree.get_name(root).strip("/").replace("/", ":"))
+                root_name = label
+                copy = 1
+                while root_name in root_names:
+                    copy += 1
+                    root_name = "{} ({})".format(label, copy)
+                root_names.add(root_name)
+                parts.append((tree, root, root_name, uids_map))
+            cls.cache_dict_username_to_uids = {}
+            tree, root = FileTree.merge("[{} exports]".format(len(parts)), parts)
+        cls.resolve_owners(tree)
+        count2 = time.perf_counter()
+        logger.info("Data loaded, {} files from {} exports in {}".format(len(tree), len(parts),
+                dt.timedelta(seconds = round(count2 - count1))))
+        return FileInfo(tree, root)
+
+    @classmethod
+    def load_json_stream(cls, fh, total_bytes: int = None, progress_callback = None) -> FileInfo:
+        """
+        Build the files tree while reading the 'ncdu -o ...' output from fh
+        Params:
+            fh - binary file object, a file or a pipe
+            total_bytes - expected input size, None if unknown
+            progress_callback - optional, called with (bytes_read, total_bytes, files_number),
+                    it may raise an exception to stop the loading
+        Return: a FileInfo object
+        """
+        return cls.build_tree(lambda handler, on_progress: NcduJsonParser(handler, on_progress).parse_stream(
+                fh, total_bytes), progress_callback)
+
+    @classmethod
+    def build_tree(cls, parse_function, progress_callback = None, builder: FileTreeBuilder = None) -> FileInfo:
+        """
+        Build the files tree from the events of a parser
+        Params:
+            parse_function - called with (handler, on_progress), it parses the data sending the events
+                    to handler and reporting the progress with on_progress(bytes_read, total_bytes)
+            progress_callback - see load_json_stream()
+            builder - default a new FileTreeBuilder
+        Return: a FileInfo object
+        """
+        cls.load_progress_step = -1
+        if builder is None:
+            builder = FileTreeBuilder()
+        def on_progress(bytes_read, total_bytes):
+            cls.log_load_progress(bytes_read, total_bytes, len(builder.tree))
+            if progress_callback is not None:
+                progress_callback(bytes_read, total_bytes, len(builder.tree))
+        # the tree is built while parsing, one phase
+        with Profiler.span("parse_build"):
+            parse_function(builder, on_progress)
+        if builder.root == NO_NODE:
+            raise ValueError("No files found in the ncdu data")
+        cls.resolve_owners(builder.tree)
+        logger.info("Data loaded, {} files.".format(len(builder.tree)))
+        return FileInfo(builder.tree, builder.root)
+    
+    @classmethod
+    def log_load_progress(cls, bytes_read: int, total_bytes: int, files_number: int) -> None:
+        """
+        Progress callback for NcduJsonParser, log every ~10% of the input
+        """
+        if not total_bytes:
+            return
+        progress_step = bytes_read * 10 // total_bytes
+        if progress_step != cls.load_progress_step:
+            cls.load_progress_step = progress_step
+            logger.debug("{:-12d}/{} bytes ({:-6.2f}%) {} files {}".format(
+                    bytes_read, total_bytes, bytes_read*100/total_bytes, files_number, datetime.now()))
+
+    @classmethod
+    def parseConfigFile(cls, cfg_file) -> configparser.ConfigParser    :
+        """
+        Parse the config file and return it as dict.
+        see https://docs.python.org/3.6/library/configparser.html#module-configparser
+        Known sections from config file: FILE_MENU
+        @param: cfg_file
+        @return: ConfigParser
+        """
+        cfg = configparser.ConfigParser()
+        cfg.optionxform=str
+        cfg.read(cfg_file)
+        return cfg
+
+    @classmethod
+    def ncdu_scan_folder(cls, folder_path : str, exclude_files: str, out_file: str) -> bool:
+        """
+        Scan the folder_path with ncdu command, exclude the exclude_files 
+        and save the results to out_file
+        @param: folder_path - folder to be scanned
+        @param: exclude_files - filenames to be excluded
+        @param: out_file - where to save the ncdu output , it is a json file
+        @return: True ( on success), False (if somethinmg went wrong)
+        """
+        if os.path.isdir(folder_path) == False:
+            logger.error("{} is not a dir, or it is not readable".format(folder_path))
+            return False
+        cmd = ['ncdu', '-e', '-x', '-o', out_file]
+        if exclude_files:
+            cmd.append('--exclude')
+            cmd.append(exclude_files)
+        cmd.append(folder_path)
+        # stdout is not captured, ncdu shows its progress there
+        proc = subprocess.run(cmd, stderr=subprocess.PIPE)        
+        if proc.returncode == 0:
+            return True
+        else:
+            logger.error("Command {} , exit code = {}, ERROR: {}".format(
+                    proc.args, proc.returncode, proc.stderr.decode(errors = "replace")))
+            return False
+
+    @classmethod
+    def get_ncdu_version(cls) -> tuple:
+        """
+        Returns the installed ncdu version, e.g. (2, 6), () if ncdu can not be run
+        """
+        if cls.ncdu_version is None:
+            try:
+                out = subprocess.run(['ncdu', '--version'], stdout = subprocess.PIPE,
+                        stderr = subprocess.DEVNULL).stdout.decode(errors = "replace")
+                cls.ncdu_version = tuple(int(n) for n in out.split()[1].split(".")[:2])
+            except (OSError, IndexError, ValueError):
+                cls.ncdu_version = ()
+        return cls.ncdu_version
+
+    @classmethod
+    def ncdu_supports_binary(cls) -> bool:
+        """
+        True if the installed ncdu can write the binary export ('-O', ncdu >= 2.6)
+        and it can be read here (zstd module available)
+        """
+        return (cls.get_ncdu_version() >= (2, 6)
+                and (ncdu_parser.zstd is not None or ncdu_parser.zstandard is not None))
+
+    @classmethod
+    def ncdu_scan_and_load(cls, folder_path : str, exclude_files: str, progress_callback = None,
+                           scan_format: str = "json") -> FileInfo:
+        """
+        Scan the folder_path with 'ncdu -o -' command and build the files tree while ncdu
+        writes its output to the pipe, no temporary file.
+        @param: folder_path - folder to be scanned
+        @param: exclude_files - filenames to be excluded
+        @param: progress_callback - see load_json_stream()
+        @param: scan_format - "json", "binary" ('ncdu -O', see ncdu_binary_scan_and_load())
+                or "auto" (binary when ncdu_supports_binary())
+        @return: a FileInfo object, raises an exception if something went wrong
+        """
+        if scan_format == "binary" or (scan_format == "auto" and cls.ncdu_supports_binary()):
+            return cls.ncdu_binary_scan_and_load(folder_path, exclude_files, progress_callback)
+        # -0 no ncdu progress on the terminal, we show our own
+        cmd = ['ncdu', '-0', '-e', '-x', '-o', '-']
+        if exclude_files:
+            cmd.append('--exclude')
+            cmd.append(exclude_files)
+        cmd.append(folder_path)
+        logger.debug("Execute command {}".format(cmd))
+        # unbuffered, so a read returns what ncdu wrote so far, not after a full chunk
+        with tempfile.TemporaryFile() as err_fh:
+            proc = subprocess.Popen(cmd, stdout = subprocess.PIPE, stderr = err_fh, bufsize = 0)
+            try:
+                root_file = cls.load_json_stream(proc.stdout, None, progress_callback)
+                proc.wait()
+            except ValueError:
+                # incomplete output, when ncdu failed the exit code and stderr tell why
+                if proc.wait() == 0:
+                    raise
+            finally:
+                if proc.poll() is None:
+                    proc.kill()
+                    proc.wait()
+                proc.stdout.close()
+            if proc.returncode != 0:
+                err_fh.seek(0)
+                raise RuntimeError("Command {} , exit code = {}, ERROR: {}".format(
+                        proc.args, proc.returncode, err_fh.read().decode(errors = "replace")))
+        return root_file
+
+    @classmethod
+    def ncdu_binary_scan_and_load(cls, folder_path : str, exclude_files: str,
+                                  progress_callback = None) -> FileInfo:
+        """
+        Scan the folder_path with 'ncdu -O -' command (binary export, ncdu >= 2.6).
+        The binary export is read from its end (index block), so it is written to an unnamed
+        temporary file, then loaded. While ncdu runs the progress reports the written bytes.
+        @return: a FileInfo object, raises an exception if something went wrong
+        """
+        cmd = ['ncdu', '-0', '-e', '-x', '-O', '-']
+        if exclude_files:
+            cmd.append('--exclude')
+            cmd.append(exclude_files)
+        cmd.append(folder_path)
+        logger.debug("Execute command {}".format(cmd))
+        with tempfile.TemporaryFile() as out_fh, tempfile.TemporaryFile() as err_fh:
+            proc = subprocess.Popen(cmd, stdout = out_fh, stderr = err_fh)
+            try:
+                while True:
+                    try:
+                        proc.wait(timeout = 0.5)
+                        break
+                    except subprocess.TimeoutExpired:
+                        if progress_callback is not None:
+                            progress_callback(os.fstat(out_fh.fileno()).st_size, None, 0)
+            finally:
+                if proc.poll() is None:
+                    proc.kill()
+                    proc.wait()
+            if proc.returncode != 0:
+                err_fh.seek(0)
+                raise RuntimeError("Command {} , exit code = {}, ERROR: {}".format(
+                        proc.args, proc.returncode, err_fh.read().decode(errors = "replace")))
+            total_bytes = out_fh.seek(0, os.SEEK_END)
+            out_fh.seek(0)
+            return cls.build_tree(lambda handler, on_progress: NcduBinaryParser(
+                    handler, on_progress).parse_stream(out_fh, total_bytes), progress_callback)
+
+
+    @classmethod
+    def native_scan_and_load(cls, folder_path : str, exclude_files: str, threads: int = None,
+                             progress_callback = None) -> FileInfo:
+        """
+        Scan the folder_path with the NativeScanner, same options as 'ncdu -x'
+        @param: folder_path - folder to be scanned
+        @param: exclude_files - filenames to be excluded
+        @param: threads - number of scanning threads, None for the default
+        @param: progress_callback - see load_json_stream()
+        @return: a FileInfo object
+        """
+        count1 = time.perf_counter()
+        scanner = NativeScanner(threads, True, [exclude_files] if exclude_files else None,
+                progress_callback)
+        with Profiler.span("scan"):
+            tree, root = scanner.scan(folder_path)
+        cls.resolve_owners(tree)
+        count2 = time.perf_counter()
+        logger.info("Scanned {} files with {} threads in {}".format(
+                len(tree), scanner.threads, dt.timedelta(seconds = round(count2 - count1))))
+        return FileInfo(tree, root)
+
+    @classmethod
+    def load_collapsed(cls, ncdu_data_file: str, file_node: FileInfo, collapse: dict,
+                       progress_callback = None) -> FileInfo:
+        """
+        Read again only the range of the collapsed folder file_node from the export it was loaded from
+        @param: collapse - same as load_json_data(), max_depth is relative to the folder
+        @return: the folder as the root of a new tree, see FileTree.replace_subtree()
+        """
+        start, end, _ = file_node.tree.collapsed[file_node.index]
+        logger.info("Loading the collapsed content of {} ...".format(file_node.path))
+        builder = CollapsingTreeBuilder(owner_name = cls.get_owner_by_uid, **collapse)
+        return cls.build_tree(lambda handler, on_progress: NcduInput.parse_range(
+                ncdu_data_file, handler, start, end), progress_callback, builder)
+
+    @classmethod
+    def load_scan_diff(cls, diff: ScanDiff, old_data_file: str, root_file: FileInfo,
+                       progress_callback = None) -> None:
+        """
+        Match the older export old_data_file on the loaded files tree, see ScanDiff
+        @param: progress_callback - see load_json_stream()
+        """
+        count1 = time.perf_counter()
+        logger.info("Loading older data from {} ... ".format(old_data_file))
+        with Profiler.span("diff_load"):
+            diff.load_old(old_data_file, root_file.tree, root_file.index, progress_callback)
+        # the owners of the removed files should be also in the owners list
+        for uid in diff.get_uids():
+            FileInfo.files_owners[cls.get_owner_by_uid(uid)] = True
+        count2 = time.perf_counter()
+        logger.info("Older data matched, {} files found in both in {}".format(
+                diff.matched_counter, dt.timedelta(seconds = round(count2 - count1))))
+
+    @classmethod
+    def write_ncdu_export(cls, root_file: FileInfo, out_file: str) -> None:
+        """
+        Save the files tree in ncdu json format, it can be loaded with '-l' or 'ncdu -f'
+        """
+        with Profiler.span("export"), open(out_file, "w", encoding = "utf-8") as fh:
+            NcduJsonWriter.write(root_file.tree, root_file.index, fh)
+        logger.info("Scan saved to {}".format(out_file))
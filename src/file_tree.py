@@ -0,0 +1,807 @@
+"""
+Compact storage of the files tree, a struct of arrays instead of one object per file.
+"""
+import collections
+import heapq
+import os
+from array import array
+
+from profiler import Profiler
+
+# index used when there is no parent/child/sibling
+NO_NODE = -1
+# flags of an entry
+FLAG_DIR = 1
+# the sizes of collapsed entries of one owner, see CollapsingTreeBuilder
+FLAG_SUMMARY = 2
+
+
+def copy_array(typecode: str, data) -> array:
+    """
+    Fast copy of an array or memoryview to a new array
+    """
+    new_array = array(typecode)
+    new_array.frombytes(memoryview(data).cast('B'))
+    return new_array
+
+
+class FileTree:
+    """
+    Files tree kept in parallel arrays, the entry i of every array describes the same file/folder:
+        - parent, first_child, next_sibling - indexes in the same arrays, NO_NODE when missing
+        - asize - actuall size
+        - dsize - size on disk
+        - uid - owner id
+        - flags - FLAG_DIR for folders (a folder may have no children), FLAG_SUMMARY for summaries
+        - mtime - modification time (seconds since epoch), 0 when unknown (no 'ncdu -e')
+        - name_offset - where the name starts in the names buffer, it ends where the next one starts
+    The entries are only appended and a folder is always added before its content,
+    so parent index < child index. That is why the hierarchy sizes are computed
+    with a single backward pass, no recursion.
+    Replaced entries (see replace_subtree) are not removed, only detached (parent NO_NODE).
+    It takes ~44 bytes per entry, plus the name, plus 8 bytes for each cached hierarchy sizes array.
+
+    The arrays may be also memoryviews over a memory mapped cache file (see tree_cache),
+    they are copied to real arrays only when entries are added.
+    """
+    # how many hierarchy sizes arrays are kept (all owners + the last selected owners)
+    max_cached_sizes = 3
+    # folders with fewer children are not remembered as sorted (see sort_children)
+    min_remembered_sort = 100
+    # the arrays and their type codes
+    arrays_types = (("parent", 'i'), ("first_child", 'i'), ("next_sibling", 'i'),
+                    ("asize", 'Q'), ("dsize", 'Q'), ("uid", 'I'), ("flags", 'B'), ("mtime", 'I'),
+                    ("name_offset", 'Q'))
+
+    def __init__(self):
+        for name, typecode in self.arrays_types:
+            setattr(self, name, array(typecode))
+        self.name_offset.append(0)
+        # all the names, utf-8 encoded, one after the other
+        self.names = bytearray()
+        # cached hierarchy sizes, the key is None for all owners or a frozenset of uids
+        self.hier_sizes = {}
+        # the memory map the arrays point to, None when they are real arrays
+        self.mapped_file = None
+        # folders with collapsed content (see CollapsingTreeBuilder):
+        # index -> (start, end, {uid: collapsed entries count}), start and end are the range
+        # of the folder in the export it was loaded from
+        self.collapsed = {}
+        # True when built by merge(), its paths are not the paths of the scanned files
+        self.merged = False
+        # folder index -> children count, filled on demand (see get_children_count)
+        self.children_counts = {}
+        # folder index -> the sizes its children are fully sorted by (see sort_children)
+        self.sorted_children = {}
+
+    def __len__(self):
+        return len(self.parent)
+
+    def add_node(self, parent: int, name: str, asize: int, dsize: int, uid: int,
+                 prev_sibling: int = NO_NODE, flags: int = 0, mtime: int = 0) -> int:
+        """
+        Append a new entry.
+        @param: parent - the folder index, NO_NODE for the root
+        @param: flags - FLAG_DIR for folders
+        @param: mtime - modification time, 0 if unknown
+        @param: prev_sibling - insert it after this child of parent,
+                if NO_NODE it becomes the first child of the parent
+        @return: the index of the new entry
+        """
+        if self.mapped_file is not None:
+            self.detach_mapped_file()
+        if self.children_counts or self.sorted_children:
+            self.children_counts.pop(parent, None)
+            self.sorted_children.pop(parent, None)
+        idx = len(self.parent)
+        self.parent.append(parent)
+        self.first_child.append(NO_NODE)
+        if prev_sibling != NO_NODE:
+            self.next_sibling.append(self.next_sibling[prev_sibling])
+            self.next_sibling[prev_sibling] = idx
+        elif parent != NO_NODE:
+            self.next_sibling.append(self.first_child[parent])
+            self.first_child[parent] = idx
+        else:
+            self.next_sibling.append(NO_NODE)
+        self.asize.append(asize)
+        self.dsize.append(dsize)
+        self.uid.append(uid)
+        self.flags.append(flags)
+        try:
+            self.mtime.append(mtime)
+        except OverflowError:
+            # before 1970 or after 2106, not worth 4 more bytes per entry
+            self.mtime.append(0)
+        self.names += name.encode("utf-8", "surrogateescape")
+        self.name_offset.append(len(self.names))
+        if self.hier_sizes:
+            self.invalidate_hierarchy_sizes()
+        return idx
+
+    def is_dir(self, idx: int) -> bool:
+        return bool(self.flags[idx] & FLAG_DIR)
+
+    def get_name(self, idx: int) -> str:
+        return str(self.names[self.name_offset[idx]:self.name_offset[idx + 1]],
+                "utf-8", "surrogateescape")
+
+    def get_path(self, idx: int) -> str:
+        """
+        Rebuild the full path, the root name is the scanned folder path.
+        """
+        names = []
+        while idx != NO_NODE:
+            names.append(self.get_name(idx))
+            idx = self.parent[idx]
+        names.reverse()
+        return os.path.join(*names) if names else ""
+
+    def iter_children(self, idx: int):
+        child = self.first_child[idx]
+        next_sibling = self.next_sibling # loop optimization
+        while child != NO_NODE:
+            yield child
+            child = next_sibling[child]
+
+    def has_children(self, idx: int) -> bool:
+        return self.first_child[idx] != NO_NODE
+
+    def get_children_count(self, idx: int) -> int:
+        """
+        Counted once, then kept until the children change
+        """
+        count = self.children_counts.get(idx)
+        if count is None:
+            count = 0
+            for _ in self.iter_children(idx):
+                count += 1
+            self.children_counts[idx] = count
+        return count
+
+    # The traversals below use an explicit stack, never recursion: the depth is limited
+    # only by the memory (no RecursionError) and there is no function call per entry.
+    # The detached entries are never reached.
+
+    def iter_preorder(self, root: int):
+        """
+        Yields root and all the entries below it, every folder before its content,
+        the children in their current order. The children of an entry are read after
+        it is yielded, so the caller may sort them (see sort_children) before they are visited.
+        """
+        first_child = self.first_child # loop optimization
+        next_sibling = self.next_sibling
+        stack = [root]
+        while stack:
+            idx = stack.pop()
+            yield idx
+            child = first_child[idx]
+            if child == NO_NODE:
+                continue
+            # pushed in reverse order, so the first child is popped first
+            start = len(stack)
+            while child != NO_NODE:
+                stack.append(child)
+                child = next_sibling[child]
+            stack[start:] = reversed(stack[start:])
+
+    def iter_events(self, root: int):
+        """
+        Yields (index, True) when an entry is entered and (index, False) when a folder is left,
+        after all its content, e.g. for writers which open and close the folders.
+        """
+        first_child = self.first_child # loop optimization
+        next_sibling = self.next_sibling
+        flags = self.flags
+        # a negative item -1 - idx leaves the folder idx
+        stack = [root]
+        while stack:
+            idx = stack.pop()
+            if idx < 0:
+                yield -1 - idx, False
+                continue
+            yield idx, True
+            if not flags[idx] & FLAG_DIR:
+                continue
+            stack.append(-1 - idx)
+            start = len(stack)
+            child = first_child[idx]
+            while child != NO_NODE:
+                stack.append(child)
+                child = next_sibling[child]
+            # pushed in reverse order, so the first child is popped first
+            stack[start:] = reversed(stack[start:])
+
+    # The folds below are no traversal, they walk the arrays by index: a parent index is always
+    # lower than its children ones, so a backward pass reaches every entry after all its content
+    # and a forward pass reaches every folder before its content. The detached entries are
+    # folded too but never reach an attached one.
+
+    def fold_up(self, values, function = None, stop: int = 0) -> None:
+        """
+        Bottom up reduction in place, e.g. hierarchy sizes: every entry value is combined
+        into its parent value, after all the entry content was combined into it.
+        @param: values - indexed like the tree (array, list, ...), the value of every entry alone
+        @param: function - (parent value, entry value) -> new parent value, None means the sum
+        @param: stop - the entries before stop are not combined into their parents
+        """
+        parent = self.parent # loop optimization
+        if function is None:
+            for i in range(len(values) - 1, stop - 1, -1):
+                p = parent[i]
+                if p != NO_NODE:
+                    values[p] += values[i]
+            return
+        for i in range(len(values) - 1, stop - 1, -1):
+            p = parent[i]
+            if p != NO_NODE:
+                values[p] = function(values[p], values[i])
+
+    def fold_down(self, values, function, start: int = 0) -> None:
+        """
+        Top down propagation in place, e.g. a mark of a sub tree: every entry value is
+        computed from its parent value, which is already final.
+        @param: values - indexed like the tree, the value of every entry alone
+        @param: function - (parent value, entry value) -> new entry value
+        @param: start - only the entries after start are changed, e.g. the root of a sub tree
+        """
+        parent = self.parent # loop optimization
+        for i in range(start + 1, len(values)):
+            p = parent[i]
+            if p != NO_NODE:
+                values[i] = function(values[p], values[i])
+
+    def truncate(self, length: int) -> None:
+        """
+        Remove the entries from index length on, they must be the last added sub tree
+        and the links to them must be removed before.
+        """
+        self.children_counts = {}
+        self.sorted_children = {}
+        for name, _ in self.arrays_types:
+            if name != "name_offset":
+                del getattr(self, name)[length:]
+        del self.names[self.name_offset[length]:]
+        del self.name_offset[length + 1:]
+
+    def has_detached(self) -> bool:
+        """
+        True if some entries were replaced (see replace_subtree), only the root has no parent otherwise
+        """
+        if isinstance(self.parent, memoryview):
+            # mapped from the cache, never changed
+            return False
+        return self.parent.count(NO_NODE) > 1
+
+    def get_uids(self) -> set:
+        """
+        Returns all the owners ids used in the tree
+        """
+        return set(self.uid)
+
+    def sort_children(self, idx: int, sizes: array, top: int = None) -> None:
+        """
+        Sort the direct children of idx, biggest first, by the values from sizes (indexed like the tree).
+        @param: top - only the top biggest children are selected (heap, not a full sort) and moved first,
+                the other ones stay after them in their current order. None means all the children.
+        Once fully sorted by sizes (the same array object), it is not done again, the children
+        are not even listed, until they or the sizes change.
+        """
+        if self.sorted_children.get(idx) is sizes:
+            return
+        children = list(self.iter_children(idx))
+        if len(children) < 2:
+            return
+        if top is not None and top < len(children):
+            if top > 0:
+                self.sorted_children.pop(idx, None)
+                self.move_top_children(idx, children, sizes, top)
+            return
+        children.sort(key = sizes.__getitem__, reverse = True)
+        # the small folders are cheaper to sort again than to remember
+        if len(children) >= self.min_remembered_sort:
+            self.sorted_children[idx] = sizes
+        self.first_child[idx] = children[0]
+        next_sibling = self.next_sibling
+        for i in range(len(children) - 1):
+            next_sibling[children[i]] = children[i + 1]
+        next_sibling[children[-1]] = NO_NODE
+
+    def move_top_children(self, idx: int, children: list, sizes: array, top: int) -> None:
+        """
+        Move the top biggest of children (the current children list of idx) first, biggest first.
+        Only the links around the moved children are changed, O(top) after the selection.
+        """
+        # positions in children, on ties the first ones win, so an already selected top stays first
+        positions = heapq.nlargest(top, range(len(children)), key = lambda i: sizes[children[i]])
+        moved = set(positions)
+        next_sibling = self.next_sibling
+        # unlink every run of moved children from the rest
+        rest_head = NO_NODE
+        for p in sorted(positions):
+            if p + 1 < len(children) and p + 1 in moved:
+                continue
+            start = p
+            while start - 1 in moved:
+                start -= 1
+            after = children[p + 1] if p + 1 < len(children) else NO_NODE
+            if start == 0:
+                rest_head = after
+            else:
+                next_sibling[children[start - 1]] = after
+        if 0 not in moved:
+            rest_head = children[0]
+        self.first_child[idx] = children[positions[0]]
+        for i in range(len(positions) - 1):
+            next_sibling[children[positions[i]]] = children[positions[i + 1]]
+        next_sibling[children[positions[-1]]] = rest_head
+
+    def replace_subtree(self, idx: int, other: "FileTree", other_root: int) -> None:
+        """
+        Replace the content of the folder idx with the content of the folder other_root from other tree
+        (e.g. the folder was scanned again).
+        The old entries stay in the arrays but they are detached, nothing points to them.
+        The cached hierarchy sizes are not dropped, they are computed only for the new entries
+        and updated along the path from idx to the root.
+        """
+        if self.mapped_file is not None:
+            self.detach_mapped_file()
+        for child in list(self.iter_children(idx)):
+            self.parent[child] = NO_NODE
+        self.collapsed.pop(idx, None)
+        # the sizes change along the path to the root, so the orders may be wrong there too
+        self.children_counts.pop(idx, None)
+        self.sorted_children = {}
+        base = len(self.parent)
+        def new_index(j):
+            if j == NO_NODE:
+                return NO_NODE
+            if j == other_root:
+                return idx
+            # other_root is not copied, the entries after it shift by one
+            return base + j - (1 if j > other_root else 0)
+        for j in range(len(other)):
+            if j == other_root:
+                continue
+            self.parent.append(new_index(other.parent[j]))
+            self.first_child.append(new_index(other.first_child[j]))
+            self.next_sibling.append(new_index(other.next_sibling[j]))
+            self.asize.append(other.asize[j])
+            self.dsize.append(other.dsize[j])
+            self.uid.append(other.uid[j])
+            self.flags.append(other.flags[j])
+            self.mtime.append(other.mtime[j])
+            self.names += other.names[other.name_offset[j]:other.name_offset[j + 1]]
+            self.name_offset.append(len(self.names))
+        self.first_child[idx] = new_index(other.first_child[other_root])
+        self.asize[idx] = other.asize[other_root]
+        self.dsize[idx] = other.dsize[other_root]
+        self.uid[idx] = other.uid[other_root]
+        self.mtime[idx] = other.mtime[other_root]
+        for j, collapsed in other.collapsed.items():
+            self.collapsed[new_index(j)] = collapsed
+        for uids, sizes in self.hier_sizes.items():
+            other_sizes = other.compute_hierarchy_sizes(uids)
+            sizes.extend(other_sizes[:other_root])
+            sizes.extend(other_sizes[other_root + 1:])
+            delta = other_sizes[other_root] - sizes[idx]
+            p = idx
+            while p != NO_NODE:
+                sizes[p] += delta
+                p = self.parent[p]
+
+    def extract(self, root: int, matches: list):
+        """
+        Copy to a new tree the matches (with their sub trees) and the folders leading to them,
+        nothing else. The folders leading to the matches get size 0, so the hierarchy sizes
+        of the new tree are the sizes of the matches only.
+        @param: matches - indexes of entries below root
+        @return: (FileTree, root index)
+        """
+        # the folders on the path from root to a match
+        ancestors = set()
+        for idx in matches:
+            idx = self.parent[idx]
+            while idx != NO_NODE and idx not in ancestors:
+                ancestors.add(idx)
+                idx = self.parent[idx]
+        matched = set(matches)
+        new_tree = FileTree()
+        # (index, new parent index, copy all its sub tree), the root is copied anyway
+        to_copy = [(root, NO_NODE, root in matched)]
+        new_root = NO_NODE
+        while to_copy:
+            idx, new_parent, copy_all = to_copy.pop()
+            if copy_all:
+                new_idx = new_tree.add_node(new_parent, self.get_name(idx), self.asize[idx],
+                        self.dsize[idx], self.uid[idx], flags = self.flags[idx], mtime = self.mtime[idx])
+            else:
+                new_idx = new_tree.add_node(new_parent, self.get_name(idx), 0, 0, self.uid[idx],
+                        flags = self.flags[idx], mtime = self.mtime[idx])
+            if new_root == NO_NODE:
+                new_root = new_idx
+            for child in self.iter_children(idx):
+                if copy_all or child in matched:
+                    to_copy.append((child, new_idx, True))
+                elif child in ancestors:
+                    to_copy.append((child, new_idx, False))
+        return new_tree, new_root
+
+    def get_own_size(self, idx: int, uids: frozenset = None) -> int:
+        """
+        Returns the disk size of idx alone, without its content, the part of the hierarchy size
+        which is not in the children ones
+        @param: uids - 0 if idx is not owned by these uids, None means all owners
+        """
+        return self.dsize[idx] if uids is None or self.uid[idx] in uids else 0
+
+    def get_hierarchy_sizes(self, uids: frozenset = None) -> array:
+        """
+        Returns an array with the disk size of every entry together with its sub tree.
+        @param: uids - count only the entries owned by these uids, None means all owners
+        """
+        sizes = self.hier_sizes.get(uids, None)
+        if sizes is None:
+            with Profiler.span("aggregate"):
+                sizes = self.compute_hierarchy_sizes(uids)
+            if len(self.hier_sizes) >= self.max_cached_sizes:
+                # drop the oldest owner, keep the "all owners" one, it is used all the time
+                oldest = next(k for k in self.hier_sizes if k is not None)
+                dropped = self.hier_sizes.pop(oldest)
+                self.sorted_children = {i: s for i, s in self.sorted_children.items() if s is not dropped}
+            self.hier_sizes[uids] = sizes
+        return sizes
+
+    def compute_hierarchy_sizes(self, uids: frozenset = None) -> array:
+        """
+        One backward pass (fold_up), every entry adds its hierarchy size to its parent.
+        """
+        if uids is None:
+            sizes = copy_array('Q', self.dsize)
+        else:
+            sizes = array('Q', (d if u in uids else 0 for d, u in zip(self.dsize, self.uid)))
+        self.fold_up(sizes)
+        return sizes
+
+    def invalidate_hierarchy_sizes(self) -> None:
+        """
+        Drop the cached hierarchy sizes, must be called every time the tree is changed.
+        """
+        self.hier_sizes = {}
+        self.sorted_children = {}
+
+    def get_memory_size(self) -> int:
+        """
+        Returns the bytes used by the arrays and the names buffer
+        """
+        arrays = [getattr(self, name) for name, _ in self.arrays_types] + list(self.hier_sizes.values())
+        return len(self.names) + sum(a.itemsize * len(a) for a in arrays)
+
+    def serialize(self) -> dict:
+        """
+        Returns the arrays, the names and the hierarchy sizes of all owners (if computed) as bytes,
+        compact and fast to send to another process, see deserialize()
+        """
+        data = {name: memoryview(getattr(self, name)).tobytes() for name, _ in self.arrays_types}
+        data["names"] = bytes(self.names)
+        if None in self.hier_sizes:
+            data["hier_sizes"] = memoryview(self.hier_sizes[None]).tobytes()
+        return data
+
+    @classmethod
+    def deserialize(cls, data: dict) -> "FileTree":
+        tree = cls()
+        for name, typecode in cls.arrays_types:
+            setattr(tree, name, copy_array(typecode, data[name]))
+        tree.names = bytearray(data["names"])
+        if "hier_sizes" in data:
+            tree.hier_sizes = {None: copy_array('Q', data["hier_sizes"])}
+        return tree
+
+    @classmethod
+    def merge(cls, root_name: str, parts: list):
+        """
+        Put several trees in a new one, under a new root folder, in the parts order.
+        The entries are copied as they are, only the indexes are shifted, there is no walk.
+        When all the parts have the hierarchy sizes of all owners, the merged ones are
+        their concatenation plus the new root, so they are not computed again.
+        @param: parts - list of (FileTree, root index, root name, uid -> new uid dict)
+        @return: (FileTree, root index)
+        """
+        tree = cls()
+        # the new root gets the owner of the first part root, not a new owner
+        first, first_root, _, first_uids_map = parts[0]
+        uid = first.uid[first_root]
+        root = tree.add_node(NO_NODE, root_name, 0, 0, first_uids_map.get(uid, uid), flags = FLAG_DIR)
+        tree.merged = True
+        all_sizes = all(None in part.hier_sizes for part, _, _, _ in parts)
+        sizes = array('Q', [0])
+        previous_root = NO_NODE
+        for part, part_root, part_root_name, uids_map in parts:
+            base = len(tree)
+            shift = lambda indexes: array('i', [i + base if i != NO_NODE else NO_NODE for i in indexes])
+            tree.parent.extend(shift(part.parent))
+            tree.first_child.extend(shift(part.first_child))
+            tree.next_sibling.extend(shift(part.next_sibling))
+            for name in ("asize", "dsize", "flags", "mtime"):
+                getattr(tree, name).extend(getattr(part, name))
+            if uids_map:
+                tree.uid.extend(array('I', [uids_map.get(u, u) for u in part.uid]))
+            else:
+                tree.uid.extend(part.uid)
+            # the part root gets its new name, the other names are copied as they are
+            offset = len(tree.names)
+            root_start, root_end = part.name_offset[part_root], part.name_offset[part_root + 1]
+            tree.names += part.names[:root_start]
+            tree.names += part_root_name.encode("utf-8", "surrogateescape")
+            tree.names += part.names[root_end:]
+            delta = len(part_root_name.encode("utf-8", "surrogateescape")) - (root_end - root_start)
+            tree.name_offset.extend(array('Q', [offset + o + (delta if j >= part_root else 0)
+                    for j, o in enumerate(part.name_offset[1:])]))
+            # link the part root as the last child of the new root
+            new_root = base + part_root
+            tree.parent[new_root] = root
+            if previous_root == NO_NODE:
+                tree.first_child[root] = new_root
+            else:
+                tree.next_sibling[previous_root] = new_root
+            previous_root = new_root
+            if all_sizes:
+                part_sizes = part.hier_sizes[None]
+                sizes.extend(part_sizes)
+                sizes[root] += part_sizes[part_root]
+        if all_sizes:
+            tree.hier_sizes = {None: sizes}
+        return tree, root
+
+    def attach_mapped_file(self, mapped_file, sections: dict) -> None:
+        """
+        Use memoryviews over mapped_file instead of arrays, nothing is copied,
+        the pages are loaded by the OS only when they are used.
+        @param: mapped_file - mmap object, opened with ACCESS_COPY so sorting does not change the file
+        @param: sections - array name -> (offset, typecode, number of items),
+                plus "names" and optionally "hier_sizes" (the hierarchy sizes for all owners)
+        """
+        view = memoryview(mapped_file)
+        for name, (offset, typecode, length) in sections.items():
+            itemsize = array(typecode).itemsize
+            data = view[offset:offset + length * itemsize]
+            if typecode != 'B':
+                data = data.cast(typecode)
+            if name == "hier_sizes":
+                self.hier_sizes = {None: data}
+            else:
+                setattr(self, name, data)
+        self.mapped_file = mapped_file
+
+    def detach_mapped_file(self) -> None:
+        """
+        Copy the memoryviews to real arrays, so new entries can be appended.
+        """
+        for name, typecode in self.arrays_types:
+            setattr(self, name, copy_array(typecode, getattr(self, name)))
+        self.names = bytearray(self.names)
+        self.hier_sizes = {uids: copy_array('Q', sizes) for uids, sizes in self.hier_sizes.items()}
+        self.sorted_children = {}
+        self.mapped_file = None
+
+
+class FileTreeBuilder:
+    """
+    Build a FileTree from the NcduJsonParser events.
+    """
+    def __init__(self, tree: FileTree = None):
+        self.tree = FileTree() if tree is None else tree
+        self.root = NO_NODE
+        # opened folders as [index, last child index],
+        # index is NO_NODE for the folders skipped together with their sub tree
+        self.dirs_stack = []
+
+    def add_entry(self, info: dict, flags: int = 0) -> int:
+        parent = self.dirs_stack[-1] if self.dirs_stack else [NO_NODE, NO_NODE]
+        # when file size is 0 there is no asize attribute
+        asize = info.get("asize", 0)
+        # if symlink it has no dsize, so use asize
+        idx = self.tree.add_node(parent[0], info["name"], asize, info.get("dsize", asize),
+                info["uid"], parent[1], flags, info.get("mtime", 0))
+        parent[1] = idx
+        return idx
+
+    def start_dir(self, info: dict):
+        if not self.dirs_stack:
+            self.root = self.add_entry(info, FLAG_DIR)
+            self.dirs_stack.append([self.root, NO_NODE])
+            return
+        idx = NO_NODE
+        # if someting went wrong when retriveing files the "uid" may not be set,
+        # if no "uid" then exclude the respective folder and its content
+        if self.dirs_stack[-1][0] != NO_NODE and info.get("uid", None) is not None:
+            idx = self.add_entry(info, FLAG_DIR)
+        self.dirs_stack.append([idx, NO_NODE])
+
+    def add_file(self, info: dict):
+        # if there are nodes with "exclude" they are exclude by ncdu , before various reasons
+        if (self.dirs_stack[-1][0] == NO_NODE or info.get("excluded", False)
+                or info.get("uid", None) is None):
+            return
+        self.add_entry(info)
+
+    def end_dir(self):
+        self.dirs_stack.pop()
+
+
+class CollapsingTreeBuilder(FileTreeBuilder):
+    """
+    FileTreeBuilder keeping full detail only for the top levels and the big entries,
+    for the exports not fitting in memory. The other entries are collapsed while parsing
+    in summary entries (FLAG_SUMMARY, one per owner) of their nearest kept folder,
+    with their exact sizes and counts:
+        - the content of the folders at depth max_depth (the root is at depth 0)
+        - the files and the folders (with their sub tree) smaller than min_size
+        - everything read after the tree reached memory_budget bytes
+    A folder sub tree is always the last added entries, so a small folder is removed
+    at its end by truncating the arrays.
+    The parser must send the folders ranges (track_offsets), the ones of the folders with summaries
+    are kept in FileTree.collapsed, so their content can be read again (see FileUtils.load_collapsed).
+    """
+    # the tree memory is checked every ... kept entries
+    memory_check_interval = 1024
+    # dirs_stack index of the folded folders, their content is added to the collector summary
+    FOLDED = -2
+
+    def __init__(self, max_depth: int = None, min_size: int = 0, memory_budget: int = None,
+                 tree: FileTree = None, owner_name = None):
+        """
+        @param: max_depth - the content of the deeper folders is collapsed, None means no limit
+        @param: min_size - the smaller entries (size on disk, with the sub tree) are collapsed
+        @param: memory_budget - bytes, then the next entries are collapsed, None means no limit
+        @param: owner_name - uid -> owner name, used in the summaries names, default "uid N"
+        """
+        super().__init__(tree)
+        self.owner_name = owner_name
+        self.max_depth = max_depth
+        self.min_size = min_size
+        self.memory_budget = memory_budget
+        self.over_budget = False
+        self.kept_counter = 0
+        # for every opened folder, parallel to dirs_stack, None for the skipped and folded ones:
+        # [start offset, previous sibling, content size, summary {uid: [dsize, asize, count]}]
+        self.opened = []
+        # dirs_stack position of the kept folder getting all the entries, None when not collapsing
+        self.collector = None
+
+    def add_entry(self, info: dict, flags: int = 0) -> int:
+        self.kept_counter += 1
+        if self.memory_budget is not None and self.kept_counter % self.memory_check_interval == 0:
+            self.over_budget = self.tree.get_memory_size() > self.memory_budget
+        return super().add_entry(info, flags)
+
+    def fold(self, position: int, info: dict) -> None:
+        """
+        Add the entry info to the summary of the kept folder at dirs_stack position
+        """
+        asize = info.get("asize", 0)
+        dsize = info.get("dsize", asize)
+        record = self.opened[position]
+        record[2] += dsize
+        summary = record[3].setdefault(info["uid"], [0, 0, 0])
+        summary[0] += dsize
+        summary[1] += asize
+        summary[2] += 1
+
+    def start_dir(self, info: dict, start: int = None):
+        if not self.dirs_stack:
+            super().start_dir(info)
+            self.opened.append([start, NO_NODE, 0, {}])
+            if self.max_depth == 0:
+                self.collector = 0
+            return
+        if self.dirs_stack[-1][0] == NO_NODE or info.get("uid", None) is None:
+            # skipped sub tree, see FileTreeBuilder
+            self.dirs_stack.append([NO_NODE, NO_NODE])
+            self.opened.append(None)
+            return
+        if self.collector is None and self.over_budget:
+            # the rest of the current folder is collapsed
+            self.collector = len(self.dirs_stack) - 1
+        if self.collector is not None:
+            self.fold(self.collector, info)
+            self.dirs_stack.append([self.FOLDED, NO_NODE])
+            self.opened.append(None)
+            return
+        previous = self.dirs_stack[-1][1]
+        idx = self.add_entry(info, FLAG_DIR)
+        self.dirs_stack.append([idx, NO_NODE])
+        self.opened.append([start, previous, 0, {}])
+        if len(self.dirs_stack) - 1 == self.max_depth:
+            self.collector = len(self.dirs_stack) - 1
+
+    def add_file(self, info: dict):
+        if (self.dirs_stack[-1][0] == NO_NODE or info.get("excluded", False)
+                or info.get("uid", None) is None):
+            return
+        if self.collector is None and self.over_budget:
+            self.collector = len(self.dirs_stack) - 1
+        if self.collector is not None:
+            self.fold(self.collector, info)
+            return
+        asize = info.get("asize", 0)
+        dsize = info.get("dsize", asize)
+        if dsize < self.min_size:
+            self.fold(len(self.dirs_stack) - 1, info)
+            return
+        self.add_entry(info)
+        self.opened[-1][2] += dsize
+
+    def end_dir(self, end: int = None):
+        idx, last_child = self.dirs_stack.pop()
+        record = self.opened.pop()
+        if self.collector == len(self.dirs_stack):
+            self.collector = None
+        if record is None:
+            # skipped or folded
+            return
+        size = record[2] + self.tree.dsize[idx]
+        if self.dirs_stack:
+            if size < self.min_size:
+                self.fold_subtree(idx, record)
+                return
+            self.opened[-1][2] += size
+        if record[3]:
+            self.add_summaries(idx, last_child, record, end)
+
+    def fold_subtree(self, idx: int, record: list) -> None:
+        """
+        Remove the folder idx with its sub tree, add them to the summary of its parent
+        """
+        tree = self.tree
+        parent_record = self.opened[-1]
+        summary = parent_record[3]
+        # loop optimization
+        dsize = tree.dsize
+        asize = tree.asize
+        uid = tree.uid
+        flags = tree.flags
+        parent = tree.parent
+        for j in range(idx, len(tree)):
+            count = tree.collapsed[parent[j]][2][uid[j]] if flags[j] & FLAG_SUMMARY else 1
+            s = summary.setdefault(uid[j], [0, 0, 0])
+            s[0] += dsize[j]
+            s[1] += asize[j]
+            s[2] += count
+            parent_record[2] += dsize[j]
+        # the summary of idx itself, its entries were not added yet
+        for u, (d, a, count) in record[3].items():
+            s = summary.setdefault(u, [0, 0, 0])
+            s[0] += d
+            s[1] += a
+            s[2] += count
+            parent_record[2] += d
+        # the collapsed folders of the sub tree are the last ones added
+        collapsed = tree.collapsed
+        while collapsed and next(reversed(collapsed)) >= idx:
+            collapsed.popitem()
+        # idx is the last child of its parent
+        previous = record[1]
+        if previous == NO_NODE:
+            tree.first_child[self.dirs_stack[-1][0]] = NO_NODE
+        else:
+            tree.next_sibling[previous] = NO_NODE
+        self.dirs_stack[-1][1] = previous
+        tree.truncate(idx)
+
+    def add_summaries(self, idx: int, last: int, record: list, end: int) -> None:
+        """
+        Add the summary entries of the folder idx after its last child, one per owner, and keep its range
+        """
+        counts = {}
+        # the names must be unique in the folder, its paths are the rows ids in the window
+        owners = {u: self.owner_name(u) if self.owner_name is not None else "uid {}".format(u)
+                  for u in record[3]}
+        repeated = set(o for o, n in collections.Counter(owners.values()).items() if n > 1)
+        for u, (d, a, count) in sorted(record[3].items()):
+            owner = owners[u] if owners[u] not in repeated else "{} (uid {})".format(owners[u], u)
+            last = self.tree.add_node(idx, "[{} collapsed entries of {}]".format(count, owner), a, d, u, last,
+                    FLAG_SUMMARY)
+            counts[u] = count
+        self.tree.collapsed[idx] = (record[0], end, counts)
@@ -0,0 +1,255 @@
+"""
+Names index of a FileTree, for substring and glob searches over the whole scan.
+"""
+import bisect
+import itertools
+import re
+import threading
+import weakref
+from array import array
+
+from file_tree import FileTree, NO_NODE, FLAG_SUMMARY
+from profiler import Profiler
+
+
+class NameIndex:
+    """
+    The distinct names of a FileTree (many entries share a name), sorted, with the entries of each name:
+        - buffer - the distinct names separated by '\\0' (a name never contains it, '\\n' is possible):
+          "\\0" name0 "\\0" name1 "\\0" ... "\\0"
+        - offsets - start of each name in buffer, plus the end
+        - sorted_names / sorted_reversed - name ids sorted by name / by reversed name
+        - entries - entry indexes grouped by name id, the entries of name k are
+          entries[first_entry[k]:first_entry[k + 1]]
+    Queries:
+        - with *, ? or [ - glob matching the whole name:
+            - literal prefix (core.*) - binary search of the prefix range in sorted_names
+            - literal suffix (*.parquet) - binary search of the reversed suffix range in sorted_reversed
+            - otherwise - regular expression search over buffer
+        - else - substring of the name, regular expression search over buffer
+    A match position in buffer is mapped to its name id by a binary search in offsets.
+    The entries appended after the build (e.g. rescan) are kept in a small tail, searched linearly.
+    It takes about 12 bytes per entry plus the distinct names.
+    """
+    # index per tree (see get_index and start_build)
+    indexes = weakref.WeakKeyDictionary()
+    builders = weakref.WeakKeyDictionary()
+    lock = threading.Lock()
+    glob_chars_re = re.compile(r"[*?\[]")
+
+    def __init__(self, tree: FileTree):
+        self.tree = tree
+        with Profiler.span("name_index"):
+            self.build()
+        self.tail_entries = []
+        self.tail_names = []
+
+    @classmethod
+    def start_build(cls, tree: FileTree) -> None:
+        """
+        Build the index of tree in a background thread, so the first search does not wait for it
+        """
+        with cls.lock:
+            if tree in cls.indexes or tree in cls.builders:
+                return
+            builder = cls.builders[tree] = threading.Thread(target = cls.build_index, args = (tree,),
+                                                            daemon = True)
+        builder.start()
+
+    @classmethod
+    def build_index(cls, tree: FileTree) -> None:
+        index = NameIndex(tree)
+        with cls.lock:
+            cls.indexes[tree] = index
+            cls.builders.pop(tree, None)
+
+    @classmethod
+    def get_index(cls, tree: FileTree) -> "NameIndex":
+        """
+        Returns the index of tree, it is built the first time (or the background build is waited for),
+        then only updated with the new entries
+        """
+        with cls.lock:
+            builder = cls.builders.get(tree)
+        if builder is not None:
+            builder.join()
+        with cls.lock:
+            index = cls.indexes.get(tree)
+        if index is None:
+            index = NameIndex(tree)
+            with cls.lock:
+                cls.indexes[tree] = index
+        index.update()
+        return index
+
+    def build(self) -> None:
+        """
+        Build the index of the current entries, only names and name_offset of the tree are read
+        (they are not changed by sorting, and the new entries are only appended)
+        """
+        tree = self.tree
+        names = tree.names
+        name_offset = tree.name_offset
+        count = len(tree)
+        ids = {}
+        # loop optimization
+        get_id = ids.setdefault
+        name_ids = array('I', [get_id(bytes(names[name_offset[i]:name_offset[i + 1]]), len(ids))
+                               for i in range(count)])
+        distinct = list(ids)
+        del ids
+        self.buffer = b"\0" + b"\0".join(distinct) + b"\0"
+        self.offsets = array('Q', itertools.accumulate((len(name) + 1 for name in distinct), initial = 1))
+        self.sorted_names = array('I', sorted(range(len(distinct)), key = distinct.__getitem__))
+        distinct = [name[::-1] for name in distinct]
+        self.sorted_reversed = array('I', sorted(range(len(distinct)), key = distinct.__getitem__))
+        del distinct
+        first_entry = array('Q', bytes(8 * (len(self.offsets) + 1)))
+        for k in name_ids:
+            first_entry[k + 2] += 1
+        for k in range(2, len(first_entry)):
+            first_entry[k] += first_entry[k - 1]
+        # first_entry[k + 1] is the next free place of name k while filling, the start of name k + 1 at the end
+        entries = array('I', bytes(4 * count))
+        for i, k in enumerate(name_ids):
+            entries[first_entry[k + 1]] = i
+            first_entry[k + 1] += 1
+        self.entries = entries
+        self.first_entry = first_entry[:-1]
+        self.indexed_count = count
+
+    def get_name(self, k: int) -> bytes:
+        return self.buffer[self.offsets[k]:self.offsets[k + 1] - 1]
+
+    def get_reversed_name(self, k: int) -> bytes:
+        return self.get_name(k)[::-1]
+
+    def update(self) -> None:
+        """
+        Add the entries appended to the tree since the last update (e.g. rescan) to the tail
+        """
+        tree = self.tree
+        if self.indexed_count == len(tree):
+            return
+        names = tree.names
+        name_offset = tree.name_offset # loop optimization
+        for i in range(self.indexed_count, len(tree)):
+            self.tail_entries.append(i)
+            self.tail_names.append(bytes(names[name_offset[i]:name_offset[i + 1]]))
+        self.indexed_count = len(tree)
+
+    @classmethod
+    def compile_query(cls, query: str):
+        """
+        Returns (regular expression of the whole name, literal prefix, literal suffix) of a glob query,
+        or (None, substring, None) of a substring query
+        """
+        pattern = query.encode("utf-8", "surrogateescape")
+        if not cls.glob_chars_re.search(query):
+            return None, pattern, None
+        regex = b""
+        i = 0
+        # the literal prefix ends at the first wildcard, the literal suffix starts after the last one
+        prefix_end = None
+        suffix_start = 0
+        while i < len(pattern):
+            start = i
+            ch = pattern[i:i + 1]
+            i += 1
+            if ch == b"*":
+                regex += b"[^\0]*"
+            elif ch == b"?":
+                regex += b"[^\0]"
+            elif ch == b"[":
+                end = pattern.find(b"]", i + 1)
+                if end == -1:
+                    regex += b"\\["
+                    continue
+                chars = pattern[i:end]
+                i = end + 1
+                if chars.startswith(b"!"):
+                    chars = b"^\0" + chars[1:]
+                regex += b"[" + chars.replace(b"\\", b"\\\\") + b"]"
+            else:
+                regex += re.escape(ch)
+                continue
+            if prefix_end is None:
+                prefix_end = start
+            suffix_start = i
+        return re.compile(regex, re.DOTALL), pattern[:prefix_end], pattern[suffix_start:]
+
+    def search_names(self, query: str) -> list:
+        """
+        Returns the ids of the distinct names matching query
+        """
+        regex, prefix, suffix = self.compile_query(query)
+        if regex is None:
+            # substring, a name matched twice is counted once
+            offsets = self.offsets
+            ids = []
+            last = -1
+            for m in re.finditer(re.escape(prefix), self.buffer):
+                k = bisect.bisect_right(offsets, m.start()) - 1
+                if k != last:
+                    ids.append(k)
+                    last = k
+            return ids
+        if prefix or suffix:
+            if len(prefix) >= len(suffix):
+                key, literal, sorted_ids = self.get_name, prefix, self.sorted_names
+            else:
+                key, literal, sorted_ids = self.get_reversed_name, suffix[::-1], self.sorted_reversed
+            length = len(literal)
+            start = bisect.bisect_left(sorted_ids, literal, key = lambda k: key(k)[:length])
+            end = bisect.bisect_right(sorted_ids, literal, lo = start, key = lambda k: key(k)[:length])
+            return [k for k in sorted_ids[start:end] if regex.fullmatch(self.get_name(k))]
+        bounded = re.compile(b"(?<=\0)" + regex.pattern + b"(?=\0)", re.DOTALL)
+        offsets = self.offsets
+        return [bisect.bisect_right(offsets, m.start()) - 1 for m in bounded.finditer(self.buffer)]
+
+    def search_tail(self, query: str) -> list:
+        regex, substring, _ = self.compile_query(query)
+        if regex is None:
+            return [i for i, name in zip(self.tail_entries, self.tail_names) if substring in name]
+        return [i for i, name in zip(self.tail_entries, self.tail_names) if regex.fullmatch(name)]
+
+    def is_attached(self, idx: int, root: int) -> bool:
+        """
+        False for the entries replaced by a rescan, they are still in the tree but detached
+        """
+        parent = self.tree.parent
+        while idx != root:
+            idx = parent[idx]
+            if idx == NO_NODE:
+                return False
+        return True
+
+    def search(self, query: str, root: int, uids: frozenset = None) -> list:
+        """
+        Returns the indexes of the entries below root matching query, in tree order, never a summary
+        @param: uids - only the files owned by these uids and the folders with content
+                owned by them, None means all owners
+        """
+        self.update()
+        tree = self.tree
+        # the check is needed only for a sub folder or after a rescan
+        check_attached = tree.parent[root] != NO_NODE or tree.has_detached()
+        with Profiler.span("search"):
+            entries = self.entries
+            first_entry = self.first_entry # loop optimization
+            matches = []
+            for k in self.search_names(query):
+                matches.extend(entries[first_entry[k]:first_entry[k + 1]])
+            matches.sort()
+            matches.extend(self.search_tail(query))
+            if check_attached:
+                matches = [i for i in matches if self.is_attached(i, root)]
+            if tree.collapsed:
+                # the summaries of collapsed folders are not files, their names are made up
+                flags = tree.flags
+                matches = [i for i in matches if not flags[i] & FLAG_SUMMARY]
+            if uids is not None:
+                sizes = self.tree.get_hierarchy_sizes(uids)
+                uid = self.tree.uid
+                matches = [i for i in matches if uid[i] in uids or sizes[i]]
+        return matches
@@ -0,0 +1,136 @@
+"""
+Parallel files system scanner, alternative to the ncdu command.
+"""
+import fnmatch
+import logging
+import os
+import queue
+import re
+import threading
+
+from file_tree import FileTree, NO_NODE, FLAG_DIR
+
+logger = logging.getLogger('PYNCDU')
+
+
+class NativeScanner:
+    """
+    Walk a folder with os.scandir on a pool of threads and build the FileTree directly.
+    The folders to be scanned are kept in a shared queue, every idle thread takes the next one,
+    so a big folder does not keep the other threads waiting (scandir/stat release the GIL).
+    Only the calling thread changes the tree: the workers send back the entries of every folder,
+    the folder being already in the tree, so a parent index is still lower than its children ones.
+
+    Same semantic as 'ncdu -x --exclude pattern':
+        - the folders from other file systems are skipped
+        - the entries matching a pattern (full path or any trailing part of it) are skipped
+    """
+    # call the progress callback every N scanned folders
+    progress_batch_size = 256
+
+    def __init__(self, threads: int = None, same_filesystem: bool = True,
+                 exclude_patterns: list = None, progress_callback = None):
+        """
+        @param: threads - number of worker threads, default like ThreadPoolExecutor
+        @param: same_filesystem - do not cross file system boundaries, like 'ncdu -x'
+        @param: exclude_patterns - shell patterns, like 'ncdu --exclude'
+        @param: progress_callback - optional, called with (0, None, files_number),
+                it may raise an exception to stop the scan
+        """
+        self.threads = threads if threads else min(32, (os.cpu_count() or 1) + 4)
+        self.same_filesystem = same_filesystem
+        self.exclude_res = [re.compile(fnmatch.translate(p)) for p in (exclude_patterns or [])]
+        self.progress_callback = progress_callback
+        self.stop_event = threading.Event()
+
+    def is_excluded(self, path: str) -> bool:
+        """
+        Same as ncdu: match the full path, then every part after a '/'
+        """
+        for exclude_re in self.exclude_res:
+            if exclude_re.match(path):
+                return True
+            pos = path.find("/")
+            while pos != -1:
+                if exclude_re.match(path, pos + 1):
+                    return True
+                pos = path.find("/", pos + 1)
+        return False
+
+    def scan(self, folder_path: str):
+        """
+        Scan folder_path
+        @return: (FileTree, root index)
+        """
+        folder_path = os.path.abspath(folder_path)
+        st = os.stat(folder_path)
+        tree = FileTree()
+        root = tree.add_node(NO_NODE, folder_path, st.st_size, st.st_blocks * 512, st.st_uid,
+                flags = FLAG_DIR, mtime = int(st.st_mtime))
+        jobs = queue.Queue()
+        results = queue.Queue()
+        workers = [threading.Thread(target = self.worker, args = (jobs, results, st.st_dev),
+                name = "scanner-{}".format(i), daemon = True) for i in range(self.threads)]
+        self.stop_event.clear()
+        for w in workers:
+            w.start()
+        try:
+            jobs.put((root, folder_path))
+            pending = 1
+            scanned_dirs = 0
+            while pending:
+                dir_idx, dir_path, entries = results.get()
+                pending -= 1
+                prev = NO_NODE
+                for name, flags, asize, dsize, uid, mtime in entries:
+                    prev = tree.add_node(dir_idx, name, asize, dsize, uid, prev, flags, mtime)
+                    if flags & FLAG_DIR:
+                        jobs.put((prev, os.path.join(dir_path, name)))
+                        pending += 1
+                scanned_dirs += 1
+                if self.progress_callback is not None and scanned_dirs % self.progress_batch_size == 0:
+                    self.progress_callback(0, None, len(tree))
+        finally:
+            # on errors/cancel the workers skip the rest of the queued folders
+            self.stop_event.set()
+            for _ in workers:
+                jobs.put(None)
+        return tree, root
+
+    def worker(self, jobs: queue.Queue, results: queue.Queue, root_dev: int) -> None:
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            if self.stop_event.is_set():
+                continue
+            dir_idx, dir_path = job
+            results.put((dir_idx, dir_path, self.scan_dir(dir_path, root_dev)))
+
+    def scan_dir(self, dir_path: str, root_dev: int) -> list:
+        """
+        Returns the entries of dir_path as (name, flags, asize, dsize, uid, mtime)
+        """
+        entries = []
+        try:
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    if self.exclude_res and self.is_excluded(entry.path):
+                        continue
+                    try:
+                        st = entry.stat(follow_symlinks = False)
+                        is_dir = entry.is_dir(follow_symlinks = False)
+                    except OSError as e:
+                        logger.debug("Cannot stat {}: {}".format(entry.path, e))
+                        continue
+                    if is_dir and self.same_filesystem and st.st_dev != root_dev:
+                        continue
+                    entries.append((entry.name, FLAG_DIR if is_dir else 0,
+                            st.st_size, st.st_blocks * 512, st.st_uid, int(st.st_mtime)))
+        except OSError as e:
+            # same as ncdu, the folder is kept, without content
+            logger.debug("Cannot read {}: {}".format(dir_path, e))
+        except Exception:
+            # never leave the scan waiting for this folder
+            logger.exception("Error scanning {}".format(dir_path))
+        return entries
@@ -0,0 +1,584 @@
+"""
+Incremental parsers for the files created by 'ncdu -o ...' (json, plain or compressed)
+and 'ncdu -O ...' (binary, ncdu >= 2.6), and a writer for the json format.
+"""
+import bz2
+import codecs
+import collections
+import gzip
+import io
+import json
+import lzma
+import os
+import re
+import struct
+import time
+
+# optional, needed for the zstd compressed json files and for the binary exports
+try:
+    from compression import zstd
+except ImportError:
+    zstd = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+# optional, the binary export items are decoded faster with its C extension
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+class NcduInput:
+    """
+    Open an ncdu export whatever its format is, detected from the first bytes (magic bytes):
+        - json, plain or compressed with gzip, xz, bzip2 or zstd, decompressed as a stream
+          while parsing, there is no temporary file
+        - binary ('ncdu -O ...'), it needs seeks, so it is not read compressed or from a pipe
+    """
+    BINARY_SIGNATURE = b"\xbfncduEX1"
+    COMPRESSIONS = ((b"\x1f\x8b", "gzip"), (b"\xfd7zXZ\x00", "xz"), (b"BZh", "bz2"),
+                    (b"\x28\xb5\x2f\xfd", "zstd"))
+
+    @classmethod
+    def detect(cls, head: bytes) -> str:
+        """
+        Returns "binary", "json" or the compression name, from the first 8 bytes of the file
+        """
+        if head.startswith(cls.BINARY_SIGNATURE):
+            return "binary"
+        for magic, name in cls.COMPRESSIONS:
+            if head.startswith(magic):
+                return name
+        return "json"
+
+    @classmethod
+    def open_decompressed(cls, fh, compression: str):
+        """
+        Returns a binary file object reading the decompressed data of fh
+        """
+        if compression == "gzip":
+            return gzip.GzipFile(fileobj = fh, mode = "rb")
+        if compression == "xz":
+            return lzma.LZMAFile(fh)
+        if compression == "bz2":
+            return bz2.BZ2File(fh)
+        if compression == "zstd":
+            if zstd is not None:
+                return zstd.ZstdFile(fh)
+            if zstandard is not None:
+                return zstandard.ZstdDecompressor().stream_reader(fh)
+            raise ValueError("Reading zstd compressed files needs Python >= 3.14 or the zstandard package")
+        return fh
+
+    @classmethod
+    def parse_file(cls, ncdu_data_file: str, handler, progress_callback = None,
+                   track_offsets: bool = False) -> None:
+        """
+        Parse ncdu_data_file sending the events to handler, see NcduJsonParser
+        @param: progress_callback - optional, called with (bytes_read, total_bytes), on the file bytes,
+                not on the decompressed ones
+        @param: track_offsets - send the folders ranges too, see NcduJsonParser
+        """
+        total_bytes = os.path.getsize(ncdu_data_file)
+        with open(ncdu_data_file, "rb") as fh:
+            file_format = cls.detect(fh.read(len(cls.BINARY_SIGNATURE)))
+            fh.seek(0)
+            if file_format == "binary":
+                NcduBinaryParser(handler, progress_callback, track_offsets).parse_stream(fh, total_bytes)
+                return
+            with cls.open_decompressed(fh, file_format) as data_fh:
+                parser = NcduJsonParser(handler, progress_callback, track_offsets)
+                if data_fh is fh:
+                    parser.parse_stream(fh, total_bytes)
+                else:
+                    # the progress is the position in the compressed file
+                    parser.parse_stream(data_fh, total_bytes, fh.tell)
+
+    @classmethod
+    def parse_range(cls, ncdu_data_file: str, handler, start: int, end: int) -> None:
+        """
+        Parse only one folder of ncdu_data_file, its range comes from a parsing with track_offsets.
+        The offsets of a compressed file are in the decompressed data, the seek decompresses
+        the data before start again, but it is not parsed.
+        """
+        with open(ncdu_data_file, "rb") as fh:
+            file_format = cls.detect(fh.read(len(cls.BINARY_SIGNATURE)))
+            fh.seek(0)
+            if file_format == "binary":
+                NcduBinaryParser(handler, None, True).parse_range(fh, start, end)
+                return
+            with cls.open_decompressed(fh, file_format) as data_fh:
+                NcduJsonParser(handler, None, True).parse_range(data_fh, start, end)
+
+
+class NcduJsonParser:
+    """
+    Event driven parser for the ncdu export format:
+        [major, minor, {metadata}, [{root folder}, {file}, [{folder}, {file}, ...], ...]]
+    The input is read in chunks, only the structure ('[', ']', ',') is tokenized here,
+    every entry (a json object) is decoded with the C json scanner.
+    So the whole document is never kept in memory, the nodes are built while reading.
+
+    The events are sent to a handler object, which should have the methods:
+        - start_dir(info: dict) - a folder, its entries follow until end_dir()
+        - add_file(info: dict) - a file (or an excluded folder) inside the last started folder
+        - end_dir() - end of the last started folder
+        - set_metadata(info: dict) - optional, the ncdu metadata (progname, timestamp ...)
+    With track_offsets the folders events also get the byte range of the folder in the input:
+        - start_dir(info: dict, start: int) - offset of the '[' opening the folder
+        - end_dir(end: int) - offset after its closing ']'
+    that range can be parsed alone later with parse_range().
+    """
+    # read 1MB chunks, same as FileUtils
+    buf_size = 1024 * 1024
+    # whitespaces and commas have no meaning for us, the ncdu export has one entry per line
+    skip_re = re.compile(r'[\s,]*')
+
+    # states of the opened lists
+    LIST_NEW = 0    # nothing read yet
+    LIST_DIR = 1    # first element was a dict => it is a folder
+    LIST_OTHER = 2  # top level list
+
+    def __init__(self, handler, progress_callback = None, track_offsets: bool = False):
+        """
+        @param: handler - receives the parsing events, see the class description
+        @param: progress_callback - optional, called after every chunk with
+                (bytes_read, total_bytes), total_bytes is None when unknown (pipes)
+        @param: track_offsets - send the folders byte ranges to the handler
+        """
+        self.handler = handler
+        self.progress_callback = progress_callback
+        self.track_offsets = track_offsets
+        self.bytes_read = 0
+        # set by parse_range(): offset of the input start, bytes to read, a single folder is parsed
+        self.start_offset = 0
+        self.bytes_left = None
+        self.subtree = False
+
+    def parse_file(self, ncdu_data_file : str) -> None:
+        """
+        Parse the json file ncdu_data_file
+        """
+        total_bytes = os.path.getsize(ncdu_data_file)
+        with open(ncdu_data_file, "rb") as fh:
+            self.parse_stream(fh, total_bytes)
+
+    def parse_range(self, fh, start: int, end: int) -> None:
+        """
+        Parse only the folder between the offsets start and end (see track_offsets)
+        @param: fh - seekable binary file object
+        """
+        fh.seek(start)
+        self.start_offset = start
+        self.bytes_left = end - start
+        self.subtree = True
+        self.parse_stream(fh, end - start)
+
+    def parse_stream(self, fh, total_bytes = None, input_position = None) -> None:
+        """
+        Parse from a binary file object, it could be also a pipe (e.g. stdout of 'ncdu -o -').
+        @param: fh - object with read(size) method returning bytes
+        @param: total_bytes - the expected size, used only to report the progress
+        @param: input_position - optional, returns the bytes read so far when fh decompresses
+                another file, then total_bytes is that file size
+        """
+        handler = self.handler
+        start_dir = handler.start_dir
+        add_file = handler.add_file
+        end_dir = handler.end_dir
+        set_metadata = getattr(handler, "set_metadata", None)
+        decode = json.JSONDecoder().raw_decode
+        skip = self.skip_re.match
+        # ncdu may write invalid utf-8 names, the bad bytes are kept as surrogates (like os.fsdecode()),
+        # so the names are encoded back to the same bytes and the offsets are exact
+        text_decoder = codecs.getincrementaldecoder("utf-8")(errors = "surrogateescape")
+        track_offsets = self.track_offsets
+
+        def read_chunk():
+            """ Returns (next decoded chunk, True if end of input) """
+            size = self.buf_size
+            if self.bytes_left is not None:
+                size = min(size, self.bytes_left)
+                self.bytes_left -= size
+            chunk = fh.read(size) if size else b""
+            self.bytes_read = self.bytes_read + len(chunk) if input_position is None else input_position()
+            if self.progress_callback is not None:
+                self.progress_callback(self.bytes_read, total_bytes)
+            return text_decoder.decode(chunk, final = not chunk), not chunk
+
+        # a single folder is parsed as if it was in the top level list
+        top_lists = [self.LIST_OTHER] if self.subtree else []
+        lists = list(top_lists)
+        # offsets of the opened lists, only with track_offsets
+        list_starts = [None] * len(lists)
+        buf = ""
+        pos = 0
+        eof = False
+        # byte offset in the input of the char buf[cursor], moved forward only
+        cursor = 0
+        cursor_offset = self.start_offset
+
+        def get_offset(pos: int) -> int:
+            """ Returns the byte offset in the input of the char buf[pos], pos >= cursor """
+            nonlocal cursor, cursor_offset
+            text = buf[cursor:pos]
+            cursor_offset += len(text) if text.isascii() else len(text.encode("utf-8", "surrogateescape"))
+            cursor = pos
+            return cursor_offset
+
+        while True:
+            pos = skip(buf, pos).end()
+            if pos >= len(buf) or (buf[pos] not in "[]" and not eof and len(buf) - pos < 64):
+                # keep a small margin, so a number is not split between two chunks
+                if eof:
+                    break
+                chunk, eof = read_chunk()
+                if track_offsets:
+                    get_offset(pos)
+                    cursor = 0
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+            ch = buf[pos]
+            if ch == "[":
+                lists.append(self.LIST_NEW)
+                if track_offsets:
+                    list_starts.append(get_offset(pos))
+                pos += 1
+            elif ch == "]":
+                if lists.pop() == self.LIST_DIR:
+                    if track_offsets:
+                        end_dir(get_offset(pos + 1))
+                    else:
+                        end_dir()
+                if track_offsets:
+                    list_starts.pop()
+                pos += 1
+            else:
+                try:
+                    value, end = decode(buf, pos)
+                except ValueError:
+                    if eof:
+                        raise
+                    # the entry continues in the next chunk
+                    chunk, eof = read_chunk()
+                    if track_offsets:
+                        get_offset(pos)
+                        cursor = 0
+                    buf = buf[pos:] + chunk
+                    pos = 0
+                    continue
+                pos = end
+                if type(value) is not dict:
+                    # version numbers from the header
+                    if lists and lists[-1] == self.LIST_NEW:
+                        lists[-1] = self.LIST_OTHER
+                    continue
+                if len(lists) < 2:
+                    if set_metadata is not None:
+                        set_metadata(value)
+                elif lists[-1] == self.LIST_NEW:
+                    lists[-1] = self.LIST_DIR
+                    if track_offsets:
+                        start_dir(value, list_starts[-1])
+                    else:
+                        start_dir(value)
+                else:
+                    add_file(value)
+        if lists != top_lists:
+            raise ValueError("Unexpected end of ncdu data, {} lists not closed".format(len(lists)))
+
+
+class CborDecoder:
+    """
+    Minimal CBOR decoder, enough for the ncdu binary export items, used when cbor2 is not installed:
+    integers, byte and text strings, arrays, maps (also indefinite length), tags and simple values.
+    """
+    # additional info -> size of the argument in bytes
+    arg_sizes = {24: 1, 25: 2, 26: 4, 27: 8}
+    simple_values = {20: False, 21: True, 22: None, 23: None}
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def read_arg(self, info: int, pos: int):
+        """ Returns (argument value, position after it) """
+        if info < 24:
+            return info, pos
+        size = self.arg_sizes.get(info)
+        if size is None:
+            # 31, indefinite length
+            return None, pos
+        return int.from_bytes(self.data[pos:pos + size], "big"), pos + size
+
+    def decode(self, pos: int):
+        """ Returns (value, position after it) """
+        data = self.data
+        major = data[pos] >> 5
+        value, pos = self.read_arg(data[pos] & 0x1f, pos + 1)
+        if major == 0:
+            return value, pos
+        if major == 1:
+            return -1 - value, pos
+        if major in (2, 3):
+            if value is None:
+                # indefinite length, a list of chunks
+                chunks = []
+                while data[pos] != 0xff:
+                    chunk, pos = self.decode(pos)
+                    chunks.append(chunk)
+                value = (b"" if major == 2 else "").join(chunks)
+                return value, pos + 1
+            value, pos = data[pos:pos + value], pos + value
+            return (bytes(value) if major == 2 else str(value, "utf-8", "surrogateescape")), pos
+        if major == 4:
+            items = []
+            while (len(items) < value) if value is not None else (data[pos] != 0xff):
+                item, pos = self.decode(pos)
+                items.append(item)
+            return items, pos + (1 if value is None else 0)
+        if major == 5:
+            items = {}
+            while (len(items) < value) if value is not None else (data[pos] != 0xff):
+                key, pos = self.decode(pos)
+                items[key], pos = self.decode(pos)
+            return items, pos + (1 if value is None else 0)
+        if major == 6:
+            # tags are not used by ncdu, only the tagged value is kept
+            return self.decode(pos)
+        return self.simple_values.get(data[pos - 1] & 0x1f, value), pos
+
+
+class NcduBinaryParser:
+    """
+    Parser for the ncdu binary export ('ncdu -O ...', ncdu >= 2.6), same handler events as NcduJsonParser.
+    The file is a signature, then blocks: [4 bytes type << 28 | length][content][4 bytes length].
+        - data blocks (type 0): block number (4 bytes) + zstd compressed CBOR items
+        - the index block (type 1), the last one: 8 bytes per data block (offset << 24 | length),
+          then the reference of the root item
+    An item is a CBOR map with integer keys, it references other items by "itemref":
+    block number << 24 | offset in the decompressed block, or negative, relative to the current item.
+    A folder references its last child ("sub"), every item its previous sibling ("prev").
+    The items are written bottom up, so the folders are walked from the root following the references,
+    only a few decompressed blocks are kept.
+    With track_offsets the start of a folder range is its item reference and the end is None.
+    """
+    # item keys
+    TYPE, NAME, PREV, ASIZE, DSIZE, SUB, UID, MTIME = 0, 1, 2, 3, 4, 12, 15, 18
+    # item types: 0 folder, 1 file, 2 other (device, fifo ...), 3 hard link, negative excluded
+    TYPE_DIR = 0
+    excluded_types = {-1: "error", -2: "pattern", -3: "otherfs", -4: "kernfs"}
+    # how many decompressed blocks are kept
+    max_cached_blocks = 16
+
+    def __init__(self, handler, progress_callback = None, track_offsets: bool = False):
+        """
+        @param: handler - receives the parsing events, see NcduJsonParser
+        @param: progress_callback - optional, called with (bytes_read, total_bytes),
+                bytes_read counts the compressed blocks read so far
+        @param: track_offsets - see NcduJsonParser
+        """
+        if zstd is None and zstandard is None:
+            raise ValueError("Reading ncdu binary exports needs Python >= 3.14 or the zstandard package")
+        self.handler = handler
+        self.progress_callback = progress_callback
+        self.track_offsets = track_offsets
+        self.bytes_read = 0
+        self.fh = None
+        self.total_bytes = None
+        self.blocks_index = []
+        self.blocks = collections.OrderedDict()
+        self.blocks_seen = set()
+
+    def parse_file(self, ncdu_data_file: str) -> None:
+        total_bytes = os.path.getsize(ncdu_data_file)
+        with open(ncdu_data_file, "rb") as fh:
+            self.parse_stream(fh, total_bytes)
+
+    def parse_stream(self, fh, total_bytes: int = None) -> None:
+        """
+        @param: fh - seekable binary file object, starting with the signature
+        """
+        self.fh = fh
+        self.total_bytes = total_bytes
+        if fh.read(len(NcduInput.BINARY_SIGNATURE)) != NcduInput.BINARY_SIGNATURE:
+            raise ValueError("Not an ncdu binary export")
+        root = self.read_index()
+        self.walk(root)
+
+    def parse_range(self, fh, start: int, end: int = None) -> None:
+        """
+        Parse only the folder with the item reference start (see track_offsets)
+        """
+        self.fh = fh
+        self.read_index()
+        self.walk(start)
+
+    def read_index(self) -> int:
+        """
+        Read the index block at the end of the file, returns the root item reference
+        """
+        fh = self.fh
+        fh.seek(-4, os.SEEK_END)
+        length = struct.unpack(">I", fh.read(4))[0] & 0x0fffffff
+        fh.seek(-length, os.SEEK_END)
+        header = struct.unpack(">I", fh.read(4))[0]
+        if header >> 28 != 1 or header & 0x0fffffff != length:
+            raise ValueError("Invalid ncdu binary export, no index block at the end")
+        content = fh.read(length - 8)
+        pointers = struct.unpack(">{}Q".format(len(content) // 8), content)
+        self.blocks_index = [(p >> 24, p & 0xffffff) for p in pointers[:-1]]
+        return pointers[-1]
+
+    def get_block(self, number: int):
+        """
+        Returns the items decoder of the decompressed data block number, a function: offset -> item
+        """
+        decode_at = self.blocks.get(number)
+        if decode_at is not None:
+            self.blocks.move_to_end(number)
+            return decode_at
+        offset, length = self.blocks_index[number]
+        self.fh.seek(offset)
+        block = self.fh.read(length)
+        # header (4 bytes), block number (4 bytes), compressed data, footer (4 bytes)
+        if zstd is not None:
+            data = zstd.decompress(block[8:-4])
+        else:
+            data = zstandard.ZstdDecompressor().decompressobj().decompress(block[8:-4])
+        if cbor2 is not None:
+            decoder = cbor2.CBORDecoder(io.BytesIO(data))
+            seek = decoder.fp.seek
+            decode = decoder.decode
+            def decode_at(offset):
+                seek(offset)
+                return decode()
+        else:
+            decode = CborDecoder(data).decode
+            decode_at = lambda offset: decode(offset)[0]
+        self.blocks[number] = decode_at
+        if len(self.blocks) > self.max_cached_blocks:
+            self.blocks.popitem(last = False)
+        if number not in self.blocks_seen:
+            self.blocks_seen.add(number)
+            self.bytes_read += length
+            if self.progress_callback is not None:
+                self.progress_callback(self.bytes_read, self.total_bytes)
+        return decode_at
+
+    def get_info(self, item: dict) -> dict:
+        """
+        Returns the item as the json export entry dict (name, asize, dsize, uid, mtime ...)
+        """
+        get = item.get
+        name = get(self.NAME, b"")
+        if name.__class__ is bytes:
+            name = name.decode("utf-8", "surrogateescape")
+        info = {"name": name, "asize": get(self.ASIZE, 0), "dsize": get(self.DSIZE, 0),
+                "mtime": get(self.MTIME, 0)}
+        uid = get(self.UID)
+        if uid is not None:
+            info["uid"] = uid
+        if get(self.TYPE, 0) < 0:
+            excluded = self.excluded_types.get(get(self.TYPE), "error")
+            if excluded == "error":
+                info["read_error"] = True
+            else:
+                info["excluded"] = excluded
+        return info
+
+    def get_children(self, item: dict, ref: int) -> list:
+        """
+        Returns the (item, reference) of the children of the folder item, in the written order
+        """
+        children = []
+        PREV = self.PREV # loop optimization
+        child_ref = item.get(self.SUB)
+        block_number = -1
+        while child_ref is not None:
+            if child_ref < 0:
+                # relative to the item holding it
+                child_ref += ref
+            ref = child_ref
+            # the siblings are usually in the same block
+            if ref >> 24 != block_number:
+                block_number = ref >> 24
+                decode_at = self.get_block(block_number)
+            child = decode_at(ref & 0xffffff)
+            children.append((child, ref))
+            child_ref = child.get(PREV)
+        children.reverse()
+        return children
+
+    def walk(self, root: int) -> None:
+        """
+        Send the handler events, depth first from the root, with an explicit stack
+        """
+        handler = self.handler
+        start_dir = handler.start_dir
+        add_file = handler.add_file
+        end_dir = handler.end_dir
+        track_offsets = self.track_offsets
+        item = self.get_block(root >> 24)(root & 0xffffff)
+        ref = root
+        if track_offsets:
+            start_dir(self.get_info(item), ref)
+        else:
+            start_dir(self.get_info(item))
+        # iterators over the children of the opened folders
+        stack = [iter(self.get_children(item, ref))]
+        get_info = self.get_info # loop optimization
+        TYPE, TYPE_DIR = self.TYPE, self.TYPE_DIR
+        while stack:
+            for item, ref in stack[-1]:
+                if item.get(TYPE) == TYPE_DIR:
+                    if track_offsets:
+                        start_dir(get_info(item), ref)
+                    else:
+                        start_dir(get_info(item))
+                    stack.append(iter(self.get_children(item, ref)))
+                    break
+                add_file(get_info(item))
+            else:
+                stack.pop()
+                if track_offsets:
+                    end_dir(None)
+                else:
+                    end_dir()
+
+
+class NcduJsonWriter:
+    """
+    Write a files tree in the 'ncdu -o ...' json format, it can be loaded back
+    with 'ncdu -f file.json' or with NcduJsonParser.
+    Only the attributes kept in the tree are written: name, asize, dsize, uid, mtime.
+    """
+    # ncdu export format version
+    MAJOR_VERSION = 1
+    MINOR_VERSION = 2
+
+    @classmethod
+    def write(cls, tree, root: int, fh) -> None:
+        """
+        @param: tree - a file_tree.FileTree
+        @param: root - index of the folder to be written
+        @param: fh - text file object, opened with utf-8 encoding
+        """
+        fh.write(json.dumps([cls.MAJOR_VERSION, cls.MINOR_VERSION,
+                {"progname": "pyncdu-gui", "progver": "1.0", "timestamp": int(time.time())}])[:-1])
+        for idx, entering in tree.iter_events(root):
+            if not entering:
+                fh.write("]")
+                continue
+            info = {"name": tree.get_name(idx), "asize": tree.asize[idx],
+                    "dsize": tree.dsize[idx], "uid": tree.uid[idx]}
+            if tree.mtime[idx]:
+                info["mtime"] = tree.mtime[idx]
+            info = json.dumps(info)
+            if tree.is_dir(idx):
+                fh.write(",\n[" + info)
+            else:
+                fh.write(",\n" + info)
+        fh.write("]\n")
@@ -0,0 +1,207 @@
+"""
+Lightweight spans/timers around the pipeline phases, dumped as json with '--profile'.
+"""
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+logger = logging.getLogger('PYNCDU')
+
+
+class NullSpan:
+    """ Returned by Profiler.span() when profiling is off, it does nothing """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class Span:
+    """
+    One measured run of a phase: wall time, CPU time of the thread,
+    allocated memory blocks and RSS delta.
+    """
+    __slots__ = ("name", "parent", "start", "cpu_start", "blocks_start", "rss_start", "capture")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        stack = Profiler.get_stack()
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self.capture = Profiler.start_capture(self.name)
+        self.rss_start = Profiler.get_rss()
+        self.blocks_start = sys.getallocatedblocks()
+        self.cpu_start = time.thread_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter()
+        cpu_end = time.thread_time()
+        blocks_end = sys.getallocatedblocks()
+        rss_end = Profiler.get_rss()
+        if self.capture:
+            Profiler.stop_capture(self.name)
+        Profiler.get_stack().pop()
+        Profiler.add_record({"name": self.name, "parent": self.parent,
+                "thread": threading.current_thread().name,
+                "start": round(self.start - Profiler.start_time, 6),
+                "wall": round(end - self.start, 6), "cpu": round(cpu_end - self.cpu_start, 6),
+                "allocated_blocks": blocks_end - self.blocks_start,
+                "rss_delta": rss_end - self.rss_start, "error": exc_info[0] is not None})
+        return False
+
+
+class Profiler:
+    """
+    Usage: with Profiler.span("sort"): ...
+    When not enabled span() returns the same NullSpan, so the cost is one function call.
+    Optionally the runs of one span are also captured with cProfile (functions stats)
+    or tracemalloc (allocations by line).
+    """
+    enabled = False
+    start_time = 0.0
+    records = []
+    lock = threading.Lock()
+    local = threading.local()
+    # name of the captured span and how: "cprofile" or "tracemalloc"
+    capture_span = None
+    capture_mode = "cprofile"
+    cprofile = None
+    tracemalloc_snapshot = None
+    tracemalloc_stats = None
+    null_span = NullSpan()
+    # how many functions/lines are dumped from the capture
+    capture_top = 30
+
+    @classmethod
+    def enable(cls, capture_span: str = None, capture_mode: str = "cprofile") -> None:
+        cls.enabled = True
+        cls.start_time = time.perf_counter()
+        cls.records = []
+        cls.capture_span = capture_span
+        cls.capture_mode = capture_mode
+
+    @classmethod
+    def span(cls, name: str):
+        if not cls.enabled:
+            return cls.null_span
+        return Span(name)
+
+    @classmethod
+    def get_stack(cls) -> list:
+        """ The opened spans of the current thread """
+        stack = getattr(cls.local, "stack", None)
+        if stack is None:
+            stack = cls.local.stack = []
+        return stack
+
+    @classmethod
+    def get_rss(cls) -> int:
+        """ Resident memory in bytes, from /proc (Linux), 0 if not available """
+        try:
+            with open("/proc/self/statm") as fh:
+                return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            return 0
+
+    @classmethod
+    def add_record(cls, record: dict) -> None:
+        with cls.lock:
+            cls.records.append(record)
+
+    @classmethod
+    def start_capture(cls, name: str) -> bool:
+        """
+        Start the capture if name is the captured span, and it is not already running
+        """
+        if name != cls.capture_span:
+            return False
+        if cls.capture_mode == "cprofile":
+            if cls.cprofile is None:
+                cls.cprofile = cProfile.Profile()
+            try:
+                # cProfile sees only the calling thread, one capture at a time
+                cls.cprofile.enable()
+            except ValueError:
+                return False
+            return True
+        if tracemalloc.is_tracing():
+            return False
+        tracemalloc.start()
+        cls.tracemalloc_snapshot = tracemalloc.take_snapshot()
+        return True
+
+    @classmethod
+    def stop_capture(cls, name: str) -> None:
+        if cls.capture_mode == "cprofile":
+            cls.cprofile.disable()
+            return
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        stats = snapshot.compare_to(cls.tracemalloc_snapshot, "lineno")
+        if cls.tracemalloc_stats is None:
+            cls.tracemalloc_stats = {}
+        # keep the sum of all the runs
+        for stat in stats:
+            key = str(stat.traceback[0])
+            size, count = cls.tracemalloc_stats.get(key, (0, 0))
+            cls.tracemalloc_stats[key] = (size + stat.size_diff, count + stat.count_diff)
+        cls.tracemalloc_snapshot = None
+
+    @classmethod
+    def get_summary(cls) -> dict:
+        """
+        Returns span name -> count and totals of the runs
+        """
+        summary = {}
+        for record in cls.records:
+            s = summary.setdefault(record["name"], {"count": 0, "wall": 0.0, "cpu": 0.0,
+                    "allocated_blocks": 0, "rss_delta": 0})
+            s["count"] += 1
+            for key in ("wall", "cpu", "allocated_blocks", "rss_delta"):
+                s[key] += record[key]
+        for s in summary.values():
+            s["wall"] = round(s["wall"], 6)
+            s["cpu"] = round(s["cpu"], 6)
+        return summary
+
+    @classmethod
+    def get_capture(cls) -> dict:
+        if cls.capture_span is None:
+            return None
+        capture = {"span": cls.capture_span, "mode": cls.capture_mode}
+        if cls.cprofile is not None:
+            out = io.StringIO()
+            pstats.Stats(cls.cprofile, stream = out).sort_stats("cumulative").print_stats(cls.capture_top)
+            capture["stats"] = out.getvalue().splitlines()
+        elif cls.tracemalloc_stats is not None:
+            top = sorted(cls.tracemalloc_stats.items(), key = lambda s: s[1][0], reverse = True)
+            capture["stats"] = [{"line": line, "size_diff": size, "count_diff": count}
+                                for line, (size, count) in top[:cls.capture_top]]
+        return capture
+
+    @classmethod
+    def dump(cls, out_file: str) -> None:
+        """
+        Write the spans, their summary and the capture to out_file as json
+        """
+        if not cls.enabled:
+            return
+        with cls.lock:
+            data = {"summary": cls.get_summary(), "capture": cls.get_capture(), "spans": cls.records}
+        with open(out_file, "w") as fh:
+            json.dump(data, fh, indent = 1)
+        logger.info("Profile saved to {}".format(out_file))
@@ -0,0 +1,173 @@
+"""
+Headless report of the biggest folders and files, overall and per owner, no GUI needed.
+"""
+import csv
+import heapq
+import json
+import logging
+
+from breakdown import Breakdown
+from file_info import FileInfo, FileUtils
+from file_tree import FLAG_DIR, FLAG_SUMMARY
+from profiler import Profiler
+
+logger = logging.getLogger('PYNCDU')
+
+
+class Report:
+    """
+    Top N biggest folders and files of a files tree, overall and for every owner.
+    Only the top N are selected, with heaps (heapq.nlargest) over the hierarchy sizes arrays,
+    the children are never sorted.
+    """
+    FORMATS = ("json", "csv", "text")
+
+    def __init__(self, root_file: FileInfo, top: int = 20, breakdown: bool = False):
+        """
+        @param: root_file - the folder to report, usually the loaded root
+        @param: top - how many folders and files are reported in every top
+        @param: breakdown - add the sizes by extension, by age and by owner x age (see Breakdown)
+        """
+        self.root_file = root_file
+        self.tree = root_file.tree
+        self.top = top
+        self.breakdown = breakdown
+
+    def iter_entries(self):
+        """
+        Yields (index, is folder) for every entry below the root, the detached entries are never reached.
+        The summaries of collapsed folders (see CollapsingTreeBuilder) are not files, they are skipped,
+        their sizes are still in the folders sizes.
+        """
+        tree = self.tree
+        flags = tree.flags # loop optimization
+        entries = tree.iter_preorder(self.root_file.index)
+        # the root is not reported, its size is the total
+        next(entries)
+        for idx in entries:
+            if not flags[idx] & FLAG_SUMMARY:
+                yield idx, bool(flags[idx] & FLAG_DIR)
+
+    def get_top(self, uids: frozenset = None) -> dict:
+        """
+        Returns the total size and the top folders/files as lists of (path, size)
+        @param: uids - only the sizes owned by these uids, None means all owners
+        """
+        sizes = self.tree.get_hierarchy_sizes(uids)
+        dirs = []
+        files = []
+        if uids is None:
+            for idx, is_dir in self.iter_entries():
+                (dirs if is_dir else files).append(idx)
+        else:
+            uid = self.tree.uid
+            for idx, is_dir in self.iter_entries():
+                if is_dir:
+                    if sizes[idx]:
+                        dirs.append(idx)
+                elif uid[idx] in uids:
+                    files.append(idx)
+        top = {"total": sizes[self.root_file.index]}
+        for name, indexes in (("dirs", dirs), ("files", files)):
+            top[name] = [(self.tree.get_path(idx), sizes[idx])
+                         for idx in heapq.nlargest(self.top, indexes, key = sizes.__getitem__)]
+        return top
+
+    def get_owners(self) -> list:
+        """
+        Returns the usernames owning entries of the tree
+        """
+        owners = set(FileUtils.get_owner_by_uid(uid) for uid in self.tree.get_uids())
+        # "*" is returned for the uids without a username, they are counted only in the overall top
+        owners.discard("*")
+        return sorted(owners)
+
+    def build(self) -> dict:
+        """
+        Returns the report as a dict: the overall top, then the top of every owner
+        """
+        logger.info("Building the report, top {} ...".format(self.top))
+        report = {"root": self.root_file.path, "top": self.top, "all": self.get_top()}
+        report["owners"] = {owner: self.get_top(FileUtils.get_uids_by_owner(owner))
+                            for owner in self.get_owners()}
+        if self.breakdown:
+            report["breakdown"] = self.get_breakdown()
+        return report
+
+    def get_breakdown(self) -> dict:
+        """
+        Returns the breakdowns of all the files below the root, the extensions limited to the top N
+        """
+        breakdown = Breakdown(self.tree, self.root_file.index)
+        return {"extension": [list(g) for g in breakdown.by_extension()[:self.top]],
+                "age": [list(g) for g in breakdown.by_age()],
+                "owner_age": [list(g) for g in breakdown.by_owner_age()]}
+
+    def write(self, fh, report_format: str = "text") -> None:
+        """
+        Write the report to the text file object fh in one of FORMATS
+        """
+        with Profiler.span("report"):
+            report = self.build()
+        getattr(self, "write_" + report_format)(report, fh)
+
+    @classmethod
+    def iter_rows(cls, report: dict):
+        """
+        Yields (owner, kind, rank, size, path), owner is "*" for the overall top
+        """
+        sections = [("*", report["all"])] + list(report["owners"].items())
+        for owner, top in sections:
+            yield owner, "total", 0, top["total"], report["root"]
+            for kind in ("dirs", "files"):
+                for rank, (path, size) in enumerate(top[kind], 1):
+                    yield owner, kind[:-1], rank, size, path
+        breakdown = report.get("breakdown")
+        if breakdown is None:
+            return
+        # the extension or the age label is in the path column
+        for kind in ("extension", "age"):
+            for rank, (key, size, count) in enumerate(breakdown[kind], 1):
+                yield "*", kind, rank, size, key
+        ranks = {}
+        for owner, label, size, count in breakdown["owner_age"]:
+            ranks[owner] = ranks.get(owner, 0) + 1
+            yield owner, "age", ranks[owner], size, label
+
+    @classmethod
+    def write_json(cls, report: dict, fh) -> None:
+        json.dump(report, fh, indent = 2)
+        fh.write("\n")
+
+    @classmethod
+    def write_csv(cls, report: dict, fh) -> None:
+        writer = csv.writer(fh)
+        writer.writerow(("owner", "kind", "rank", "size", "path"))
+        writer.writerows(cls.iter_rows(report))
+
+    @classmethod
+    def write_text(cls, report: dict, fh) -> None:
+        const_multiplier = 1.0/1024/1024 # to transform file size in MB
+        for owner, kind, rank, size, path in cls.iter_rows(report):
+            if kind in ("extension", "age"):
+                # the breakdown rows are the last ones, written with their files count below
+                break
+            if kind == "total":
+                fh.write("\nOwned by {}: {:.3f} MB in {}\n".format(owner, size * const_multiplier, path))
+            else:
+                if rank == 1:
+                    fh.write("  Top {} {}s:\n".format(report["top"], kind))
+                fh.write("  {:4d}. {:12.3f} MB  {}\n".format(rank, size * const_multiplier, path))
+        breakdown = report.get("breakdown")
+        if breakdown is None:
+            return
+        fh.write("\nSize by extension (top {}):\n".format(report["top"]))
+        for ext, size, count in breakdown["extension"]:
+            fh.write("  {:>10} {:12.3f} MB {:10d} files\n".format(ext, size * const_multiplier, count))
+        fh.write("\nSize by modification age:\n")
+        for label, size, count in breakdown["age"]:
+            fh.write("  {:>16} {:12.3f} MB {:10d} files\n".format(label, size * const_multiplier, count))
+        fh.write("\nSize by owner and modification age:\n")
+        for owner, label, size, count in breakdown["owner_age"]:
+            fh.write("  {:>12} {:>16} {:12.3f} MB {:10d} files\n".format(
+                    owner, label, size * const_multiplier, count))
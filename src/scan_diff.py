@@ -0,0 +1,196 @@
+"""
+Compare an older ncdu export with the loaded files tree.
+"""
+from array import array
+
+from file_tree import FileTree, NO_NODE
+from ncdu_parser import NcduInput
+
+
+class DeltaSizes:
+    """
+    Indexable like the hierarchy sizes arrays, returns new size - old size,
+    so it can be used to sort the children by growth (see FileTree.sort_children).
+    """
+    def __init__(self, new_sizes, old_sizes):
+        self.new_sizes = new_sizes
+        self.old_sizes = old_sizes
+
+    def __getitem__(self, idx: int) -> int:
+        return self.new_sizes[idx] - self.old_sizes[idx]
+
+
+class ScanDiff:
+    """
+    Sizes from an older scan, matched on the entries of the current FileTree.
+    The older export is streamed (NcduJsonParser events), it is never kept as a tree:
+    every old entry is matched by name inside its already matched parent folder,
+    with a name -> index dict only for the folders currently open in the old export.
+    So it is one linear pass, and it keeps only 12 bytes per entry of the current tree:
+        - old_dsize - old size on disk of the matched entry, 0 for new entries
+        - old_uid - old owner of the matched entry
+    plus, for the folders having removed content, uid -> size of the removed entries.
+    """
+    # how many old hierarchy sizes arrays are kept
+    max_cached_sizes = 3
+
+    def __init__(self):
+        self.tree = None
+        self.root = NO_NODE
+        self.old_dsize = array('Q')
+        self.old_uid = array('I')
+        # folder index -> {uid: size}, old entries missing in the current tree
+        self.removed = {}
+        # cached old hierarchy sizes, the key is None for all owners or a frozenset of uids
+        self.old_hier_sizes = {}
+        self.matched_counter = 0
+        self.uids = set()
+        # open folders of the old export as [matched index, nearest matched folder, children by name]
+        self.dirs_stack = []
+
+    def load_old(self, ncdu_data_file: str, tree: FileTree, root: int, progress_callback = None) -> None:
+        """
+        Stream the older export ncdu_data_file and match it on tree.
+        @param: progress_callback - optional, called with (bytes_read, total_bytes, matched entries)
+        """
+        self.tree = tree
+        self.root = root
+        self.old_dsize = array('Q', bytes(8 * len(tree)))
+        self.old_uid = array('I', bytes(4 * len(tree)))
+        self.removed = {}
+        self.old_hier_sizes = {}
+        self.matched_counter = 0
+        self.uids = set()
+        self.dirs_stack = []
+        on_progress = None
+        if progress_callback is not None:
+            on_progress = lambda bytes_read, total_bytes: progress_callback(
+                    bytes_read, total_bytes, self.matched_counter)
+        NcduInput.parse_file(ncdu_data_file, self, on_progress)
+
+    def match_entry(self, info: dict) -> int:
+        """
+        Find the current entry of an old entry, returns NO_NODE if it does not exist anymore.
+        The old size is saved on the matched entry, or added as removed to the nearest matched folder.
+        """
+        parent_idx, nearest_idx, children = self.dirs_stack[-1]
+        asize = info.get("asize", 0)
+        dsize = info.get("dsize", asize)
+        self.uids.add(info["uid"])
+        idx = NO_NODE
+        if parent_idx != NO_NODE:
+            if children is None:
+                children = {self.tree.get_name(c): c for c in self.tree.iter_children(parent_idx)}
+                self.dirs_stack[-1][2] = children
+            idx = children.get(info["name"], NO_NODE)
+        if idx == NO_NODE:
+            removed = self.removed.setdefault(nearest_idx, {})
+            removed[info["uid"]] = removed.get(info["uid"], 0) + dsize
+        else:
+            self.old_dsize[idx] = dsize
+            self.old_uid[idx] = info["uid"]
+            self.matched_counter += 1
+        return idx
+
+    # NcduJsonParser handler methods, same filters as FileTreeBuilder
+    def start_dir(self, info: dict):
+        if not self.dirs_stack:
+            # the root is matched whatever its name is
+            self.old_dsize[self.root] = info.get("dsize", info.get("asize", 0))
+            self.old_uid[self.root] = info["uid"]
+            self.uids.add(info["uid"])
+            self.dirs_stack.append([self.root, self.root, None])
+            return
+        nearest_idx = self.dirs_stack[-1][1]
+        if nearest_idx == NO_NODE or info.get("uid", None) is None:
+            # skipped sub tree
+            self.dirs_stack.append([NO_NODE, NO_NODE, None])
+            return
+        idx = self.match_entry(info)
+        if idx != NO_NODE and not self.tree.is_dir(idx):
+            # it was a folder, now it is a file, count the old content as removed
+            idx = NO_NODE
+        self.dirs_stack.append([idx, idx if idx != NO_NODE else nearest_idx, None])
+
+    def add_file(self, info: dict):
+        if (self.dirs_stack[-1][1] == NO_NODE or info.get("excluded", False)
+                or info.get("uid", None) is None):
+            return
+        self.match_entry(info)
+
+    def end_dir(self):
+        self.dirs_stack.pop()
+
+    def forget_subtree(self, idx: int) -> None:
+        """
+        Must be called before the content of the folder idx is replaced (e.g. rescan):
+        the old sizes of its content are kept as removed on idx, so the totals stay right,
+        the new entries have no old size.
+        """
+        removed = self.removed.setdefault(idx, {})
+        entries = self.tree.iter_preorder(idx)
+        # only the content, idx keeps its own old size
+        next(entries)
+        for i in entries:
+            if i < len(self.old_dsize) and self.old_dsize[i]:
+                uid = self.old_uid[i]
+                removed[uid] = removed.get(uid, 0) + self.old_dsize[i]
+            for uid, size in self.removed.pop(i, {}).items():
+                removed[uid] = removed.get(uid, 0) + size
+        self.old_hier_sizes = {}
+
+    def get_uids(self) -> set:
+        """
+        Returns the owners ids of the older scan, including the removed entries
+        """
+        return self.uids
+
+    def get_old_hierarchy_sizes(self, uids: frozenset = None) -> array:
+        """
+        Returns the old disk size of every current entry together with its sub tree.
+        @param: uids - count only the entries owned by these uids, None means all owners
+        """
+        # entries added after the diff was loaded (e.g. rescan) are new
+        missing = len(self.tree) - len(self.old_dsize)
+        if missing > 0:
+            self.old_dsize.frombytes(bytes(8 * missing))
+            self.old_uid.frombytes(bytes(4 * missing))
+            self.old_hier_sizes = {}
+        sizes = self.old_hier_sizes.get(uids, None)
+        if sizes is not None:
+            return sizes
+        if uids is None:
+            sizes = array('Q', self.old_dsize)
+            for idx, removed in self.removed.items():
+                sizes[idx] += sum(removed.values())
+        else:
+            sizes = array('Q', (d if u in uids else 0 for d, u in zip(self.old_dsize, self.old_uid)))
+            for idx, removed in self.removed.items():
+                sizes[idx] += sum(size for uid, size in removed.items() if uid in uids)
+        self.tree.fold_up(sizes)
+        if len(self.old_hier_sizes) >= self.max_cached_sizes:
+            del self.old_hier_sizes[next(iter(self.old_hier_sizes))]
+        self.old_hier_sizes[uids] = sizes
+        return sizes
+
+    def get_old_own_size(self, idx: int, uids: frozenset = None) -> int:
+        """
+        Returns the old disk size of idx alone plus its removed content, the part of the
+        old hierarchy size which is not in the children ones (see get_old_hierarchy_sizes)
+        """
+        size = 0
+        if idx < len(self.old_dsize) and (uids is None or self.old_uid[idx] in uids):
+            size = self.old_dsize[idx]
+        return size + sum(s for uid, s in self.removed.get(idx, {}).items() if uids is None or uid in uids)
+
+    def get_delta_own_size(self, idx: int, uids: frozenset = None) -> int:
+        """
+        Returns the growth of idx alone, like get_delta_sizes() without the children
+        """
+        return self.tree.get_own_size(idx, uids) - self.get_old_own_size(idx, uids)
+
+    def get_delta_sizes(self, uids: frozenset = None) -> DeltaSizes:
+        """
+        Returns the growth (current - old size) of every entry, indexable by the entry index
+        """
+        return DeltaSizes(self.tree.get_hierarchy_sizes(uids), self.get_old_hierarchy_sizes(uids))
@@ -0,0 +1,306 @@
+"""
+History of the folders sizes over many scans, in a SQLite database.
+"""
+import csv
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from file_info import FileInfo, FileUtils
+from file_tree import FLAG_DIR
+from ncdu_parser import NcduInput
+from profiler import Profiler
+
+logger = logging.getLogger('PYNCDU')
+
+DAY = 24 * 3600
+
+
+class StopParsing(Exception):
+    """ Raised by the metadata handler, the export is not read further """
+
+
+class ExportMetadata:
+    """
+    Parser handler keeping only the ncdu metadata, it stops the parsing at the first entry
+    """
+    def __init__(self):
+        self.metadata = {}
+
+    def set_metadata(self, info: dict):
+        self.metadata = info
+        raise StopParsing()
+
+    def start_dir(self, *args):
+        raise StopParsing()
+
+    add_file = start_dir
+    end_dir = start_dir
+
+
+class ScanHistory:
+    """
+    Every ingested scan keeps only its folders sizes (hierarchy sizes), for all owners ("*")
+    and for every owner, not the files, so a scan is parsed once and then never loaded again.
+        - scans - time, root folder, source export and files count of every scan
+        - paths - a numeric id for every folder path, shared by all the scans
+        - owners - a numeric id for every owner name
+        - sizes - (path id, owner id, scan id) -> size on disk, only the not empty ones
+    The sizes primary key starts with the path, so the sizes of a folder over time are one
+    index range, and the (scan, owner) index gives the folders of one scan for the growers.
+    The paths are stored as utf-8 bytes, the names which are not valid utf-8 are kept as they are.
+    """
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS scans (id INTEGER PRIMARY KEY, time INTEGER NOT NULL,
+                root BLOB NOT NULL, source TEXT, files INTEGER NOT NULL, UNIQUE (root, time))""",
+        "CREATE TABLE IF NOT EXISTS paths (id INTEGER PRIMARY KEY, path BLOB NOT NULL UNIQUE)",
+        "CREATE TABLE IF NOT EXISTS owners (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)",
+        """CREATE TABLE IF NOT EXISTS sizes (path_id INTEGER NOT NULL, owner_id INTEGER NOT NULL,
+                scan_id INTEGER NOT NULL, dsize INTEGER NOT NULL,
+                PRIMARY KEY (path_id, owner_id, scan_id)) WITHOUT ROWID""",
+        "CREATE INDEX IF NOT EXISTS sizes_scan ON sizes (scan_id, owner_id)",
+    )
+    FORMATS = ("json", "csv", "text")
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self.connection = sqlite3.connect(db_file)
+        with self.connection:
+            for statement in self.SCHEMA:
+                self.connection.execute(statement)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    @classmethod
+    def encode_path(cls, path: str) -> bytes:
+        return path.encode("utf-8", "surrogateescape")
+
+    @classmethod
+    def decode_path(cls, path: bytes) -> str:
+        return str(path, "utf-8", "surrogateescape")
+
+    @classmethod
+    def get_export_time(cls, ncdu_data_file: str) -> int:
+        """
+        Returns the scan time of an export: the ncdu metadata timestamp, else the file modification time
+        """
+        handler = ExportMetadata()
+        try:
+            NcduInput.parse_file(ncdu_data_file, handler)
+        except StopParsing:
+            pass
+        timestamp = handler.metadata.get("timestamp")
+        if isinstance(timestamp, int) and timestamp > 0:
+            return timestamp
+        return int(os.path.getmtime(ncdu_data_file))
+
+    def get_id(self, table: str, column: str, value) -> int:
+        """
+        Returns the id of value in a paths/owners table, it is added if missing
+        """
+        cursor = self.connection.execute("SELECT id FROM {} WHERE {} = ?".format(table, column), (value,))
+        row = cursor.fetchone()
+        if row is not None:
+            return row[0]
+        return self.connection.execute("INSERT INTO {} ({}) VALUES (?)".format(table, column), (value,)).lastrowid
+
+    def find_id(self, table: str, column: str, value) -> int:
+        """
+        Same as get_id() but returns None when value is missing
+        """
+        row = self.connection.execute("SELECT id FROM {} WHERE {} = ?".format(table, column), (value,)).fetchone()
+        return None if row is None else row[0]
+
+    def get_path_ids(self, paths: list) -> list:
+        """
+        Returns the ids of the encoded paths, the missing ones are added.
+        The paths go through a temporary table, so all the ids are read by one select.
+        """
+        self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS new_paths (position INTEGER PRIMARY KEY, path BLOB NOT NULL)")
+        self.connection.execute("DELETE FROM new_paths")
+        self.connection.executemany("INSERT INTO new_paths (position, path) VALUES (?, ?)", enumerate(paths))
+        self.connection.execute("INSERT OR IGNORE INTO paths (path) SELECT path FROM new_paths")
+        path_ids = [path_id for path_id, in self.connection.execute(
+                "SELECT paths.id FROM new_paths JOIN paths ON paths.path = new_paths.path ORDER BY new_paths.position")]
+        self.connection.execute("DELETE FROM new_paths")
+        return path_ids
+
+    @classmethod
+    def merge_sizes(cls, parent_sizes: dict, sizes: dict) -> dict:
+        """
+        fold_up() function adding the {owner: size} of a folder to its parent folder ones,
+        the files have no dict of their own, None
+        """
+        if sizes and parent_sizes is not None:
+            for owner, size in sizes.items():
+                parent_sizes[owner] = parent_sizes.get(owner, 0) + size
+        return parent_sizes
+
+    def ingest(self, root_file: FileInfo, scan_time: int, source: str = None) -> int:
+        """
+        Store the sizes of all the folders below root_file, for all owners and for every owner.
+        A scan of the same root at the same time is stored only once.
+        @param: scan_time - seconds since epoch, see get_export_time()
+        @param: source - the export file, only informative
+        @return: the scan id, None if the scan was already stored
+        """
+        tree = root_file.tree
+        root = root_file.index
+        root_path = self.encode_path(root_file.path)
+        if self.connection.execute("SELECT id FROM scans WHERE root = ? AND time = ?",
+                                   (root_path, scan_time)).fetchone() is not None:
+            logger.info("Scan of {} at {} already in {}".format(root_file.path,
+                    time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(scan_time)), self.db_file))
+            return None
+        # the uids without username are counted only for all owners
+        owners = {}
+        for uid in tree.get_uids():
+            owner = FileUtils.get_owner_by_uid(uid)
+            if owner != "*":
+                owners[uid] = owner
+        with Profiler.span("history_ingest"), self.connection:
+            # the folders paths, built top down from their parent paths, and the size of every
+            # owner of the folders: the own size of every entry, merged into the folders by fold_up
+            flags = tree.flags # loop optimization
+            parent = tree.parent
+            uid = tree.uid
+            dsize = tree.dsize
+            paths = {}
+            owner_sizes = [None] * len(tree)
+            for idx in tree.iter_preorder(root):
+                if flags[idx] & FLAG_DIR:
+                    paths[idx] = (root_file.path if idx == root
+                                  else os.path.join(paths[parent[idx]], tree.get_name(idx)))
+                    sizes = owner_sizes[idx] = {}
+                else:
+                    sizes = owner_sizes[parent[idx]]
+                owner = owners.get(uid[idx])
+                if owner is not None and dsize[idx]:
+                    sizes[owner] = sizes.get(owner, 0) + dsize[idx]
+            tree.fold_up(owner_sizes, self.merge_sizes, root)
+            dirs = list(paths)
+            path_ids = self.get_path_ids([self.encode_path(paths[idx]) for idx in dirs])
+            scan_id = self.connection.execute("INSERT INTO scans (time, root, source, files) VALUES (?, ?, ?, ?)",
+                    (scan_time, root_path, source, len(tree))).lastrowid
+            owner_ids = {owner: self.get_id("owners", "name", owner) for owner in sorted(set(owners.values()))}
+            all_id = self.get_id("owners", "name", "*")
+            all_sizes = tree.get_hierarchy_sizes()
+            values = []
+            for idx, path_id in zip(dirs, path_ids):
+                if all_sizes[idx]:
+                    values.append((path_id, all_id, scan_id, all_sizes[idx]))
+                values.extend((path_id, owner_ids[owner], scan_id, size) for owner, size in owner_sizes[idx].items())
+            self.connection.executemany("INSERT INTO sizes (path_id, owner_id, scan_id, dsize) VALUES (?, ?, ?, ?)",
+                                        values)
+            rows = len(values)
+        logger.info("Scan of {} ingested in {}: {} folders, {} owners, {} sizes".format(
+                root_file.path, self.db_file, len(dirs), len(owner_ids), rows))
+        return scan_id
+
+    def get_scans(self) -> list:
+        """
+        Returns (scan id, time, root, source, files count) of all the scans, oldest first
+        """
+        return [(scan_id, scan_time, self.decode_path(root), source, files) for scan_id, scan_time, root, source, files
+                in self.connection.execute("SELECT id, time, root, source, files FROM scans ORDER BY time")]
+
+    def get_time_series(self, path: str, owner: str = "*") -> list:
+        """
+        Returns (scan time, size) of the folder path owned by owner, oldest first.
+        The scans where the folder is missing, or has nothing of owner, are not listed.
+        """
+        path_id = self.find_id("paths", "path", self.encode_path(path))
+        owner_id = self.find_id("owners", "name", owner)
+        if path_id is None or owner_id is None:
+            return []
+        with Profiler.span("history_query"):
+            return self.connection.execute("""SELECT scans.time, sizes.dsize FROM sizes
+                    JOIN scans ON scans.id = sizes.scan_id
+                    WHERE sizes.path_id = ? AND sizes.owner_id = ? ORDER BY scans.time""",
+                    (path_id, owner_id)).fetchall()
+
+    def get_top_growers(self, owner: str = "*", days: int = 30, top: int = 20, root: str = None) -> dict:
+        """
+        Returns the folders which grew the most for owner between the last scan of root
+        and the last scan at least days older (else the oldest one):
+            {"root", "owner", "from", "to" - the scans times, "growers" - list of (path, old size, new size)}
+        @param: root - the scanned folder, default the root of the last scan
+        """
+        result = {"root": root, "owner": owner, "from": None, "to": None, "growers": []}
+        query = "SELECT id, time, root FROM scans {} ORDER BY time DESC LIMIT 1"
+        if root is None:
+            last = self.connection.execute(query.format("")).fetchone()
+        else:
+            last = self.connection.execute(query.format("WHERE root = ?"), (self.encode_path(root),)).fetchone()
+        owner_id = self.find_id("owners", "name", owner)
+        if last is None or owner_id is None:
+            return result
+        last_id, last_time, root_path = last
+        base = self.connection.execute("SELECT id, time FROM scans WHERE root = ? AND time <= ? ORDER BY time DESC LIMIT 1",
+                (root_path, last_time - days * DAY)).fetchone()
+        if base is None:
+            base = self.connection.execute("SELECT id, time FROM scans WHERE root = ? ORDER BY time LIMIT 1",
+                    (root_path,)).fetchone()
+        base_id, base_time = base
+        result.update({"root": self.decode_path(root_path), "from": base_time, "to": last_time})
+        if base_id == last_id:
+            return result
+        with Profiler.span("history_query"):
+            rows = self.connection.execute("""SELECT paths.path, COALESCE(old.dsize, 0), new.dsize FROM sizes AS new
+                    JOIN paths ON paths.id = new.path_id
+                    LEFT JOIN sizes AS old ON old.path_id = new.path_id AND old.owner_id = new.owner_id
+                        AND old.scan_id = ?
+                    WHERE new.scan_id = ? AND new.owner_id = ? AND new.dsize > COALESCE(old.dsize, 0)
+                    ORDER BY new.dsize - COALESCE(old.dsize, 0) DESC LIMIT ?""",
+                    (base_id, last_id, owner_id, top)).fetchall()
+        result["growers"] = [(self.decode_path(path), old_size, new_size) for path, old_size, new_size in rows]
+        return result
+
+    @classmethod
+    def format_time(cls, scan_time: int) -> str:
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(scan_time)) if scan_time else "-"
+
+    @classmethod
+    def write_time_series(cls, path: str, owner: str, series: list, fh, report_format: str = "text") -> None:
+        """
+        Write the result of get_time_series() to the text file object fh in one of FORMATS
+        """
+        if report_format == "json":
+            json.dump({"path": path, "owner": owner, "sizes": series}, fh, indent = 2)
+            fh.write("\n")
+        elif report_format == "csv":
+            writer = csv.writer(fh)
+            writer.writerow(("owner", "path", "time", "size"))
+            writer.writerows((owner, path, scan_time, size) for scan_time, size in series)
+        else:
+            const_multiplier = 1.0/1024/1024 # to transform file size in MB
+            fh.write("\nSize of {} owned by {}:\n".format(path, owner))
+            previous = None
+            for scan_time, size in series:
+                delta = "" if previous is None else "{:+12.3f} MB".format((size - previous) * const_multiplier)
+                fh.write("  {} {:12.3f} MB {}\n".format(cls.format_time(scan_time), size * const_multiplier, delta))
+                previous = size
+
+    @classmethod
+    def write_growers(cls, growers: dict, fh, report_format: str = "text") -> None:
+        """
+        Write the result of get_top_growers() to the text file object fh in one of FORMATS
+        """
+        if report_format == "json":
+            json.dump(growers, fh, indent = 2)
+            fh.write("\n")
+        elif report_format == "csv":
+            writer = csv.writer(fh)
+            writer.writerow(("owner", "from", "to", "rank", "old size", "new size", "path"))
+            writer.writerows((growers["owner"], growers["from"], growers["to"], rank, old_size, new_size, path)
+                             for rank, (path, old_size, new_size) in enumerate(growers["growers"], 1))
+        else:
+            const_multiplier = 1.0/1024/1024 # to transform file size in MB
+            fh.write("\nTop growers owned by {} in {}, from {} to {}:\n".format(growers["owner"], growers["root"],
+                    cls.format_time(growers["from"]), cls.format_time(growers["to"])))
+            for rank, (path, old_size, new_size) in enumerate(growers["growers"], 1):
+                fh.write("  {:4d}. {:+12.3f} MB {:12.3f} MB  {}\n".format(rank,
+                        (new_size - old_size) * const_multiplier, new_size * const_multiplier, path))
@@ -0,0 +1,191 @@
+"""
+Persistent binary cache of the parsed ncdu exports, opened with mmap.
+"""
+import hashlib
+import json
+import logging
+import mmap
+import os
+import sys
+import tempfile
+from array import array
+
+from file_tree import FileTree
+
+logger = logging.getLogger('PYNCDU')
+
+
+class TreeCache:
+    """
+    Keep the FileTree built from an ncdu export in a binary file, so next time
+    the same export is loaded there is no json parsing, no uid lookups and no tree build.
+
+    Cache file layout:
+        - MAGIC
+        - header length, 8 bytes little endian
+        - header, json: source key, root index, uid -> username table
+          and the sections (array name -> offset, typecode, number of items)
+        - the sections, the raw content of the FileTree arrays, 8 bytes aligned
+    The file is opened with mmap, the arrays are memoryviews over it,
+    so the pages are read from disk only when they are used.
+    """
+    MAGIC = b"PYNCDU-TREE\0"
+    VERSION = 3
+    CACHE_SUFFIX = ".tree"
+    # the source hash is computed only on the head and tail of the file, reading GBs is too slow
+    hash_chunk_size = 1024 * 1024
+
+    def __init__(self, cache_dir: str = None, max_size: int = 0, rebuild: bool = False):
+        """
+        @param: cache_dir - where to keep the cache files, None for the default one
+        @param: max_size - max total size (bytes) of the cache files, 0 means no limit,
+                when exceeded the least recently used files are removed
+        @param: rebuild - ignore the existing cache files, they will be overwritten
+        """
+        self.cache_dir = cache_dir if cache_dir else self.get_default_cache_dir()
+        self.max_size = max_size
+        self.rebuild = rebuild
+
+    @classmethod
+    def get_default_cache_dir(cls) -> str:
+        cache_home = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+        return os.path.join(cache_home, "pyncdu-gui")
+
+    def get_cache_file(self, source_file: str) -> str:
+        """
+        Returns the cache file path used for the ncdu export source_file
+        """
+        source_path = os.path.abspath(source_file)
+        path_hash = hashlib.sha1(source_path.encode("utf-8", "surrogateescape")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, "{}-{}{}".format(
+                os.path.basename(source_path), path_hash, self.CACHE_SUFFIX))
+
+    @classmethod
+    def get_source_key(cls, source_file: str) -> dict:
+        """
+        Identify the content of source_file by size, mtime and a hash of its head and tail
+        """
+        st = os.stat(source_file)
+        digest = hashlib.sha1()
+        with open(source_file, "rb") as fh:
+            digest.update(fh.read(cls.hash_chunk_size))
+            if st.st_size > 2 * cls.hash_chunk_size:
+                fh.seek(-cls.hash_chunk_size, os.SEEK_END)
+            digest.update(fh.read(cls.hash_chunk_size))
+        return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "hash": digest.hexdigest()}
+
+    def load(self, source_file: str):
+        """
+        Open the cache file of source_file
+        @return: (FileTree, root index, uid -> username dict)
+                 or None if there is no valid cache for the current source_file content
+        """
+        if self.rebuild:
+            return None
+        cache_file = self.get_cache_file(source_file)
+        if not os.path.isfile(cache_file):
+            return None
+        try:
+            with open(cache_file, "rb") as fh:
+                # ACCESS_COPY - the arrays are changed when sorting, never write back to the file
+                mapped_file = mmap.mmap(fh.fileno(), 0, access = mmap.ACCESS_COPY)
+            header = self.read_header(mapped_file)
+            if header is None or header["source"] != self.get_source_key(source_file):
+                logger.info("Cache file {} is out of date".format(cache_file))
+                return None
+        except (OSError, ValueError) as e:
+            logger.warning("Cannot read cache file {}: {}".format(cache_file, e))
+            return None
+        tree = FileTree()
+        tree.attach_mapped_file(mapped_file, header["sections"])
+        # mark it as recently used, for the eviction
+        os.utime(cache_file)
+        uid_names = {int(uid): name for uid, name in header["uid_names"].items()}
+        return tree, header["root"], uid_names
+
+    @classmethod
+    def read_header(cls, mapped_file) -> dict:
+        start = len(cls.MAGIC)
+        if mapped_file[:start] != cls.MAGIC:
+            return None
+        header_len = int.from_bytes(mapped_file[start:start + 8], "little")
+        header = json.loads(mapped_file[start + 8:start + 8 + header_len])
+        if (header.get("version") != cls.VERSION or header.get("byteorder") != sys.byteorder
+                or header.get("itemsizes") != cls.get_itemsizes()):
+            return None
+        # make the sections offsets absolute
+        data_start = cls.align(start + 8 + header_len)
+        for section in header["sections"].values():
+            section[0] += data_start
+        return header
+
+    @classmethod
+    def get_itemsizes(cls) -> dict:
+        """ The arrays items sizes are platform dependent, the cache is valid only on the same platform """
+        return {typecode: array(typecode).itemsize for typecode in "iIQB"}
+
+    def save(self, source_file: str, tree: FileTree, root: int, uid_names: dict) -> None:
+        """
+        Write the cache file of source_file, then evict the old cache files if too big.
+        @param: uid_names - uid -> username, for the uids which have a username
+        """
+        cache_file = self.get_cache_file(source_file)
+        try:
+            os.makedirs(self.cache_dir, exist_ok = True)
+            source_key = self.get_source_key(source_file)
+            buffers = [(name, typecode, getattr(tree, name)) for name, typecode in tree.arrays_types]
+            buffers.append(("names", 'B', tree.names))
+            buffers.append(("hier_sizes", 'Q', tree.get_hierarchy_sizes()))
+            # the sections offsets are relative to the end of the header
+            sections = {}
+            offset = 0
+            for name, typecode, data in buffers:
+                sections[name] = [offset, typecode, len(data)]
+                offset = self.align(offset + memoryview(data).nbytes)
+            header = {"version": self.VERSION, "byteorder": sys.byteorder,
+                      "itemsizes": self.get_itemsizes(), "source": source_key, "root": root,
+                      "uid_names": {str(uid): name for uid, name in uid_names.items()},
+                      "sections": sections}
+            header_bytes = json.dumps(header).encode()
+            data_start = self.align(len(self.MAGIC) + 8 + len(header_bytes))
+            fd, tmp_file = tempfile.mkstemp(dir = self.cache_dir, suffix = ".tmp")
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(self.MAGIC)
+                fh.write(len(header_bytes).to_bytes(8, "little"))
+                fh.write(header_bytes)
+                for name, typecode, data in buffers:
+                    fh.write(b"\0" * (data_start + sections[name][0] - fh.tell()))
+                    fh.write(data)
+            os.replace(tmp_file, cache_file)
+            logger.info("Cache file {} saved".format(cache_file))
+        except OSError as e:
+            logger.warning("Cannot write cache file {}: {}".format(cache_file, e))
+            return
+        self.evict(keep = cache_file)
+
+    @staticmethod
+    def align(offset: int) -> int:
+        return (offset + 7) & ~7
+
+    def evict(self, keep: str = None) -> None:
+        """
+        Remove the least recently used cache files until the total size is under max_size
+        @param: keep - never remove this file
+        """
+        if not self.max_size or not os.path.isdir(self.cache_dir):
+            return
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(self.CACHE_SUFFIX) and entry.is_file():
+                st = entry.stat()
+                files.append((st.st_mtime, st.st_size, entry.path))
+        total_size = sum(f[1] for f in files)
+        files.sort()
+        for _, size, path in files:
+            if total_size <= self.max_size:
+                break
+            if path == keep:
+                continue
+            logger.info("Remove cache file {}".format(path))
+            os.remove(path)
+            total_size -= size
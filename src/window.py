@@ -0,0 +1,1062 @@
+"""
+Tk window browsing the files tree, the only module importing tkinter.
+"""
+import codecs
+import configparser
+import heapq
+import itertools
+import logging
+import os
+import queue
+import signal
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+import psutil
+import tkinter as tk
+import tkinter.ttk as ttk
+
+from file_info import FileInfo, FileUtils
+from scan_diff import ScanDiff
+from profiler import Profiler
+from name_index import NameIndex
+from breakdown import Breakdown
+
+logger = logging.getLogger('PYNCDU')
+
+
+class LoadCancelled(Exception):
+    """
+    Raised from the progress callback when the user cancels the loading.
+    """
+
+
+class BackgroundWorker:
+    """
+    Base of the workers running in a thread, so the Tk mainloop is not blocked.
+    A worker never touches the widgets, it only puts (kind, data) messages in a queue
+    and the window reads them with after() polling.
+    """
+    thread_name = "worker"
+
+    def __init__(self):
+        self.messages = queue.Queue()
+        self.cancel_event = threading.Event()
+        self.thread = None
+
+    def start(self) -> None:
+        # daemon, the program does not wait for the worker when the window is closed
+        self.thread = threading.Thread(target = self.run, name = self.thread_name, daemon = True)
+        self.thread.start()
+
+    def run(self) -> None:
+        raise NotImplementedError()
+
+    def cancel(self) -> None:
+        self.cancel_event.set()
+
+    def get_messages(self) -> list:
+        """
+        Returns the messages received so far, never blocks
+        """
+        messages = []
+        try:
+            while True:
+                messages.append(self.messages.get_nowait())
+        except queue.Empty:
+            pass
+        return messages
+
+
+class BackgroundLoader(BackgroundWorker):
+    """
+    Run the data loading (scan and/or parse) in a worker thread, its messages are:
+        ("progress", (bytes_read, total_bytes, files_number))
+        ("done", FileInfo)
+        ("cancelled", None)
+        ("error", error message)
+    """
+    thread_name = "loader"
+
+    def __init__(self, load_function):
+        """
+        @param: load_function - called in the worker thread with a progress callback
+                (bytes_read, total_bytes, files_number), it returns the root FileInfo
+        """
+        super().__init__()
+        self.load_function = load_function
+
+    def run(self) -> None:
+        try:
+            with Profiler.span("load"):
+                root_file = self.load_function(self.report_progress)
+            self.messages.put(("done", root_file))
+        except LoadCancelled:
+            logger.info("Loading cancelled.")
+            self.messages.put(("cancelled", None))
+        except Exception as e:
+            logger.exception("Loading failed")
+            self.messages.put(("error", str(e)))
+
+    def report_progress(self, bytes_read: int, total_bytes: int, files_number: int) -> None:
+        if self.cancel_event.is_set():
+            raise LoadCancelled()
+        self.messages.put(("progress", (bytes_read, total_bytes, files_number)))
+
+
+class CommandRunner(BackgroundWorker):
+    """
+    Runs a shell command of the FILE_MENU in a worker thread and reads its output as it comes,
+    in chunks, not lines, so the progress shown with '\\r' is not held back. Its messages are:
+        ("started", pid)
+        ("output", text)
+        ("done", exit code)
+        ("cancelled", None)
+        ("error", error message)
+    At most slots commands run at the same time, the other ones wait for a free slot.
+    The command runs in its own session: cancel() kills it together with its children,
+    and it is not killed when the window is closed.
+    """
+    thread_name = "command"
+    # how often a command waiting for a free slot checks if it was cancelled, in seconds
+    cancel_check_interval = 0.1
+    # max bytes of one output message
+    chunk_size = 65536
+
+    def __init__(self, cmd: str, slots: threading.Semaphore):
+        """
+        @param: slots - shared by all the commands, its value is the max number of running commands
+        """
+        super().__init__()
+        self.cmd = cmd
+        self.slots = slots
+        # the process is started and killed under the lock, so a cancel never misses it
+        self.process_lock = threading.Lock()
+        self.process = None
+
+    def run(self) -> None:
+        # a command cancelled while it waits for a free slot ends right away
+        while not self.cancel_event.is_set():
+            if self.slots.acquire(timeout = self.cancel_check_interval):
+                break
+        else:
+            logger.info("Command cancelled: {}".format(self.cmd))
+            self.messages.put(("cancelled", None))
+            return
+        try:
+            with Profiler.span("popup_command"):
+                with self.process_lock:
+                    if self.cancel_event.is_set():
+                        logger.info("Command cancelled: {}".format(self.cmd))
+                        self.messages.put(("cancelled", None))
+                        return
+                    self.process = subprocess.Popen(self.cmd, shell = True,
+                            stdin = subprocess.DEVNULL, stdout = subprocess.PIPE, stderr = subprocess.STDOUT,
+                            start_new_session = True)
+                self.messages.put(("started", self.process.pid))
+                self.read_output(self.process.stdout)
+                exit_code = self.process.wait()
+        except Exception as e:
+            logger.exception("Command failed")
+            self.messages.put(("error", str(e)))
+            return
+        finally:
+            self.slots.release()
+        if self.cancel_event.is_set():
+            logger.info("Command cancelled: {}".format(self.cmd))
+            self.messages.put(("cancelled", None))
+        else:
+            logger.info("Command ended with exit code {}: {}".format(exit_code, self.cmd))
+            self.messages.put(("done", exit_code))
+
+    def read_output(self, fh) -> None:
+        """
+        Put the output in messages as soon as any is available, until the end of fh
+        """
+        decoder = codecs.getincrementaldecoder("utf-8")(errors = "replace")
+        pending = ""
+        with fh:
+            while True:
+                chunk = fh.read1(self.chunk_size)
+                text = pending + decoder.decode(chunk, final = not chunk)
+                # a last '\r' may be the start of "\r\n", it waits for the next chunk
+                pending = "\r" if chunk and text.endswith("\r") else ""
+                if pending:
+                    text = text[:-1]
+                if text:
+                    self.messages.put(("output", text))
+                if not chunk:
+                    return
+
+    def cancel(self) -> None:
+        super().cancel()
+        with self.process_lock:
+            if self.process is None:
+                return
+            try:
+                # the shell and all the processes it started
+                os.killpg(self.process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
+class Window (tk.Frame):
+    # how often the loader messages are read, in ms
+    poll_interval = 100
+    # the oldest lines of a command output window are dropped after this
+    max_output_lines = 10000
+
+    def __init__(self, master : tk.Tk, root_file: FileInfo , cfg_data: configparser.ConfigParser,
+                 logger : logging.Logger, loader: BackgroundLoader = None, scan_function = None,
+                 diff: ScanDiff = None, expand_function = None, history = None):
+        """
+        Either root_file is given, or it is None and it will come from the loader,
+        which is started here, the window shows the progress until it is done.
+        scan_function(folder_path, progress_callback) -> FileInfo is used by "Rescan this folder",
+        if None the native scanner is used.
+        diff - if set, the size changes since an older scan are shown (filled by the loader)
+        expand_function(file_node, progress_callback) -> FileInfo is used by "Load collapsed content",
+        it reads again the content of a collapsed folder (see FileUtils.load_collapsed)
+        history - optional ScanHistory, for the "History of this folder" and "Top growers" menus
+        """
+        
+        self.const_multiplier = 1.0/1024/1024 # to transform file size in MB        
+
+        self.master = master       
+        self.logger = logger
+        self.loader = None
+        # folders to rescan after the current loading, see rescan_when_idle
+        self.pending_rescans = []
+        if scan_function is None:
+            scan_function = lambda folder_path, progress_callback: FileUtils.native_scan_and_load(
+                    folder_path, None, None, progress_callback)
+        self.scan_function = scan_function
+        self.expand_function = expand_function
+        self.diff = diff
+        self.history = history
+        self.create_widgets(cfg_data)
+        if root_file is not None:
+            self.set_root_file(root_file)
+        elif loader is not None:
+            self.master.wm_title("Loading ...")
+            self.start_loader(loader, self.set_root_file, "Loading ...")
+
+    def set_root_file(self, root_file: FileInfo) -> None:
+        """
+        Show the files tree, the root folder is expanded
+        """
+        self.full_root_file = root_file
+        self.master.wm_title(root_file.path)
+        self.combo_owners['values'] = FileUtils.get_all_usernames()
+        self.combo_owners.set(self.combo_owners['values'][0])
+        root_file.set_selected_owner("*")        
+        self.show_tree(root_file)
+        # the names index is built in background once the tree is shown, so the first search is fast
+        NameIndex.start_build(root_file.tree)
+        rss =psutil.Process(os.getpid()).memory_info().rss
+        self.logger.debug("Used memory {:.2f} GB, {:.0f} bytes per entry (tree arrays {:.0f} bytes per entry)".format(
+                rss/1024/1024/1024, rss/len(root_file.tree), root_file.tree.get_memory_size()/len(root_file.tree))) 
+
+    def show_tree(self, root_file: FileInfo) -> None:
+        """
+        Replace all the rows with the rows of root_file (the loaded tree or a filtered one)
+        """
+        self.tree.delete(*self.tree.get_children(""))
+        self.nodes = {}
+        self.loaded_children = {}
+        self.root_file = root_file
+        self.populate_data(self.root_file, "")        
+        self.expand_row(self.root_file.path)
+        self.tree.item(self.root_file.path, open=True)
+
+    def is_filtered(self) -> bool:
+        return self.root_file is not self.full_root_file
+
+    def is_merged(self) -> bool:
+        """
+        True when several exports are shown under one root, their paths are not the real ones:
+        every export root is labelled "<file name>:<root path without the leading '/', '/' replaced
+        by ':'>" under "[N exports]" (e.g. "[2 exports]/b.json:data:sub/x", see FileUtils.load_json_files),
+        so they cannot be rescanned or passed to commands
+        """
+        return self.full_root_file is not None and self.full_root_file.tree.merged
+
+    def start_loader(self, loader: BackgroundLoader, on_done, text: str) -> None:
+        """
+        Start the loader and show its progress, on_done(FileInfo) is called when it ends
+        """
+        self.loader = loader
+        self.on_loader_done = on_done
+        self.create_progress_widgets(text)
+        loader.start()
+        self.master.after(self.poll_interval, self.poll_loader)
+
+    def stop_loader(self) -> None:
+        """
+        Remove the progress widgets, if there is no data loaded yet close the window
+        """
+        self.loader = None
+        if self.root_file is None:
+            self.master.destroy()
+        else:
+            self.progress_frame.destroy()
+            self.start_pending_rescan()
+
+    def create_progress_widgets(self, text: str) -> None:
+        self.progress_frame = tk.Frame(self.master)
+        self.progress_frame.grid(row=2, column=0, columnspan=3, sticky="ew")
+        self.progress_frame.columnconfigure(1, weight=1)
+        self.progress_label = tk.Label(self.progress_frame, text = text, anchor = "w", width = 40)
+        self.progress_label.grid(row=0, column=0, padx=5, pady=5)
+        self.progress_bar = ttk.Progressbar(self.progress_frame, mode = "indeterminate", maximum = 100)
+        self.progress_bar.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
+        self.progress_button = tk.Button(self.progress_frame, text = "Cancel", command = self.onCancelLoad)
+        self.progress_button.grid(row=0, column=2, padx=5, pady=5)
+
+    def onCancelLoad(self) -> None:
+        self.progress_label["text"] = "Cancelling ..."
+        self.loader.cancel()
+
+    def poll_loader(self) -> None:
+        """
+        Read the loader messages, re-scheduled with after() until the loading ends
+        """
+        for kind, data in self.loader.get_messages():
+            if kind == "progress":
+                bytes_read, total_bytes, files_number = data
+                if total_bytes:
+                    self.progress_bar.configure(mode = "determinate", value = bytes_read * 100 / total_bytes)
+                else:
+                    self.progress_bar.step()
+                self.progress_label["text"] = "{} files".format(files_number)
+                if bytes_read:
+                    self.progress_label["text"] += ", {:.1f} MB read".format(bytes_read * self.const_multiplier)
+            elif kind == "done":
+                self.progress_frame.destroy()
+                self.loader = None
+                self.on_loader_done(data)
+                self.start_pending_rescan()
+                return
+            elif kind == "cancelled":
+                self.stop_loader()
+                return
+            elif kind == "error":
+                self.progress_bar.stop()
+                self.progress_label["text"] = "ERROR: {}".format(data)
+                self.progress_button.configure(text = "Close", command = self.stop_loader)
+                return
+        self.master.after(self.poll_interval, self.poll_loader)
+
+    def create_widgets(self, cfg_data:configparser.ConfigParser) -> None:
+        self.master.columnconfigure(0, weight=1)
+        self.master.columnconfigure(1, weight=1000)
+        self.master.columnconfigure(2, weight=1)
+        self.master.rowconfigure(0, weight=1)
+        self.master.rowconfigure(1, weight=1000)
+        self.root_file = None
+        self.full_root_file = None
+        # combobox (a.k.a dropdown list) to show all files owners
+        self.owners_label = tk.Label(self.master, text = "Username:")
+        self.owners_label.grid(row=0, column=0)
+        self.combo_owners = ttk.Combobox()
+        self.combo_owners.grid(row=0, column=1, sticky="w")
+        self.combo_owners['values'] = ["*"]
+        self.combo_owners.set("*")
+        self.combo_owners['state'] = 'readonly'
+        self.combo_owners.bind("<<ComboboxSelected>>", self.onOwnerChange)
+        # TreeView to show files structure
+        columns = ("size", "per_user") 
+        if self.diff is not None:
+            columns += ("delta", "delta_per_user")
+        self.tree= ttk.Treeview(self.master, columns=columns ,height = 20, selectmode='browse')        
+        self.tree.grid(row=1, column = 0, columnspan = 2, sticky='nsew')
+        
+ 
+        self.tree.heading('#0', text='Path')
+        self.tree.heading('size', text="Size(MB)", command = lambda: self.onSortChange("size"))
+        self.tree.heading('per_user', text='Owned by *', command = lambda: self.onSortChange("size"))
+        if self.diff is not None:
+            self.tree.heading('delta', text="Δ size(MB)", command = lambda: self.onSortChange("delta"))
+            self.tree.heading('delta_per_user', text='Δ owned by *',
+                    command = lambda: self.onSortChange("delta"))
+        # the children are sorted by "size" or by "delta" (growth since the older scan)
+        self.sort_by = "size"
+        # create scroll bar on treeview
+        v_scrollbar = ttk.Scrollbar(self.master, command=self.tree.yview, orient='vertical')
+        v_scrollbar.grid(row=1, column=2, sticky='ns')
+        self.tree.configure(yscrollcommand=v_scrollbar.set)
+        for c in columns:
+            self.tree.column(c, anchor=tk.E)
+        self.add_popup_menu_on_tree_view(cfg_data)
+        # the rows are inserted only when their parent is expanded
+        self.tree.bind("<<TreeviewOpen>>", self.onTreeOpen)
+        self.tree.bind("<<TreeviewSelect>>", self.onTreeSelect)
+        # how many children rows are inserted at once for a folder, the rest are behind a "load more" row
+        self.max_children_rows = cfg_data.getint("GUI", "MAX_CHILDREN_ROWS", fallback=1000)
+        # iid -> FileInfo, only for the rows inserted in the tree view
+        self.nodes = {}
+        # iid -> number of children rows inserted, only for the expanded folders
+        self.loaded_children = {}
+        self.selected_item = None
+        self.create_search_widgets(cfg_data)
+
+    def create_search_widgets(self, cfg_data:configparser.ConfigParser) -> None:
+        """
+        Search box: substring or glob (e.g. *.parquet) over all the names,
+        the matches are listed in a new window, or the tree is filtered to them.
+        """
+        self.search_frame = tk.Frame(self.master)
+        self.search_frame.grid(row=3, column=0, columnspan=3, sticky="ew")
+        self.search_frame.columnconfigure(1, weight=1)
+        tk.Label(self.search_frame, text = "Search:").grid(row=0, column=0, padx=5, pady=5)
+        self.search_entry = tk.Entry(self.search_frame)
+        self.search_entry.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
+        self.search_entry.bind("<Return>", lambda event: self.onSearch())
+        tk.Button(self.search_frame, text = "Find", command = self.onSearch).grid(row=0, column=2, padx=5)
+        self.filter_var = tk.BooleanVar(value = False)
+        tk.Checkbutton(self.search_frame, text = "Filter tree", variable = self.filter_var).grid(
+                row=0, column=3, padx=5)
+        tk.Button(self.search_frame, text = "Clear", command = self.onClearSearch).grid(row=0, column=4, padx=5)
+        self.search_label = tk.Label(self.search_frame, text = "", anchor = "w", width = 30)
+        self.search_label.grid(row=0, column=5, padx=5)
+        # how many matches are listed, the biggest ones
+        self.max_search_results = cfg_data.getint("GUI", "MAX_SEARCH_RESULTS", fallback=1000)
+
+    def onOwnerChange(self, event: tk.Event):
+        """
+        Owner name changed callback.
+        When the owner name is changed we should recalculate the usage per respective user.
+        Only the rows already inserted in the tree view are refreshed.
+        """
+        rf = self.root_file
+        if rf is None:
+            return
+        with Profiler.span("owner_switch"):
+            rf.set_selected_owner(event.widget.get())
+            if self.is_filtered():
+                # the matches depend on the owner
+                self.onSearch()
+            else:
+                self.refresh_rows(rf.path)
+        self.tree.heading('per_user', text='Owned by {}'.format(event.widget.get()))        
+        if self.diff is not None:
+            self.tree.heading('delta_per_user', text='Δ owned by {}'.format(event.widget.get()))
+
+    def onSortChange(self, sort_by: str):
+        """
+        Column heading clicked callback, sort the rows by size or by growth.
+        """
+        if self.root_file is None or sort_by == self.sort_by:
+            return
+        self.sort_by = sort_by
+        with Profiler.span("sort_switch"):
+            self.refresh_rows(self.root_file.path)
+     
+    def onSearch(self):
+        """
+        Search button callback, the matches of the selected owner are listed or, in filter mode,
+        the tree shows only them and the folders leading to them.
+        """
+        query = self.search_entry.get().strip()
+        if self.full_root_file is None or not query:
+            return
+        full = self.full_root_file
+        uids = FileUtils.get_uids_by_owner(full.get_selected_owner())
+        matches = NameIndex.get_index(full.tree).search(query, full.index, uids)
+        self.search_label["text"] = "{} matches".format(len(matches))
+        if self.filter_var.get():
+            with Profiler.span("filter"):
+                tree, root = full.tree.extract(full.index, matches)
+                self.show_tree(FileInfo(tree, root))
+            self.master.wm_title("{} (filter {})".format(full.path, query))
+        else:
+            self.show_search_results(query, full, matches, uids)
+
+    def onClearSearch(self):
+        self.search_entry.delete(0, tk.END)
+        self.search_label["text"] = ""
+        if self.full_root_file is not None and self.is_filtered():
+            self.show_tree(self.full_root_file)
+            self.master.wm_title(self.full_root_file.path)
+
+    def show_search_results(self, query: str, root_file: FileInfo, matches: list, uids: frozenset):
+        """
+        List the biggest matches (max_search_results) in a new window
+        """
+        sizes = root_file.tree.get_hierarchy_sizes(uids)
+        all_sizes = root_file.tree.get_hierarchy_sizes()
+        top = heapq.nlargest(self.max_search_results, matches, key = sizes.__getitem__)
+        win = tk.Toplevel()
+        win.wm_title("Search - {}".format(query))
+        win.columnconfigure(0, weight=1)
+        win.rowconfigure(1, weight=1)
+        tk.Label(win, text = "{} matches, the biggest {} are listed".format(len(matches), len(top)),
+                anchor = "w").grid(row=0, column=0, sticky="ew", padx=5, pady=5)
+        results = ttk.Treeview(win, columns = ("size", "per_user"), height = 20)
+        results.grid(row=1, column=0, sticky="nsew")
+        results.heading('#0', text='Path')
+        results.heading('size', text="Size(MB)")
+        results.heading('per_user', text='Owned by {}'.format(root_file.get_selected_owner()))
+        for c in ("size", "per_user"):
+            results.column(c, anchor=tk.E)
+        scrollbar = ttk.Scrollbar(win, command=results.yview, orient='vertical')
+        scrollbar.grid(row=1, column=1, sticky='ns')
+        results.configure(yscrollcommand=scrollbar.set)
+        for idx in top:
+            results.insert("", tk.END, text = root_file.tree.get_path(idx), values = [
+                    "{:.3f}".format(all_sizes[idx] * self.const_multiplier),
+                    "{:.3f}".format(sizes[idx] * self.const_multiplier)])
+        tk.Button(win, text="Close", command=win.destroy).grid(row=2, column=0, padx=10, pady=10)
+
+    def onTreeOpen(self, event: tk.Event):
+        """
+        Folder expanded callback, insert its children rows the first time it is opened.
+        """
+        iid = self.tree.focus()
+        if "load_more" in self.tree.item(iid, "tags"):
+            # ttk still opens the row after this callback, it is deleted only then
+            self.master.after_idle(self.load_other_row, iid)
+            return
+        self.expand_row(iid)
+
+    def onTreeSelect(self, event: tk.Event):
+        """
+        Row selected callback, when the "other files" row is selected insert the next children batch.
+        """
+        for iid in self.tree.selection():
+            if "load_more" in self.tree.item(iid, "tags"):
+                self.master.after_idle(self.load_other_row, iid)
+
+    def load_other_row(self, iid: str):
+        """
+        Replace the "other files" row iid with the next children batch.
+        Called with after_idle(), not from the Treeview events, the row may be already replaced.
+        """
+        if not self.tree.exists(iid):
+            return
+        parent_iid = self.tree.parent(iid)
+        self.tree.delete(iid)
+        self.load_more_children(parent_iid)
+ 
+    def get_row_values(self, file_node : FileInfo) -> list:
+        total_size = file_node.get_hierarchy_size()
+        total_size_str = "{:.3f}".format(total_size * self.const_multiplier)
+        user_size = file_node.get_hierarchy_size_by_owner(file_node.get_selected_owner())
+        user_size_str = "{:.3f}".format( user_size * self.const_multiplier)
+        if self.diff is None:
+            return [total_size_str, user_size_str]
+        if file_node.tree is not self.diff.tree:
+            # filtered tree, there is no older scan matched on it
+            return [total_size_str, user_size_str, "", ""]
+        uids = FileUtils.get_uids_by_owner(file_node.get_selected_owner())
+        total_delta = self.diff.get_delta_sizes()[file_node.index]
+        user_delta = self.diff.get_delta_sizes(uids)[file_node.index]
+        return [total_size_str, user_size_str, "{:+.3f}".format(total_delta * self.const_multiplier),
+                "{:+.3f}".format(user_delta * self.const_multiplier)]
+
+    def sort_children(self, file_node : FileInfo, top: int):
+        """
+        Move the top children of file_node first, by the selected owner, biggest or most grown first.
+        Only the shown children are selected and sorted, the other ones stay in the "other files" row.
+        """
+        if self.sort_by == "delta" and self.diff is not None and file_node.tree is self.diff.tree:
+            with Profiler.span("sort"):
+                uids = FileUtils.get_uids_by_owner(file_node.get_selected_owner())
+                file_node.tree.sort_children(file_node.index, self.diff.get_delta_sizes(uids), top)
+        else:
+            file_node.sort_children_by_selected_owner(top)
+
+    def populate_data(self, file_node : FileInfo, parent_name : str, index = tk.END):
+        """
+        Insert the row of file_node, its children are inserted later by expand_row().
+        Until then a placeholder child keeps the expand arrow visible.
+        """
+        self.tree.insert(parent_name, index, iid = file_node.path, 
+                text = file_node.name, values = self.get_row_values(file_node))
+        self.nodes[file_node.path] = file_node
+        if file_node.has_children():
+            self.tree.insert(file_node.path, tk.END, text = "...", tags = ("placeholder",))
+
+    def expand_row(self, iid : str):
+        """
+        Replace the placeholder of a folder row with the first batch of its children rows.
+        """
+        file_node = self.nodes.get(iid, None)
+        if file_node is None or iid in self.loaded_children:
+            return
+        self.tree.delete(*self.tree.get_children(iid))
+        self.loaded_children[iid] = 0
+        self.load_more_children(iid)
+
+    def load_more_children(self, iid : str):
+        """
+        Insert the next max_children_rows biggest children of an expanded folder,
+        if there are still children left add an "other files" row at the end.
+        """
+        file_node = self.nodes[iid]
+        start = self.loaded_children[iid]
+        # the shown ones stay first, only the next batch is selected from the other ones
+        self.sort_children(file_node, start + self.max_children_rows)
+        with Profiler.span("populate"):
+            end = min(file_node.get_children_count(), start + self.max_children_rows)
+            for c in file_node.get_children(start, end):
+                self.populate_data(c, iid)
+            self.loaded_children[iid] = end
+            self.add_load_more_row(iid)
+
+    def add_load_more_row(self, iid : str):
+        """
+        Add the "N other files (X MB)" row of the children not shown yet, with their exact total sizes.
+        It is expanded (or selected) on demand, then the next batch is loaded.
+        """
+        file_node = self.nodes[iid]
+        tree = file_node.tree
+        idx = file_node.index
+        shown = self.loaded_children[iid]
+        others_count = file_node.get_children_count() - shown
+        if others_count <= 0:
+            return
+        # the other children sizes are the folder size, less its own size and the shown children ones,
+        # so only the shown children are read, not the other ones
+        shown_children = list(itertools.islice(tree.iter_children(idx), shown))
+        uids = FileUtils.get_uids_by_owner(file_node.get_selected_owner())
+        columns = [(tree.get_hierarchy_sizes(), tree.get_own_size(idx)),
+                   (tree.get_hierarchy_sizes(uids), tree.get_own_size(idx, uids))]
+        if self.diff is not None and tree is self.diff.tree:
+            columns += [(self.diff.get_delta_sizes(), self.diff.get_delta_own_size(idx)),
+                        (self.diff.get_delta_sizes(uids), self.diff.get_delta_own_size(idx, uids))]
+        totals = [sizes[idx] - own - sum(map(sizes.__getitem__, shown_children)) for sizes, own in columns]
+        values = ["{:.3f}".format(size * self.const_multiplier) for size in totals[:2]]
+        values += ["{:+.3f}".format(size * self.const_multiplier) for size in totals[2:]]
+        if self.diff is not None and len(values) == 2:
+            values += ["", ""]
+        other_iid = self.tree.insert(iid, tk.END, text = "{} other files ({} MB)".format(others_count, values[0]),
+                values = values, tags = ("load_more",))
+        # keeps the expand arrow visible
+        self.tree.insert(other_iid, tk.END, text = "...", tags = ("placeholder",))
+
+    def forget_rows(self, iid : str):
+        """
+        Remove a row and all the rows below it from the tree view and from the bookkeeping dicts.
+        """
+        to_visit = [iid]
+        while to_visit:
+            item = to_visit.pop()
+            self.nodes.pop(item, None)
+            self.loaded_children.pop(item, None)
+            to_visit.extend(self.tree.get_children(item))
+        self.tree.delete(iid)
+
+    def refresh_rows(self, iid : str):
+        """
+        Update the sizes of an inserted row and re-sort its inserted children (if expanded)
+        by the selected owner, keeping the same number of children rows.
+        The same for all the expanded rows below it, with an explicit stack, not recursion.
+        """
+        to_refresh = [iid]
+        while to_refresh:
+            iid = to_refresh.pop()
+            file_node = self.nodes[iid]
+            self.tree.item(iid, values = self.get_row_values(file_node))
+            if iid not in self.loaded_children:
+                continue
+            self.sort_children(file_node, self.loaded_children[iid])
+            shown = file_node.get_children(0, self.loaded_children[iid])
+            shown_iids = set(c.path for c in shown)
+            # drop the rows which are not anymore in the top, and the "load more" row
+            for child_iid in self.tree.get_children(iid):
+                if child_iid not in shown_iids:
+                    self.forget_rows(child_iid)
+            for index, c in enumerate(shown):
+                if c.path in self.nodes:
+                    self.tree.move(c.path, iid, index)
+                    to_refresh.append(c.path)
+                else:
+                    self.populate_data(c, iid, index)
+            self.add_load_more_row(iid)
+
+    def exec_shell(self, cmd: str, name: str = None):
+        """
+        Run a FILE_MENU command on the selected file/folder, it never blocks the window.
+        A command ending with '&' (e.g. an editor or a terminal) is only started, as with a shell.
+        Any other one runs in the commands pool (see CommandRunner), with its output window,
+        and the folder is rescanned when it ends if its name is in RESCAN_AFTER_COMMANDS.
+        """
+        path = str(Path(self.selected_item))
+        if os.path.isdir(path):
+            dir_path = path
+        else:
+            dir_path = os.path.dirname(path)
+        cmd = cmd.replace('$DIR', dir_path)
+        cmd = cmd.replace('$FILE', path)
+        self.logger.debug("Execute command '{}'".format(cmd))
+        if cmd.rstrip().endswith("&"):
+            # nobody waits for it, the thread reaps it when it ends so it does not stay a zombie
+            process = subprocess.Popen(cmd, shell = True)
+            threading.Thread(target = process.wait, daemon = True).start()
+            return
+        iid = self.selected_item
+        if not self.nodes[iid].tree.is_dir(self.nodes[iid].index):
+            iid = self.tree.parent(iid)
+        runner = CommandRunner(cmd, self.command_slots)
+        self.show_command(runner, name or cmd, iid, (name or "").lower() in self.rescan_after_commands)
+
+    def show_command(self, runner: CommandRunner, title: str, iid: str, rescan: bool) -> None:
+        """
+        Start runner and show its output as it comes, read with after() polling.
+        The window may be closed while the command runs, the command goes on.
+        @param: iid - the folder the command works on, see rescan()
+        @param: rescan - rescan the folder iid when the command ends, also when cancelled,
+                after the current loading if any (see rescan_when_idle)
+        """
+        win = tk.Toplevel()
+        win.wm_title("{} - {}".format(title, self.nodes[iid].path))
+        win.columnconfigure(0, weight=1)
+        win.rowconfigure(1, weight=1)
+        status = tk.Label(win, text = "Waiting for a free slot ...", anchor = "w")
+        status.grid(row=0, column=0, columnspan=2, sticky="ew", padx=5, pady=5)
+        output = tk.Text(win, bg="white", height = 25, width = 100, state = "disabled")
+        output.grid(row=1, column=0, sticky="nsew")
+        scrollbar = ttk.Scrollbar(win, command=output.yview, orient='vertical')
+        scrollbar.grid(row=1, column=1, sticky='ns')
+        output.configure(yscrollcommand=scrollbar.set)
+        buttons = tk.Frame(win)
+        buttons.grid(row=2, column=0, columnspan=2, pady=5)
+        cancel_button = tk.Button(buttons, text = "Cancel", command = runner.cancel)
+        cancel_button.grid(row=0, column=0, padx=10)
+        rescan_button = tk.Button(buttons, text = "Rescan folder", state = "disabled",
+                command = lambda: self.rescan(iid))
+        rescan_button.grid(row=0, column=1, padx=10)
+        tk.Button(buttons, text = "Close", command = win.destroy).grid(row=0, column=2, padx=10)
+
+        def poll():
+            messages = runner.get_messages()
+            text = "".join(data for kind, data in messages if kind == "output")
+            shown = win.winfo_exists()
+            if text and shown:
+                output.configure(state = "normal")
+                self.insert_output(output, text)
+                extra_lines = int(output.index("end-1c").split(".")[0]) - self.max_output_lines
+                if extra_lines > 0:
+                    output.delete("1.0", "{}.0".format(extra_lines + 1))
+                output.see(tk.END)
+                output.configure(state = "disabled")
+            for kind, data in messages:
+                if kind == "output":
+                    continue
+                if kind == "started":
+                    text = "Running {} (pid {}) ...".format(runner.cmd, data)
+                elif kind == "done":
+                    text = "Done, exit code {}".format(data)
+                elif kind == "cancelled":
+                    text = "Cancelled"
+                else:
+                    text = "ERROR: {}".format(data)
+                if kind in ("done", "cancelled") and rescan and not self.rescan_when_idle(iid):
+                    text += ", the rescan waits for the current loading"
+                if shown:
+                    status["text"] = text
+                if kind in ("done", "cancelled", "error"):
+                    if shown:
+                        cancel_button.configure(state = "disabled")
+                        rescan_button.configure(state = "normal")
+                    return
+            self.master.after(self.poll_interval, poll)
+
+        runner.start()
+        self.master.after(self.poll_interval, poll)
+
+
+    @staticmethod
+    def insert_output(output: tk.Text, text: str) -> None:
+        """
+        Append a command output, a '\\r' goes back to the start of the line like in a terminal,
+        so a progress bar is updated in place
+        """
+        parts = text.replace("\r\n", "\n").split("\r")
+        output.insert(tk.END, parts[0])
+        for part in parts[1:]:
+            output.delete("end-1c linestart", "end-1c")
+            output.insert(tk.END, part)
+
+    def add_popup_menu_on_tree_view(self, cfg_data: configparser.ConfigParser) -> None:
+        self.popup_menu = tk.Menu(self.tree, tearoff=0)
+        self.popup_menu.add_command(label="File Info", command = self.show_file_info)
+        self.popup_menu.add_command(label="Rescan this folder", command = self.rescan_folder)
+        # menu entries using the real paths of the files, disabled for a merged tree (see do_popup)
+        self.path_menu_entries = [0, 1]
+        if self.expand_function is not None:
+            self.popup_menu.add_command(label="Load collapsed content", command = self.load_collapsed)
+        self.popup_menu.add_command(label="Breakdown of this folder", command = self.show_breakdown)
+        if self.history is not None:
+            self.history_days = cfg_data.getint("GUI", "HISTORY_DAYS", fallback=30)
+            self.popup_menu.add_command(label="History of this folder", command = self.show_history)
+            self.popup_menu.add_command(label="Top growers", command = self.show_growers)
+        # the FILE_MENU commands run in a pool of this size, see CommandRunner
+        self.command_slots = threading.BoundedSemaphore(cfg_data.getint("GUI", "MAX_RUNNING_COMMANDS", fallback=4))
+        self.rescan_after_commands = set(name.strip().lower() for name in
+                cfg_data.get("GUI", "RESCAN_AFTER_COMMANDS", fallback="").split(",") if name.strip())
+        for option, cmd in cfg_data.items("FILE_MENU"):
+            # dinamically define commands
+            def item_cmd(cmd, option):
+                def new_cmd():
+                    self.exec_shell(cmd, option)
+                return new_cmd
+            i_cmd = item_cmd(cmd, option)
+            self.popup_menu.add_command(label=option , command = i_cmd)
+            self.path_menu_entries.append(self.popup_menu.index(tk.END))
+
+        self.tree.bind("<Button-3>", self.do_popup)
+
+    
+    
+    def rescan_folder(self):
+        """
+        Scan again only the selected folder (the parent folder for a file) in background,
+        then replace its content in the files tree.
+        """
+        iid = self.selected_item
+        if not self.nodes[iid].tree.is_dir(self.nodes[iid].index):
+            iid = self.tree.parent(iid)
+        self.rescan(iid)
+
+    def rescan(self, iid: str) -> None:
+        """
+        Scan again only the folder iid in background, then replace its content in the files tree.
+        """
+        if self.loader is not None:
+            self.logger.warning("Wait for the current scan to finish")
+            return
+        if self.is_filtered():
+            self.logger.warning("Clear the search filter before rescanning")
+            return
+        if self.is_merged():
+            self.logger.warning("The folders of merged exports cannot be rescanned")
+            return
+        if iid not in self.nodes:
+            self.logger.warning("{} is not shown anymore, rescan it from its row".format(iid))
+            return
+        folder_path = self.nodes[iid].path
+        self.logger.info("Rescan folder {} ...".format(folder_path))
+        loader = BackgroundLoader(lambda progress_callback: self.scan_function(folder_path, progress_callback))
+        self.start_loader(loader, lambda new_folder: self.replace_folder(iid, new_folder),
+                "Rescan {} ...".format(folder_path))
+
+    def rescan_when_idle(self, iid: str) -> bool:
+        """
+        Rescan the folder iid now, or queue it until the current loading ends
+        @return: False if the rescan was queued
+        """
+        if self.loader is None:
+            self.rescan(iid)
+            return True
+        if iid not in self.pending_rescans:
+            self.pending_rescans.append(iid)
+        return False
+
+    def start_pending_rescan(self) -> None:
+        """
+        Start the first queued rescan which can run, the next ones wait for it
+        """
+        while self.loader is None and self.pending_rescans:
+            self.rescan(self.pending_rescans.pop(0))
+
+    def load_collapsed(self):
+        """
+        Read again from the export the content of the selected collapsed folder
+        (the parent folder for a file or a summary) in background, then replace it in the files tree.
+        """
+        if self.loader is not None:
+            self.logger.warning("Wait for the current loading to finish")
+            return
+        if self.is_filtered():
+            self.logger.warning("Clear the search filter before loading collapsed content")
+            return
+        iid = self.selected_item
+        if not self.nodes[iid].tree.is_dir(self.nodes[iid].index):
+            iid = self.tree.parent(iid)
+        file_node = self.nodes[iid]
+        if file_node.index not in file_node.tree.collapsed:
+            self.logger.warning("{} has no collapsed content".format(file_node.path))
+            return
+        loader = BackgroundLoader(lambda progress_callback: self.expand_function(file_node, progress_callback))
+        self.start_loader(loader, lambda new_folder: self.replace_folder(iid, new_folder),
+                "Loading {} ...".format(file_node.path))
+
+    def replace_folder(self, iid: str, new_folder: FileInfo) -> None:
+        """
+        Put the content of new_folder in place of the folder iid.
+        Only the rows below iid are rebuilt, the rows of its parents only get the new sizes.
+        """
+        file_node = self.nodes[iid]
+        with Profiler.span("replace_folder"):
+            if self.diff is not None:
+                self.diff.forget_subtree(file_node.index)
+            file_node.tree.replace_subtree(file_node.index, new_folder.tree, new_folder.index)
+        was_expanded = iid in self.loaded_children
+        for child_iid in self.tree.get_children(iid):
+            self.forget_rows(child_iid)
+        self.loaded_children.pop(iid, None)
+        if file_node.has_children():
+            self.tree.insert(iid, tk.END, text = "...", tags = ("placeholder",))
+            if was_expanded:
+                self.expand_row(iid)
+        while iid:
+            self.tree.item(iid, values = self.get_row_values(self.nodes[iid]))
+            iid = self.tree.parent(iid)
+        self.combo_owners['values'] = FileUtils.get_all_usernames()
+        self.logger.info("Folder replaced, {} files loaded.".format(len(new_folder.tree)))
+
+    def show_breakdown(self):
+        """
+        Sizes of the selected folder files (the parent folder for a file) owned by the selected owner,
+        by extension, by modification age and by owner x age, one tab each
+        """
+        iid = self.selected_item
+        if not self.nodes[iid].tree.is_dir(self.nodes[iid].index):
+            iid = self.tree.parent(iid)
+        file_node = self.nodes[iid]
+        owner = file_node.get_selected_owner()
+        breakdown = Breakdown(file_node.tree, file_node.index, FileUtils.get_uids_by_owner(owner))
+        tabs = (("Extension", ("Extension",), breakdown.by_extension()),
+                ("Age", ("Modified",), breakdown.by_age()),
+                ("Owner x age", ("Owner", "Modified"), breakdown.by_owner_age()))
+        win = tk.Toplevel()
+        win.wm_title("Breakdown - {}".format(file_node.path))
+        win.columnconfigure(0, weight=1)
+        win.rowconfigure(1, weight=1)
+        tk.Label(win, text = "Files owned by {}".format(owner), anchor = "w").grid(
+                row=0, column=0, sticky="ew", padx=5, pady=5)
+        notebook = ttk.Notebook(win)
+        notebook.grid(row=1, column=0, sticky="nsew")
+        for title, keys, groups in tabs:
+            frame = tk.Frame(notebook)
+            frame.columnconfigure(0, weight=1)
+            frame.rowconfigure(0, weight=1)
+            columns = keys + ("Size(MB)", "Files")
+            view = ttk.Treeview(frame, columns = columns, show = "headings", height = 20)
+            view.grid(row=0, column=0, sticky="nsew")
+            for c in columns:
+                view.heading(c, text = c)
+                view.column(c, anchor = tk.W if c in keys else tk.E)
+            scrollbar = ttk.Scrollbar(frame, command=view.yview, orient='vertical')
+            scrollbar.grid(row=0, column=1, sticky='ns')
+            view.configure(yscrollcommand=scrollbar.set)
+            for group in groups:
+                *key, size, count = group
+                view.insert("", tk.END, values = key + ["{:.3f}".format(size * self.const_multiplier), count])
+            notebook.add(frame, text = title)
+        tk.Button(win, text="Close", command=win.destroy).grid(row=2, column=0, padx=10, pady=10)
+
+    def show_table(self, title: str, text: str, columns: tuple, rows: list) -> None:
+        """
+        Popup with a text line and a table, the first column is left aligned, the other ones (sizes) right
+        """
+        win = tk.Toplevel()
+        win.wm_title(title)
+        win.columnconfigure(0, weight=1)
+        win.rowconfigure(1, weight=1)
+        tk.Label(win, text = text, anchor = "w").grid(row=0, column=0, sticky="ew", padx=5, pady=5)
+        frame = tk.Frame(win)
+        frame.grid(row=1, column=0, sticky="nsew")
+        frame.columnconfigure(0, weight=1)
+        frame.rowconfigure(0, weight=1)
+        view = ttk.Treeview(frame, columns = columns, show = "headings", height = 20)
+        view.grid(row=0, column=0, sticky="nsew")
+        for c in columns:
+            view.heading(c, text = c)
+            view.column(c, anchor = tk.W if c == columns[0] else tk.E)
+        scrollbar = ttk.Scrollbar(frame, command=view.yview, orient='vertical')
+        scrollbar.grid(row=0, column=1, sticky='ns')
+        view.configure(yscrollcommand=scrollbar.set)
+        for row in rows:
+            view.insert("", tk.END, values = row)
+        tk.Button(win, text="Close", command=win.destroy).grid(row=2, column=0, padx=10, pady=10)
+
+    def show_history(self):
+        """
+        Size of the selected folder (the parent folder for a file) owned by the selected owner
+        in every ingested scan, from the history database, the tree is not used
+        """
+        iid = self.selected_item
+        if not self.nodes[iid].tree.is_dir(self.nodes[iid].index):
+            iid = self.tree.parent(iid)
+        file_node = self.nodes[iid]
+        owner = file_node.get_selected_owner()
+        rows = []
+        previous = None
+        for scan_time, size in self.history.get_time_series(file_node.path, owner):
+            delta = "" if previous is None else "{:+.3f}".format((size - previous) * self.const_multiplier)
+            rows.append((self.history.format_time(scan_time), "{:.3f}".format(size * self.const_multiplier), delta))
+            previous = size
+        if not rows:
+            self.logger.warning("{} has no history for owner {}".format(file_node.path, owner))
+            return
+        self.show_table("History - {}".format(file_node.path), "Owned by {}".format(owner),
+                ("Scan time", "Size(MB)", "Δ Size(MB)"), rows)
+
+    def show_growers(self):
+        """
+        The folders which grew the most for the selected owner in the last HISTORY_DAYS days,
+        from the history database
+        """
+        root_file = self.full_root_file
+        owner = root_file.get_selected_owner()
+        growers = self.history.get_top_growers(owner, self.history_days, self.max_children_rows, root_file.path)
+        if growers["from"] is None:
+            self.logger.warning("{} has no history for owner {}".format(root_file.path, owner))
+            return
+        rows = [(path, "{:+.3f}".format((new_size - old_size) * self.const_multiplier),
+                 "{:.3f}".format(old_size * self.const_multiplier), "{:.3f}".format(new_size * self.const_multiplier))
+                for path, old_size, new_size in growers["growers"]]
+        self.show_table("Top growers - {}".format(root_file.path), "Owned by {}, from {} to {}".format(
+                owner, self.history.format_time(growers["from"]), self.history.format_time(growers["to"])),
+                ("Folder", "Δ Size(MB)", "Old size(MB)", "Size(MB)"), rows)
+
+    def show_file_info(self):
+        f_path = self.selected_item
+        win = tk.Toplevel()
+        win.wm_title("File Info - {}".format(f_path))
+        info_list =["{}", "Size: {} B", "Modfied: {}", "Owner: {}"]
+        info_str = "\n\t".join(info_list)
+        
+        size = os.path.getsize(f_path)
+        m_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(os.path.getmtime(f_path)))
+        owner = Path(f_path).owner()
+
+        info_str = info_str.format(f_path, size, m_time, owner)        
+        f_info_text = tk.Text(win, bg="white")
+        f_info_text.insert(1.0, info_str)
+        f_info_text["state"] = "disabled"        
+        f_info_text.configure(height=len(info_str.split("\n")))
+        f_info_text.grid(row=1, column=1, padx=10, pady=10)
+        
+        # Button for closing
+        close_button = tk.Button(win, text="Close", command=win.destroy)
+        close_button.grid(row=3, column=1, padx=10, pady=10)
+        
+        win.columnconfigure(0, weight=3)
+        win.columnconfigure(1, weight=10)
+        win.columnconfigure(2, weight=3)
+        win.rowconfigure(0, weight=1)
+        win.rowconfigure(1, weight=10)
+        win.rowconfigure(2, weight=1)
+
+
+    def do_popup(self, event):
+    # display the popup menu for tree view
+        try:
+            self.selected_item = self.tree.identify_row(event.y)            
+            # placeholder and "load more" rows are not files
+            if self.selected_item not in self.nodes:
+                return
+            state = "disabled" if self.is_merged() else "normal"
+            for entry in self.path_menu_entries:
+                self.popup_menu.entryconfigure(entry, state = state)
+            self.popup_menu.tk_popup(event.x_root, event.y_root)
+        
+        finally:
+            # make sure to release the grab (Tk 8.0a1 only)
+            self.popup_menu.grab_release()